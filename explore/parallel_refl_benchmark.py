@@ -0,0 +1,77 @@
+"""
+Scaling of the threaded numba reflectivity kernel.
+
+Times reflectivity_amplitude from the serial numba backend against the
+numba_parallel backend over a range of kz point counts and layer counts,
+printing the time per call and the speedup for each thread count.
+
+Usage::
+
+    python explore/parallel_refl_benchmark.py [--threads 1,2,4,8] [--repeat 5]
+"""
+
+import argparse
+import importlib
+import time
+
+import numpy as np
+
+from refl1d.backends import BACKEND_MODULE_NAMES
+
+
+def make_model(nlayers, npoints, seed=1):
+    rng = np.random.default_rng(seed)
+    depth = rng.uniform(5, 200, nlayers)
+    depth[0] = depth[-1] = 0.0
+    sigma = rng.uniform(0, 10, nlayers - 1)
+    rho = rng.uniform(-1, 8, (1, nlayers))
+    irho = rng.uniform(0, 0.1, (1, nlayers)) + 1e-30
+    kz = np.linspace(0.001, 0.15, npoints)
+    rho_index = np.zeros(npoints, "i")
+    r = np.empty(npoints, "D")
+    return depth, sigma, rho, irho, kz, rho_index, r
+
+
+def time_kernel(kernel, args, repeat):
+    kernel(*args)  # warm up the threads and any lazy compilation
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kernel(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=str, default="", help="comma separated thread counts (default: 1,2,4,...)")
+    parser.add_argument("--points", type=str, default="1000,10000,100000", help="comma separated kz point counts")
+    parser.add_argument("--layers", type=str, default="10,100,1000", help="comma separated layer counts")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timings per case (best is reported)")
+    opts = parser.parse_args()
+
+    serial = importlib.import_module(BACKEND_MODULE_NAMES["numba"])
+    parallel = importlib.import_module(BACKEND_MODULE_NAMES["numba_parallel"])
+    max_threads = parallel.numba.config.NUMBA_NUM_THREADS
+    if opts.threads:
+        threads = [int(v) for v in opts.threads.split(",")]
+    else:
+        threads = [1 << k for k in range(max_threads.bit_length()) if 1 << k <= max_threads]
+    points = [int(v) for v in opts.points.split(",")]
+    layers = [int(v) for v in opts.layers.split(",")]
+
+    print("%8s %8s %12s" % ("layers", "points", "serial (ms)") + "".join(" %10s" % f"{n} thr" for n in threads))
+    for nlayers in layers:
+        for npoints in points:
+            args = make_model(nlayers, npoints)
+            base = time_kernel(serial.reflectivity_amplitude, args, opts.repeat)
+            speedup = []
+            for n in threads:
+                parallel.set_num_threads(n)
+                speedup.append(base / time_kernel(parallel.reflectivity_amplitude, args, opts.repeat))
+            print("%8d %8d %12.3f" % (nlayers, npoints, 1e3 * base) + "".join(" %9.2fx" % s for s in speedup))
+    parallel.set_num_threads(None)
+
+
+if __name__ == "__main__":
+    main()
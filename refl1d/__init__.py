@@ -25,7 +25,7 @@ except ImportError:
     __version__ = "unknown"
 
 
-BACKEND_NAMES = Literal["numba", "c_ext", "python"]
+BACKEND_NAMES = Literal["numba", "numba_parallel", "c_ext", "numpy", "python"]
 BACKEND_NAME: BACKEND_NAMES = os.environ.get("REFL1D_BACKEND", "numba")
 
 
@@ -10,6 +10,8 @@ from . import BACKEND_NAME, BACKEND_NAMES
 BACKEND_MODULE_NAMES = {
     "c_ext": "refl1d.reflmodule",
     "numba": "refl1d.lib.numba",
+    "numba_parallel": "refl1d.lib.numba.parallel",
+    "numpy": "refl1d.lib.numpy",
     "python": "refl1d.lib.python",
 }
 
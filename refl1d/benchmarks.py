@@ -0,0 +1,334 @@
+"""
+Benchmarks for the reflectometry backend kernels.
+
+Times the kernels exported by each backend in
+:data:`refl1d.backends.BACKEND_MODULE_NAMES` over a sweep of layer counts,
+Q point counts and oversampling factors, for both non-magnetic and
+magnetic reflectivity.  Results can be saved as JSON and compared against
+a previous run to flag regressions.
+
+Usage::
+
+    python -m refl1d.benchmarks --output bench.json
+    python -m refl1d.benchmarks --baseline bench.json --tolerance 0.25
+    refl1d benchmark --backend numba,python --kernel reflectivity_amplitude
+
+The best of *repeat* timings is reported for each case.  Within each
+kernel and backend the cases are run in order of increasing size, and
+once a single call takes longer than *timeout* seconds the larger cases
+are skipped, so the slow backends do not take forever.  Backends which
+cannot be imported (such as an unbuilt c_ext) are skipped.
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from . import __version__
+from .backends import BACKEND_MODULE_NAMES
+
+# Sweep values for the full and --quick runs.
+SWEEP = {
+    "layers": (10, 100, 1000),
+    "points": (100, 1000, 10000),
+    "oversampling": (1, 5, 20),
+}
+QUICK_SWEEP = {
+    "layers": (10, 100),
+    "points": (100, 1000),
+    "oversampling": (1, 5),
+}
+
+
+def _slabs(layers, rng):
+    depth = rng.uniform(5, 200, layers)
+    depth[0] = depth[-1] = 0.0
+    sigma = rng.uniform(0, 10, layers - 1)
+    rho = rng.uniform(-1, 8, (1, layers))
+    irho = rng.uniform(0, 0.1, (1, layers)) + 1e-30
+    return depth, sigma, rho, irho
+
+
+def _kz(points, oversampling):
+    return np.linspace(-0.01, 0.15, points * oversampling)
+
+
+def reflectivity_amplitude_case(layers, points, oversampling, rng):
+    depth, sigma, rho, irho = _slabs(layers, rng)
+    kz = _kz(points, oversampling)
+    return (depth, sigma, rho, irho, kz, np.zeros(kz.shape, "i"), np.empty(kz.shape, "D"))
+
+
+def magnetic_amplitude_case(layers, points, oversampling, rng):
+    depth, sigma, rho, irho = _slabs(layers, rng)
+    kz = _kz(points, oversampling)
+    rhoM = rng.uniform(0, 2, layers)
+    rhoM[0] = rhoM[-1] = 0.0
+    thetaM = np.radians(rng.uniform(0, 360, layers))
+    # Use the python version for u1, u3 so that the inputs do not depend
+    # on the backend being timed.
+    from .lib.python import calculate_u1_u3
+
+    u1, u3 = np.empty(layers, "D"), np.empty(layers, "D")
+    calculate_u1_u3(0.0, rhoM, thetaM, 270.0, u1, u3)
+    R = [np.empty(kz.shape, "D") for _ in range(4)]
+    return (depth, sigma, rho[0], irho[0], rhoM, u1, u3, kz, np.zeros(kz.shape, "i"), *R)
+
+
+def _resolution(points, oversampling):
+    x = np.linspace(0.005, 0.3, points)
+    dx = 0.01 * x + 0.001
+    xin = np.linspace(0.0, 0.31, points * oversampling)
+    yin = np.exp(-20 * xin) * (1 + 0.5 * np.cos(200 * xin))
+    return xin, yin, x, dx
+
+
+def convolve_gaussian_case(points, oversampling, rng):
+    xin, yin, x, dx = _resolution(points, oversampling)
+    return (xin, yin, x, dx, np.empty(x.shape))
+
+
+def convolve_sampled_case(points, oversampling, rng):
+    xin, yin, x, dx = _resolution(points, oversampling)
+    xp = np.linspace(-3, 3, 31)
+    yp = np.exp(-0.5 * xp**2)
+    return (xin, yin, xp, yp, x, dx, np.empty(x.shape))
+
+
+def build_profile_case(layers, points, rng):
+    z = np.linspace(-50, 25 * layers, points)
+    offset = np.cumsum(rng.uniform(5, 40, layers - 1))
+    roughness = rng.uniform(0, 10, layers - 1)
+    value = rng.uniform(-1, 8, (2, layers))
+    contrast = np.diff(value, axis=1).ravel()
+    return (z, offset, roughness, contrast, value[:, 0].copy(), np.zeros(2 * points))
+
+
+def contract_by_area_case(layers, rng):
+    # Microslabs from a smooth profile, with a rough interface every 50 slices.
+    w = np.full(layers, 0.5)
+    sigma = np.zeros(layers - 1)
+    sigma[::50] = 3.0
+    rho = np.cumsum(rng.normal(0, 0.05, layers))
+    irho = np.abs(np.cumsum(rng.normal(0, 0.005, layers)))
+    return (w, sigma, rho, irho, 0.1)
+
+
+def rebin_counts_case(points, oversampling, rng):
+    xold = np.linspace(0, 1, points * oversampling + 1)
+    Iold = rng.uniform(0, 100, points * oversampling)
+    xnew = np.linspace(0, 1, points + 1)
+    return (xold, Iold, xnew, np.empty(points))
+
+
+# Kernel name => (case builder, sweep parameters).  The builder is called with
+# the sweep values and a random generator and returns the kernel arguments.
+KERNELS = {
+    "reflectivity_amplitude": (reflectivity_amplitude_case, ("layers", "points", "oversampling")),
+    "magnetic_amplitude": (magnetic_amplitude_case, ("layers", "points", "oversampling")),
+    "convolve_gaussian": (convolve_gaussian_case, ("points", "oversampling")),
+    "convolve_sampled": (convolve_sampled_case, ("points", "oversampling")),
+    "build_profile": (build_profile_case, ("layers", "points")),
+    "contract_by_area": (contract_by_area_case, ("layers",)),
+    "rebin_counts": (rebin_counts_case, ("points", "oversampling")),
+}
+
+# Arguments which are modified in place by the kernel and must be restored
+# before each call.
+_INPLACE = {"contract_by_area": (0, 1, 2, 3)}
+
+
+def _cases(kernel, sweep):
+    """
+    Sweep values for *kernel* in order of increasing work.
+    """
+    names = KERNELS[kernel][1]
+    grids = np.meshgrid(*[sweep[name] for name in names], indexing="ij")
+    cases = [dict(zip(names, (int(v) for v in values))) for values in zip(*(g.ravel() for g in grids))]
+    return sorted(cases, key=lambda case: np.prod(list(case.values())))
+
+
+def load_backend(name):
+    """
+    Return the backend module for *name*, or None if it is unavailable.
+    """
+    try:
+        return importlib.import_module(BACKEND_MODULE_NAMES[name])
+    except ImportError:
+        return None
+
+
+def time_call(fn, args, repeat=5, inplace=()):
+    """
+    Best time of *repeat* calls of fn(\\*args), after one warm-up call
+    which also triggers any lazy compilation.
+    """
+    saved = [args[k].copy() for k in inplace]
+
+    def call():
+        for k, v in zip(inplace, saved):
+            args[k][:] = v
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+
+    call()
+    return min(call() for _ in range(max(repeat, 1)))
+
+
+def run(backends=None, kernels=None, sweep=None, repeat=5, timeout=2.0, seed=1, log=None):
+    """
+    Run the benchmarks, returning a list of result records.
+
+    *backends* and *kernels* are lists of names, defaulting to all of
+    :data:`refl1d.backends.BACKEND_MODULE_NAMES` and :data:`KERNELS`.
+    *sweep* maps parameter names to the values to try, defaulting to
+    :data:`SWEEP`.
+
+    Each record is a dict with *backend*, *kernel* and the sweep
+    parameters, along with *time* in seconds, or *skipped* with the
+    reason the case was not run.
+    """
+    backends = list(BACKEND_MODULE_NAMES) if backends is None else backends
+    kernels = list(KERNELS) if kernels is None else kernels
+    sweep = dict(SWEEP, **(sweep or {}))
+    results = []
+    for backend_name in backends:
+        backend = load_backend(backend_name)
+        for kernel in kernels:
+            fn = getattr(backend, kernel, None) if backend is not None else None
+            too_slow = False
+            for case in _cases(kernel, sweep):
+                record = dict(backend=backend_name, kernel=kernel, **case)
+                if backend is None:
+                    record["skipped"] = "backend unavailable"
+                elif fn is None:
+                    record["skipped"] = "kernel not provided by backend"
+                elif too_slow:
+                    record["skipped"] = "timeout"
+                else:
+                    builder = KERNELS[kernel][0]
+                    args = builder(**case, rng=np.random.default_rng(seed))
+                    t = time_call(fn, args, repeat=repeat, inplace=_INPLACE.get(kernel, ()))
+                    record["time"] = t
+                    too_slow = t > timeout
+                results.append(record)
+                if log is not None:
+                    log(format_record(record))
+    return results
+
+
+def format_record(record):
+    params = " ".join("%s=%d" % (k, record[k]) for k in ("layers", "points", "oversampling") if k in record)
+    if "time" in record:
+        outcome = "%10.3f ms" % (1e3 * record["time"])
+    else:
+        outcome = "   skipped (%s)" % record["skipped"]
+    return "%-14s %-24s %-38s %s" % (record["backend"], record["kernel"], params, outcome)
+
+
+def _key(record):
+    return tuple((k, record[k]) for k in ("backend", "kernel", "layers", "points", "oversampling") if k in record)
+
+
+def compare(results, baseline, tolerance=0.2, min_time=1e-4):
+    """
+    Compare *results* against *baseline* results from a previous run.
+
+    Returns a list of (record, baseline time, ratio) for each case which
+    is slower by more than a factor of 1 + *tolerance*.  Cases which take
+    less than *min_time* seconds in both runs are ignored since they are
+    dominated by timer noise.
+    """
+    previous = {_key(r): r["time"] for r in baseline if "time" in r}
+    regressions = []
+    for record in results:
+        old = previous.get(_key(record), None)
+        if old is None or "time" not in record:
+            continue
+        if max(old, record["time"]) < min_time:
+            continue
+        ratio = record["time"] / old
+        if ratio > 1 + tolerance:
+            regressions.append((record, old, ratio))
+    return regressions
+
+
+def save(results, filename):
+    """
+    Save *results* as JSON along with a description of the system.
+    """
+    data = {
+        "refl1d": __version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "results": results,
+    }
+    with open(filename, "w") as fid:
+        json.dump(data, fid, indent=2)
+
+
+def load(filename):
+    """
+    Load results saved by :func:`save`.
+    """
+    with open(filename) as fid:
+        return json.load(fid)["results"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="refl1d benchmark",
+        description="Time the refl1d backend kernels.",
+    )
+    parser.add_argument("--backend", type=str, default="", help="comma separated backends (default: all)")
+    parser.add_argument("--kernel", type=str, default="", help="comma separated kernels (default: all)")
+    parser.add_argument("--quick", action="store_true", help="run a reduced sweep")
+    for name in SWEEP:
+        parser.add_argument("--" + name, type=str, default="", help="comma separated %s values" % name)
+    parser.add_argument("--repeat", type=int, default=5, help="number of timings per case (best is reported)")
+    parser.add_argument("--timeout", type=float, default=2.0, help="skip larger cases after a call takes this long")
+    parser.add_argument("--output", type=str, default="", help="save results to this JSON file")
+    parser.add_argument("--baseline", type=str, default="", help="compare against results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional slowdown from baseline")
+    opts = parser.parse_args(argv)
+
+    sweep = dict(QUICK_SWEEP if opts.quick else SWEEP)
+    for name in SWEEP:
+        value = getattr(opts, name)
+        if value:
+            sweep[name] = tuple(int(v) for v in value.split(","))
+    results = run(
+        backends=opts.backend.split(",") if opts.backend else None,
+        kernels=opts.kernel.split(",") if opts.kernel else None,
+        sweep=sweep,
+        repeat=opts.repeat,
+        timeout=opts.timeout,
+        log=print,
+    )
+    if opts.output:
+        save(results, opts.output)
+    if opts.baseline:
+        regressions = compare(results, load(opts.baseline), tolerance=opts.tolerance)
+        for record, old, ratio in regressions:
+            print(
+                "REGRESSION %s: %.3f ms -> %.3f ms (%.2fx)"
+                % (format_record(record), 1e3 * old, 1e3 * record["time"], ratio)
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,7 @@ varying parameter.  Multi-parameter dispersion models are not available.
 from bumps.parameter import Parameter
 import numpy as np
 
-from .experiment import ExperimentBase
+from .experiment import ExperimentBase, _reflamp_models, _slab_values
 
 
 class Weights(object):
@@ -104,8 +104,15 @@ class DistributionExperiment(ExperimentBase):
     from the coherent sum rather than the incoherent sum.
 
     See :class:`Weights` for a description of how to set up the distribution.
+
+    The slabs for all distribution values are rendered before computing
+    the reflectivity amplitudes, which are then evaluated together rather
+    than one value at a time.  Set *batch* to False on the instance to
+    compute each value separately.
     """
 
+    batch = True
+
     def __init__(self, experiment=None, P=None, distribution=None, coherent=False):
         self.P = P
         self.distribution = distribution
@@ -126,9 +133,15 @@ class DistributionExperiment(ExperimentBase):
     def reflectivity(self, resolution=True, interpolation=0):
         key = ("reflectivity", resolution, interpolation)
         if key not in self._cache:
-            calc_R = 0
-            for x, w in self.distribution:
-                if w > 0:
+            bins = [(x, w) for x, w in self.distribution if w > 0]
+            amplitudes = self._reflamp_batch([x for x, _ in bins]) if self.batch else None
+            if amplitudes is not None:
+                Qx, r = amplitudes
+                weights = np.array([w for _, w in bins])
+                calc_R = abs(weights @ r) ** 2 if self.coherent else weights @ (abs(r) ** 2)
+            else:
+                calc_R = 0
+                for x, w in bins:
                     self.P.value = x
                     self.experiment.update()
                     Qx, Rx = self.experiment._reflamp()
@@ -136,17 +149,61 @@ class DistributionExperiment(ExperimentBase):
                         calc_R += w * Rx
                     else:
                         calc_R += w * abs(Rx) ** 2
-            if self.coherent:
-                calc_R = abs(calc_R) ** 2
+                if self.coherent:
+                    calc_R = abs(calc_R) ** 2
             Q, R = self.probe.apply_beam(Qx, calc_R, resolution=resolution, interpolation=interpolation)
             self._cache[key] = Q, R
         return self._cache[key]
 
+    def _reflamp_batch(self, values):
+        """
+        Reflectivity amplitudes for each value of *P* in *values*.
+
+        The slabs are rendered for every value first, then the amplitudes
+        are computed together with :func:`refl1d.experiment._reflamp_models`.
+
+        Returns (calc_Q, r) with r of shape (len(values), len(calc_Q)), or
+        None if the amplitudes must be computed one value at a time, as for
+        magnetic or repeated slabs or if *P* changes calc_Q.
+        """
+        experiment = self.experiment
+        if not values or not hasattr(experiment, "_render_slabs"):
+            return None
+        calc_q, slabs_k = None, []
+        for x in values:
+            self.P.value = x
+            experiment.update()
+            slabs = experiment._render_slabs()
+            if slabs.ismagnetic or slabs.repeats is not None or len(slabs.rho) != 1:
+                return None
+            if calc_q is None:
+                calc_q = experiment.probe.calc_Q
+            elif not np.array_equal(calc_q, experiment.probe.calc_Q):
+                return None
+            # Copy the values since the microslab storage is reused.
+            slabs_k.append(_slab_values(slabs))
+        return calc_q, _reflamp_models(calc_q, slabs_k, experiment.partial_cache_limit)
+
     def _max_P(self):
         x, w = zip(*self.distribution)
         idx = np.argmax(w)
         return x[idx]
 
+    def film_thickness(self):
+        """
+        Largest film thickness over the values of *P* in the distribution,
+        since the thickest film has the most closely spaced fringes.
+        """
+        values = [x for x, w in self.distribution if w > 0]
+        if not values:
+            return self.experiment.film_thickness()
+        thickness = 0.0
+        for x in values:
+            self.P.value = x
+            self.experiment.update()
+            thickness = max(thickness, self.experiment.film_thickness())
+        return thickness
+
     def smooth_profile(self, dz=1):
         """
         Compute a density profile for the material
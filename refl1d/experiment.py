@@ -17,7 +17,7 @@ from warnings import warn
 import numpy as np
 from bumps import parameter
 from bumps.dream.state import MCMCDraw
-from bumps.fitproblem import Fitness, FitProblem
+from bumps.fitproblem import Fitness, FitProblem, fit_parameters
 from bumps.parameter import Parameter, tag_all
 
 from . import __version__
@@ -25,6 +25,10 @@ from .sample.reflectivity import (
     BASE_GUIDE_ANGLE as DEFAULT_THETA_M,
     magnetic_amplitude as reflmag,
     reflectivity_amplitude as reflamp,
+    reflectivity_amplitude_batch as reflamp_batch,
+    reflectivity_amplitude_cache as reflamp_cache,
+    reflectivity_amplitude_gradient as reflamp_gradient,
+    reflectivity_amplitude_update as reflamp_update,
 )
 from . import profile
 from .probe.probe import PolarizedNeutronProbe, Probe
@@ -47,6 +51,7 @@ class ExperimentBase:
     probe = None  # type: Optional[Probe]
     interpolation = 0
     _probe_cache = None
+    _slabs = None
     _substrate = None
     _surface = None
     _webview_plots: dict[str, WebviewPlotInfo]
@@ -75,6 +80,25 @@ class ExperimentBase:
     def plot_profile(self, plot_shift=0.0):
         raise NotImplementedError()
 
+    def film_thickness(self):
+        """
+        Total thickness of the layers between the substrate and the surface.
+        """
+        raise NotImplementedError()
+
+    def adaptive_oversample(self, tolerance=0.05, max_oversampling=201, seed=1):
+        """
+        Oversample the probe to resolve the Kiessig fringes of the model.
+
+        The film thickness is taken from the current parameter values, so
+        call this again if the thickness changes substantially during the
+        fit.  See :meth:`refl1d.probe.Probe.adaptive_oversample`.
+        """
+        self.probe.adaptive_oversample(
+            self.film_thickness(), tolerance=tolerance, max_oversampling=max_oversampling, seed=seed
+        )
+        self.update()
+
     def format_parameters(self):
         p = self.parameters()
         print(parameter.format(p))
@@ -86,7 +110,9 @@ class ExperimentBase:
         when an existing chemical formula is modified; new and
         deleted formulas will be handled automatically.
         """
-        self._probe_cache.reset()
+        self._probe_cache.clear()
+        if self._slabs is not None:
+            self._slabs.clear_cache()
         self.update()
 
     def is_reset(self):
@@ -114,15 +140,7 @@ class ExperimentBase:
             # compare against so that we can profile simulation code, and
             # so that simulation smoke tests are run more thoroughly.
             QR = self.reflectivity()
-            if (self.probe.polarized and all(x is None or x.R is None for x in self.probe.xs)) or (
-                not self.probe.polarized and self.probe.R is None
-            ):
-                resid = np.zeros(0)
-            else:
-                if self.probe.polarized:
-                    resid = np.hstack([(xs.R - QRi[1]) / xs.dR for xs, QRi in zip(self.probe.xs, QR) if xs is not None])
-                else:
-                    resid = (self.probe.R - QR[1]) / self.probe.dR
+            resid = self._residuals(QR)
             self._cache["residuals"] = resid
             # print(("%12s "*4)%("Q", "R", "dR", "Rtheory"))
             # print("\n".join(("%12.6e "*4)%el for el in zip(QR[0], self.probe.R, self.probe.dR, QR[1]))
@@ -130,6 +148,73 @@ class ExperimentBase:
 
         return self._cache["residuals"]
 
+    def _residuals(self, QR):
+        """
+        Residuals for the theory *QR* returned from :meth:`reflectivity`.
+        """
+        if (self.probe.polarized and all(x is None or x.R is None for x in self.probe.xs)) or (
+            not self.probe.polarized and self.probe.R is None
+        ):
+            return np.zeros(0)
+        if self.probe.polarized:
+            return np.hstack([(xs.R - QRi[1]) / xs.dR for xs, QRi in zip(self.probe.xs, QR) if xs is not None])
+        return (self.probe.R - QR[1]) / self.probe.dR
+
+    def residuals_jacobian(self, parameters=None, step=1e-6):
+        """
+        Return the forward difference derivatives of the residuals with
+        respect to the parameters.
+
+        *parameters* defaults to the fitted parameters of the experiment in
+        the order returned by :func:`bumps.fitproblem.fit_parameters`.  The
+        result *J* has one row for each residual and one column for each
+        parameter, with J[i, j] the derivative of residual i with respect
+        to parameter j.
+
+        Each column is a forward difference with a step of *step* times the
+        parameter value (or *step* if the value is zero), so the profile is
+        rendered and the beam is applied once for each parameter, as for any
+        finite difference.  What is saved is the reflectivity calculation:
+        if the model can compute the derivatives of the reflectivity with
+        respect to the slab profile, the reflectivity is linearized about the
+        current point using :func:`refl1d.sample.reflectivity.reflectivity_amplitude_gradient`
+        and only computed once.  Otherwise the model is evaluated in full for
+        each parameter.  The parameter values are restored on return.
+        """
+        if parameters is None:
+            parameters = fit_parameters(self)
+        resid = self.residuals()
+        linearized = self._linearized_residuals()
+        saved = [p.value for p in parameters]
+        J = np.empty((len(resid), len(parameters)))
+        try:
+            for j, p in enumerate(parameters):
+                h = step * abs(saved[j]) if saved[j] != 0 else step
+                p.value = saved[j] + h
+                self.update()
+                resid_h = linearized() if linearized is not None else None
+                if resid_h is None:
+                    resid_h = self.residuals()
+                J[:, j] = (resid_h - resid) / h
+                p.value = saved[j]
+        finally:
+            for p, v in zip(parameters, saved):
+                p.value = v
+            self.update()
+        return J
+
+    def _linearized_residuals(self):
+        """
+        Return a function which computes the residuals at the current
+        parameter values from the reflectivity linearized about the model
+        at the time of the call.  The function returns None if the
+        linearization does not apply, such as when the rendered profile
+        has a different number of slabs.
+
+        Returns None if the model does not support linearization.
+        """
+        return None
+
     def numpoints(self):
         if self.probe.polarized:
             return sum(len(xs.Q) for xs in self.probe.xs if xs is not None)
@@ -391,6 +476,14 @@ class Experiment(ExperimentBase):
     version: str
 
     profile_shift = 0
+    # Keep the partial transfer matrix products between evaluations, so
+    # that numerical derivatives only recompute the changed slabs.  Set
+    # partial_cache = True on the instance to enable.
+    partial_cache = False
+    # Largest partial product cache (in bytes) kept for incremental updates.
+    partial_cache_limit = 1 << 27
+    _partial = None
+    _last_slabs = None
 
     def __init__(
         self,
@@ -435,6 +528,14 @@ class Experiment(ExperimentBase):
             tag_all(self.sample.parameters(), "sample")
         self._webview_plots = {}
 
+    def __getstate__(self):
+        # The partial products are large and are rebuilt on demand, so leave
+        # them out of copies and of the models sent to worker processes.
+        state = self.__dict__.copy()
+        state.pop("_partial", None)
+        state.pop("_last_slabs", None)
+        return state
+
     @property
     def ismagnetic(self):
         """True if experiment contains magnetic materials"""
@@ -487,9 +588,12 @@ class Experiment(ExperimentBase):
                     Aguide=Aguide,
                     H=H,
                     sigma=sigma,
+                    repeats=slabs.repeats,
                 )
             else:
-                calc_r = reflamp(-calc_q / 2, depth=w, rho=rho, irho=irho, sigma=sigma)
+                calc_r = None if slabs.repeats is not None else self._reflamp_partial(calc_q, slabs)
+                if calc_r is None:
+                    calc_r = reflamp(-calc_q / 2, depth=w, rho=rho, irho=irho, sigma=sigma, repeats=slabs.repeats)
             if False and np.isnan(calc_r).any():
                 print("w", w)
                 print("rho", rho)
@@ -510,6 +614,89 @@ class Experiment(ExperimentBase):
             # if np.isnan(calc_r).any(): print("calc_r contains NaN")
         return self._cache[key]
 
+    def _reflamp_partial(self, calc_q, slabs):
+        """
+        Reflectivity amplitude using cached partial products.
+
+        Numerical derivatives evaluate the model at a base point then at
+        a series of points with one parameter changed, each of which
+        usually touches only a few slabs.  When the current slabs differ
+        from the previous model in a narrow range, the partial transfer
+        matrix products for the previous model are saved and reused for
+        this and subsequent models near it, so that only the matrices for
+        the changed slabs need to be recomputed.
+
+        When the optimizer moves on, the saved products no longer match
+        the models being evaluated, so they are rebuilt from the previous
+        model if that is close to the current one.
+
+        This is only used if *partial_cache* is set.  Returns None if the
+        model should be computed in full.
+        """
+        if not self.partial_cache:
+            return None
+        layers = len(slabs.w)
+        if 96 * len(calc_q) * layers > self.partial_cache_limit:
+            return None
+        values = np.vstack((slabs.w, np.hstack((slabs.sigma, 0.0)), slabs.rho, slabs.irho))
+        last, self._last_slabs = self._last_slabs, (calc_q.copy(), values)
+        for base in (self._partial, last):
+            if base is None or base[1].shape != values.shape or not np.array_equal(base[0], calc_q):
+                continue
+            changed = np.flatnonzero((base[1] != values).any(axis=0))
+            if len(changed) == 0:
+                if len(base) > 2:
+                    return base[2].copy()
+                continue
+            first, final = changed[0], changed[-1]
+            if 2 * (final - first + 1) <= layers:
+                break
+        else:
+            return None
+        kz = -calc_q / 2
+        if len(base) == 2:
+            # Build the partial products for the previous model.
+            w, sigma, rho, irho = _split_slab_values(base[1])
+            r, cache = reflamp_cache(kz, depth=w, rho=rho, irho=irho, sigma=sigma)
+            if cache is None:
+                return None
+            base = self._partial = (base[0], base[1], r, cache)
+        w, sigma, rho, irho = _split_slab_values(values)
+        return reflamp_update(base[3], first, final, kz, depth=w, rho=rho, irho=irho, sigma=sigma)
+
+    def _linearized_residuals(self):
+        slabs = self._render_slabs()
+        if slabs.ismagnetic:
+            return None
+        calc_q = self.probe.calc_Q
+        values = _slab_values(slabs)
+        r, dr = reflamp_gradient(-calc_q / 2, depth=slabs.w, rho=slabs.rho, irho=slabs.irho, sigma=slabs.sigma)
+        if dr is None:
+            return None
+        dr_depth, dr_sigma, dr_rho, dr_irho = dr
+        dr_sigma = np.hstack((dr_sigma, np.zeros((len(r), 1))))
+        dr_irho = dr_irho * np.where(slabs.irho[0] < 0, -1.0, 1.0)
+        # Derivative of |r|^2 with respect to each row of the slab values.
+        dR = 2 * np.real(np.conj(r)[:, None, None] * np.stack((dr_depth, dr_sigma, dr_rho, dr_irho), axis=1))
+        R = abs(r) ** 2
+        kz_key = calc_q.tobytes()
+
+        def linearized():
+            slabs = self._render_slabs()
+            calc_q = self.probe.calc_Q
+            if slabs.ismagnetic or calc_q.tobytes() != kz_key:
+                return None
+            delta = _slab_values(slabs)
+            if delta.shape != values.shape:
+                return None
+            delta -= values
+            calc_R = R + np.einsum("ijk,jk->i", dR, delta)
+            if self.probe.polarized:
+                calc_R = _polarized_nonmagnetic(calc_R)
+            return self._residuals(self.probe.apply_beam(calc_q, calc_R))
+
+        return linearized
+
     def amplitude(self, resolution=False, interpolation=0):
         """
         Calculate reflectivity amplitude at the probe points.
@@ -535,6 +722,92 @@ class Experiment(ExperimentBase):
             self._cache[key] = res
         return self._cache[key]
 
+    def reflectivity_batch(self, points, parameters=None, resolution=True, interpolation=0):
+        """
+        Calculate predicted reflectivity for a population of models.
+
+        *points* is an array of shape (population, len(parameters)) with
+        one row of parameter values for each model.  If *parameters* is not
+        given, the fitted parameters of the experiment are used in the order
+        returned by :func:`bumps.fitproblem.fit_parameters`.
+
+        The slab profiles for the whole population are rendered first, then
+        the reflectivity amplitudes are computed with a single call to the
+        batch kernel.  Models which share calc_Q are evaluated together;
+        a fitted *theta_offset* gives each model its own calc_Q.  Magnetic
+        models are evaluated one at a time.
+
+        Returns a list with the result of :meth:`reflectivity` for each
+        model.  The parameter values are restored on return.
+        """
+        if parameters is None:
+            parameters = fit_parameters(self)
+        points = np.atleast_2d(np.asarray(points, "d"))
+        saved = [p.value for p in parameters]
+        try:
+            # Render the slabs for each model, holding on to copies since the
+            # microslab storage is reused for the next model.
+            calc_q, calc_r, groups, slabs_k = [], [], {}, []
+            for k, point in enumerate(points):
+                self._set_point(parameters, point)
+                slabs = self._render_slabs()
+                calc_q.append(self.probe.calc_Q)
+                if slabs.ismagnetic:
+                    calc_r.append(self._reflamp()[1])
+                    slabs_k.append(None)
+                    continue
+                calc_r.append(None)
+                slabs_k.append((slabs.w.copy(), slabs.sigma.copy(), slabs.rho[0].copy(), slabs.irho[0].copy()))
+                groups.setdefault(calc_q[k].tobytes(), []).append(k)
+
+            # Compute the amplitudes for each group of models with shared calc_Q.
+            for index in groups.values():
+                depth, sigma, rho, irho = zip(*(slabs_k[k] for k in index))
+                r = reflamp_batch(-calc_q[index[0]] / 2, depth=depth, rho=rho, irho=irho, sigma=sigma)
+                for k, r_k in zip(index, r):
+                    calc_r[k] = r_k
+
+            # Apply the beam with the probe parameters for each model.
+            results = []
+            for k, point in enumerate(points):
+                self._set_point(parameters, point)
+                calc_R = _amplitude_to_magnitude(
+                    calc_r[k], ismagnetic=slabs_k[k] is None, polarized=self.probe.polarized
+                )
+                results.append(
+                    self.probe.apply_beam(calc_q[k], calc_R, resolution=resolution, interpolation=interpolation)
+                )
+        finally:
+            self._set_point(parameters, saved)
+        return results
+
+    def nllf_batch(self, points, parameters=None):
+        """
+        Return the -log(P(data|model)) for a population of models.
+
+        *points* and *parameters* are as for :meth:`reflectivity_batch`.
+        Returns an array with one value for each row of *points*.  As for
+        :meth:`nllf`, this excludes the sample penalty and any parameter
+        priors.
+        """
+        results = self.reflectivity_batch(points, parameters)
+        if self.probe.polarized:
+            data = [(None, None) if xs is None else (xs.R, xs.dR) for xs in self.probe.xs]
+        else:
+            data = [(self.probe.R, self.probe.dR)]
+            results = [[QR] for QR in results]
+        nllf = np.zeros(len(results))
+        for k, QR in enumerate(results):
+            for (R, dR), QRi in zip(data, QR):
+                if R is not None:
+                    nllf[k] += 0.5 * np.sum(((R - QRi[1]) / dR) ** 2)
+        return nllf
+
+    def _set_point(self, parameters, point):
+        for p, v in zip(parameters, point):
+            p.value = v
+        self.update()
+
     def smooth_profile(self, dz=0.1):
         """
         Return the scattering potential for the sample.
@@ -573,6 +846,9 @@ class Experiment(ExperimentBase):
         slabs = self._render_slabs()
         return (slabs.w, np.hstack((slabs.sigma, 0)), slabs.rho[0], slabs.irho[0])
 
+    def film_thickness(self):
+        return float(np.sum(self._render_slabs().w[1:-1]))
+
     def magnetic_smooth_profile(self, dz=0.1):
         """
         Return the nuclear and magnetic scattering potential for the sample.
@@ -721,6 +997,9 @@ class MixedExperiment(ExperimentBase):
         for p in self.parts:
             p.update()
 
+    def film_thickness(self):
+        return max(p.film_thickness() for p in self.parts)
+
     def parameters(self):
         return {
             "samples": [s.parameters() for s in self.samples],
@@ -741,7 +1020,7 @@ class MixedExperiment(ExperimentBase):
         It all comes out in the wash.
         """
         total = sum(r.value for r in self.ratio)
-        Qs, Rs = zip(*[p._reflamp() for p in self.parts])
+        Qs, Rs = zip(*self._parts_reflamp())
         if not self.coherent:
             Rs = [np.asarray(ri) * np.sqrt(ratio_i.value / total) for ri, ratio_i in zip(Rs, self.ratio)]
         else:  # self.coherent == True
@@ -749,6 +1028,32 @@ class MixedExperiment(ExperimentBase):
         # print("Rs", Rs)
         return Qs[0], Rs
 
+    def _parts_reflamp(self):
+        """
+        Return (calc_Q, calc_r) for each part.
+
+        The parts usually share the substrate and most of the layers, so
+        rather than computing each part separately, the non-magnetic parts
+        are rendered first and their amplitudes are computed together with
+        :func:`_reflamp_models`.  The results are stored in the caches of the
+        parts, so the amplitudes for the individual parts are not recomputed.
+        """
+        pending, values = [], []
+        for p in self.parts:
+            if "calc_r" in p._cache:
+                continue
+            slabs = p._render_slabs()
+            if slabs.ismagnetic or slabs.repeats is not None or len(slabs.rho) != 1:
+                continue
+            pending.append(p)
+            values.append(_slab_values(slabs))
+        if len(pending) > 1:
+            calc_q = pending[0].probe.calc_Q
+            r = _reflamp_models(calc_q, values, min(p.partial_cache_limit for p in pending))
+            for p, r_k in zip(pending, r):
+                p._cache["calc_r"] = calc_q, r_k
+        return [p._reflamp() for p in self.parts]
+
     def amplitude(self, resolution=False):
         """ """
         if not self.coherent:
@@ -877,3 +1182,71 @@ def _amplitude_to_magnitude(r, ismagnetic, polarized):
         if polarized:
             R = _polarized_nonmagnetic(R)
     return R
+
+
+def _split_slab_values(values):
+    """
+    Split the stacked slab values (w, sigma, rho, irho) from
+    :meth:`Experiment._reflamp_partial` into separate arrays.
+    """
+    n = (len(values) - 2) // 2
+    return values[0], values[1, :-1], values[2 : 2 + n], values[2 + n :]
+
+
+def _slab_values(slabs):
+    """
+    Stack the slab values (w, sigma, rho, irho) for the first wavelength
+    into a (4, n) array, padding sigma with zero.
+    """
+    return np.vstack((slabs.w, np.hstack((slabs.sigma, 0.0)), slabs.rho[0], slabs.irho[0]))
+
+
+def _reflamp_models(calc_q, values, cache_limit):
+    """
+    Reflectivity amplitudes for a set of non-magnetic models sharing calc_Q.
+
+    *values* holds the stacked slab values from :func:`_slab_values` for
+    each model.  If the models have the same number of slabs and differ
+    only in a narrow range, such as the thickness of a single layer, the
+    transfer matrix products for the slabs on either side of the range are
+    computed once for the first model and shared by the rest, provided
+    they fit in *cache_limit* bytes.  Otherwise the slabs are padded to a
+    common length and evaluated with a single call to the batch kernel.
+
+    Returns complex[K, M] for K models and M = len(calc_q).
+    """
+    kz = -calc_q / 2
+    r = _reflamp_shared(kz, values, cache_limit)
+    if r is None:
+        w, sigma, rho, irho = zip(*(_split_slab_values(v) for v in values))
+        rho, irho = [v[0] for v in rho], [v[0] for v in irho]
+        r = reflamp_batch(kz, depth=w, rho=rho, irho=irho, sigma=sigma)
+    return r
+
+
+def _reflamp_shared(kz, values, cache_limit):
+    """
+    Amplitudes for the models in *values* using the partial products of the
+    first model, or None if the models differ too widely.
+    """
+    base = values[0]
+    if any(v.shape != base.shape for v in values):
+        return None
+    layers = base.shape[1]
+    changed = np.zeros(layers, bool)
+    for v in values[1:]:
+        changed |= (v != base).any(axis=0)
+    changed = np.flatnonzero(changed)
+    first, final = (changed[0], changed[-1]) if len(changed) else (0, 0)
+    if 2 * (final - first + 1) > layers or 96 * len(kz) * layers > cache_limit:
+        return None
+    w, sigma, rho, irho = _split_slab_values(base)
+    r0, cache = reflamp_cache(kz, depth=w, rho=rho, irho=irho, sigma=sigma)
+    if cache is None:
+        return None
+    r = np.empty((len(values), len(kz)), "D")
+    r[0] = r0
+    for k, v in enumerate(values[1:], 1):
+        w, sigma, rho, irho = _split_slab_values(v)
+        r[k] = reflamp_update(cache, first, final, kz, depth=w, rho=rho, irho=irho, sigma=sigma)
+    return r
@@ -8,6 +8,7 @@
 #include <cmath>
 #include <iostream>
 #include <algorithm>
+#include <vector>
 
 #define GREEDY
 #include <cassert>
@@ -223,6 +224,82 @@ contract_by_area(int n, double d[], double sigma[],
   return newi;
 }
 
+/* Like contract_by_area, but with nprobe rows of rho and irho stored
+ * row by row.  Slices are only joined if they fit within dA for every
+ * row, so all rows share the same layer boundaries.
+ */
+extern "C"
+int
+contract_by_area_multi(int n, int nprobe, double d[], double sigma[],
+                       double rho[], double irho[], double dA)
+{
+  double dz;
+  std::vector<double> rholo(nprobe), rhohi(nprobe), rhoarea(nprobe);
+  std::vector<double> irholo(nprobe), irhohi(nprobe), irhoarea(nprobe);
+  int i, k, newi;
+  bool fits;
+  i=newi=1; /* Skip the substrate */
+  while (i < n) {
+
+    /* Get ready for the next layer */
+    dz = 0.;
+    for (k=0; k < nprobe; k++) {
+      rhoarea[k] = irhoarea[k] = 0.;
+      rholo[k] = rhohi[k] = rho[k*n+i];
+      irholo[k] = irhohi[k] = irho[k*n+i];
+    }
+
+    /* Accumulate slices into layer */
+    for (;;) {
+      assert(i < n);
+      /* Accumulate next slice */
+      dz += d[i];
+      for (k=0; k < nprobe; k++) {
+        rhoarea[k] += d[i]*rho[k*n+i];
+        irhoarea[k] += d[i]*irho[k*n+i];
+      }
+
+      /* If no more slices or sigma != 0, break immediately */
+      if (++i == n || sigma[i-1] != 0.) break;
+
+      /* If next slice won't fit at any wavelength, break */
+      fits = true;
+      for (k=0; k < nprobe && fits; k++) {
+        const double r = rho[k*n+i], ir = irho[k*n+i];
+        if (r < rholo[k]) rholo[k] = r;
+        if (r > rhohi[k]) rhohi[k] = r;
+        if (ir < irholo[k]) irholo[k] = ir;
+        if (ir > irhohi[k]) irhohi[k] = ir;
+        if ((rhohi[k]-rholo[k])*(dz+d[i]) > dA
+            || (irhohi[k]-irholo[k])*(dz+d[i]) > dA) fits = false;
+      }
+      if (!fits) break;
+    }
+
+    /* Save the layer */
+    assert(newi < n);
+    d[newi] = dz;
+    if (i == n) {
+      /* Last layer uses surface values */
+      for (k=0; k < nprobe; k++) {
+        rho[k*n+newi] = rho[k*n+n-1];
+        irho[k*n+newi] = irho[k*n+n-1];
+      }
+      /* No interface for final layer */
+    } else {
+      /* Middle layers uses average values */
+      for (k=0; k < nprobe; k++) {
+        rho[k*n+newi] = rhoarea[k] / dz;
+        irho[k*n+newi] = irhoarea[k] / dz;
+      }
+      sigma[newi] = sigma[i-1];
+    }
+    newi++;
+  }
+
+  return newi;
+}
+
 extern "C"
 int
 contract_mag(int n, double d[], double sigma[],
@@ -255,6 +255,35 @@ PyObject* Pcontract_by_area(PyObject*obj,PyObject*args)
   return Py_BuildValue("i",newlen);
 }
 
+PyObject* Pcontract_by_area_multi(PyObject*obj,PyObject*args)
+{
+  PyObject *d_obj,*rho_obj,*irho_obj,*sigma_obj;
+  Py_ssize_t nd, nrho, nirho, nsigma;
+  double *d, *sigma, *rho, *irho;
+  double dA;
+  DECLARE_VECTORS(4);
+
+  if (!PyArg_ParseTuple(args, "OOOOd:contract_by_area_multi",
+      &d_obj,&sigma_obj,&rho_obj,&irho_obj,&dA))
+    return NULL;
+  INVECTOR(d_obj,d,nd);
+  INVECTOR(sigma_obj,sigma,nsigma);
+  INVECTOR(rho_obj,rho,nrho);
+  INVECTOR(irho_obj,irho,nirho);
+  // rho and irho have a row of length nd for each wavelength;
+  // interfaces should be one shorter than layers
+  if (nd == 0 || nrho%nd != 0 || nrho != nirho || nd != nsigma+1) {
+#ifndef BROKEN_EXCEPTIONS
+    PyErr_SetString(PyExc_ValueError, "d,rho,mu,sigma have different lengths");
+#endif
+    FREE_VECTORS();
+    return NULL;
+  }
+  int newlen = contract_by_area_multi((int)nd, (int)(nrho/nd), d, sigma, rho, irho, dA);
+  FREE_VECTORS();
+  return Py_BuildValue("i",newlen);
+}
+
 PyObject* Pcontract_mag(PyObject*obj,PyObject*args)
 {
   PyObject *d_obj,*rho_obj,*irho_obj,*rhoM_obj,*thetaM_obj,*sigma_obj;
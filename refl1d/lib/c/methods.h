@@ -77,6 +77,7 @@ PyObject* Pcalculate_u1_u3(PyObject* obj, PyObject* args);
 PyObject* Palign_magnetic(PyObject *obj, PyObject *args);
 PyObject* Pcontract_by_step(PyObject*obj,PyObject*args);
 PyObject* Pcontract_by_area(PyObject*obj,PyObject*args);
+PyObject* Pcontract_by_area_multi(PyObject*obj,PyObject*args);
 PyObject* Pcontract_mag(PyObject*obj,PyObject*args);
 PyObject* Pconvolve_gaussian(PyObject*obj,PyObject*args);
 PyObject* Pconvolve_uniform(PyObject*obj,PyObject*args);
@@ -152,6 +152,10 @@ int
 contract_by_area(int n, double d[], double sigma[],
                  double rho[], double irho[], double dA);
 
+int
+contract_by_area_multi(int n, int nprobe, double d[], double sigma[],
+                       double rho[], double irho[], double dA);
+
 int
 contract_mag(int n, double d[], double sigma[], double rho[], double irho[],
              double rhoM[], double thetaM[], double dA);
@@ -103,6 +103,11 @@ static PyMethodDef methods[] = {
 	 METH_VARARGS,
 	 "contract_by_area(d,sigma,rho,irho,dA): join layers in microstep profile, keeping error under control"},
 
+	{"contract_by_area_multi",
+	 Pcontract_by_area_multi,
+	 METH_VARARGS,
+	 "contract_by_area_multi(d,sigma,rho,irho,dA): join layers in microstep profile with a row of rho,irho for each wavelength"},
+
 	{"contract_mag",
 	 Pcontract_mag,
 	 METH_VARARGS,
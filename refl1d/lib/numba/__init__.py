@@ -1,6 +1,22 @@
+"""
+Numba backend for the reflectometry kernels.
+
+The kernels are compiled on first use rather than on import, so for example
+a fit without magnetic layers never compiles the magnetic kernels.  Use
+:func:`refl1d.precompile.precompile` to compile them ahead of time.
+"""
+
+import importlib
+
 __all__ = [
     "reflectivity_amplitude",
+    "reflectivity_amplitude_batch",
+    "reflectivity_amplitude_repeat",
+    "reflectivity_amplitude_cache",
+    "reflectivity_amplitude_update",
+    "reflectivity_amplitude_gradient",
     "magnetic_amplitude",
+    "magnetic_amplitude_repeat",
     "calculate_u1_u3",
     "build_profile",
     "convolve_gaussian",
@@ -8,20 +24,44 @@ __all__ = [
     "convolve_sampled",
     "align_magnetic",
     "contract_by_area",
+    "contract_by_area_multi",
     "contract_mag",
     "rebin_counts",
     "rebin_counts_2D",
 ]
 
-from .reflectivity import reflectivity_amplitude
-from .magnetic import magnetic_amplitude
-from .magnetic import calculate_u1_u3
-from .build_profile import build_profile
-from .convolve import convolve_gaussian
-from .convolve import convolve_uniform
-from .convolve_sampled import convolve_sampled
-from .contract_profile import align_magnetic
-from .contract_profile import contract_by_area
-from .contract_profile import contract_mag
-from .rebin import rebin_counts
-from .rebin import rebin_counts_2D
+# Kernel name => submodule which defines it.
+_KERNEL_MODULES = {
+    "reflectivity_amplitude": "reflectivity",
+    "reflectivity_amplitude_batch": "reflectivity",
+    "reflectivity_amplitude_repeat": "reflectivity",
+    "reflectivity_amplitude_cache": "reflectivity",
+    "reflectivity_amplitude_update": "reflectivity",
+    "reflectivity_amplitude_gradient": "reflectivity",
+    "magnetic_amplitude": "magnetic",
+    "magnetic_amplitude_repeat": "magnetic",
+    "calculate_u1_u3": "magnetic",
+    "build_profile": "build_profile",
+    "convolve_gaussian": "convolve",
+    "convolve_uniform": "convolve",
+    "convolve_sampled": "convolve_sampled",
+    "align_magnetic": "contract_profile",
+    "contract_by_area": "contract_profile",
+    "contract_by_area_multi": "contract_profile",
+    "contract_mag": "contract_profile",
+    "rebin_counts": "rebin",
+    "rebin_counts_2D": "rebin",
+}
+
+
+def __getattr__(name):
+    module_name = _KERNEL_MODULES.get(name, None)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    kernel = getattr(importlib.import_module("." + module_name, __name__), name)
+    globals()[name] = kernel
+    return kernel
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -19,3 +19,6 @@ CONTRACT_BY_AREA_SIG = "i4(f8[:], f8[:], f8[:], f8[:], f8)"
 # @numba.njit(CONTRACT_BY_AREA_SIG, parallel=False, cache=True)
 contract_by_area = numba.njit(cache=True)(MODULE.contract_by_area)
 MODULE.contract_by_area = contract_by_area
+
+
+contract_by_area_multi = numba.njit(cache=True)(MODULE.contract_by_area_multi)
@@ -6,4 +6,7 @@ MODULE = clone_module("refl1d.lib.python.convolve_sampled")
 convolve_point_sampled = numba.njit(cache=True)(MODULE.convolve_point_sampled)
 MODULE.convolve_point_sampled = convolve_point_sampled
 
+convolve_sampled_stride = numba.njit(cache=True)(MODULE.convolve_sampled_stride)
+MODULE.convolve_sampled_stride = convolve_sampled_stride
+
 convolve_sampled = numba.njit(cache=True)(MODULE.convolve_sampled)
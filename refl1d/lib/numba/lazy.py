@@ -0,0 +1,68 @@
+"""
+Deferred compilation of numba kernels.
+
+Kernels declared with an explicit signature are compiled, or loaded from
+the numba cache, as soon as the decorator is applied, so importing a module
+of kernels pays for every kernel in it.  Instead the kernel modules register
+a function which builds each kernel and expose the kernels through the
+module level ``__getattr__`` hook.  A kernel is then built on first use and
+stored in the module namespace so later lookups are ordinary attribute
+access.
+"""
+
+import sys
+import threading
+
+# Builders may request other kernels, so the lock must be reentrant.
+_LOCK = threading.RLock()
+
+
+class LazyKernels:
+    """
+    Registry of kernels for the module *module_name*.
+
+    Builders are registered with the :meth:`kernel` decorator, and
+    :meth:`get` is installed as the module ``__getattr__``.  If *clone*
+    is given then the compiled kernel replaces the function of the same
+    name in the cloned python module so that other jitted functions which
+    call it see the compiled version.
+    """
+
+    def __init__(self, module_name, clone=None):
+        self.module_name = module_name
+        self.clone = clone
+        self.builders = {}
+
+    def kernel(self, build):
+        """
+        Register *build* as the builder for a kernel.
+
+        The builder is named _compile_<kernel> and returns the jitted kernel.
+        """
+        self.builders[build.__name__.removeprefix("_compile_")] = build
+        return build
+
+    def get(self, name):
+        """
+        Return the kernel *name*, building it if necessary.
+        """
+        namespace = vars(sys.modules[self.module_name])
+        if name in namespace:
+            return namespace[name]
+        build = self.builders.get(name, None)
+        if build is None:
+            raise AttributeError(f"module {self.module_name!r} has no attribute {name!r}")
+        with _LOCK:
+            if name not in namespace:
+                kernel = build()
+                if self.clone is not None and hasattr(self.clone, name):
+                    setattr(self.clone, name, kernel)
+                namespace[name] = kernel
+        return namespace[name]
+
+    def compile_all(self):
+        """
+        Build every registered kernel.
+        """
+        for name in self.builders:
+            self.get(name)
@@ -1,7 +1,10 @@
 import numba
 from .clone_module import clone_module
+from .lazy import LazyKernels
 
 MODULE = clone_module("refl1d.lib.python.magnetic")
+KERNELS = LazyKernels(__name__, MODULE)
+__getattr__ = KERNELS.get
 
 MODULE.prange = numba.prange
 
@@ -12,13 +15,26 @@ calculate_u1_u3 = numba.njit(cache=True)(MODULE.calculate_u1_u3)
 MODULE.calculate_u1_u3 = calculate_u1_u3
 
 
-CR4XA_SIG = "void(i8, f8[:], f8[:], f8, f8[:], f8[:], f8[:], c16[:], c16[:], f8, i4, c16[:], c16[:], c16[:], c16[:])"
+_block_entry = numba.njit(cache=True)(MODULE._block_entry)
+MODULE._block_entry = _block_entry
+_matmul4 = numba.njit(cache=True)(MODULE._matmul4)
+MODULE._matmul4 = _matmul4
+_repeat_product = numba.njit(cache=True)(MODULE._repeat_product)
+MODULE._repeat_product = _repeat_product
+
+CR4XA_SIG = (
+    "void(i8, f8[:], f8[:], f8, f8[:], f8[:], f8[:], c16[:], c16[:], f8, i4,"
+    " c16[:], c16[:], c16[:], c16[:], i4[:], i4[:], i4[:])"
+)
 CR4XA_LOCALS = {
     "E0": numba.float64,
     "L": numba.int32,
     "LP": numba.int32,
     "STEP": numba.int8,
     "Z": numba.float64,
+    "ZSTART": numba.float64,
+    "I": numba.int64,
+    "SKIP": numba.int64,
 }
 CR4XA_LOCALS.update(
     (s, numba.complex128)
@@ -50,16 +66,35 @@ CR4XA_LOCALS.update(
         "ENS3L",
         "ES3LP",
         "ENS3LP",
+        "SE1",
+        "SE3",
     ]
 )
 CR4XA_LOCALS.update(("A{i}{j}".format(i=i, j=j), numba.complex128) for i in range(1, 5) for j in range(1, 5))
 CR4XA_LOCALS.update(("B{i}{j}".format(i=i, j=j), numba.complex128) for i in range(1, 5) for j in range(1, 5))
 CR4XA_LOCALS.update(("C{i}".format(i=i), numba.complex128) for i in range(1, 5))
 
-Cr4xa = numba.njit(CR4XA_SIG, parallel=False, cache=True, locals=CR4XA_LOCALS)(MODULE.Cr4xa)
-MODULE.Cr4xa = Cr4xa
+
+@KERNELS.kernel
+def _compile_Cr4xa():
+    return numba.njit(CR4XA_SIG, parallel=False, cache=True, locals=CR4XA_LOCALS)(MODULE.Cr4xa)
 
 
 MAGAMP_SIG = "void(f8[:], f8[:], f8[:], f8[:], f8[:], c16[:], c16[:], f8[:], i4[:], c16[:], c16[:], c16[:], c16[:])"
 
-magnetic_amplitude = numba.njit(MAGAMP_SIG, parallel=False, cache=True)(MODULE.magnetic_amplitude)
+MAGAMP_REPEAT_SIG = (
+    "void(f8[:], f8[:], f8[:], f8[:], f8[:], c16[:], c16[:], f8[:], i4[:], i4[:], i4[:], i4[:],"
+    " c16[:], c16[:], c16[:], c16[:])"
+)
+
+
+@KERNELS.kernel
+def _compile_magnetic_amplitude_repeat():
+    KERNELS.get("Cr4xa")
+    return numba.njit(MAGAMP_REPEAT_SIG, parallel=False, cache=True)(MODULE.magnetic_amplitude_repeat)
+
+
+@KERNELS.kernel
+def _compile_magnetic_amplitude():
+    KERNELS.get("magnetic_amplitude_repeat")
+    return numba.njit(MAGAMP_SIG, parallel=False, cache=True)(MODULE.magnetic_amplitude)
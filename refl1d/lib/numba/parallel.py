@@ -0,0 +1,259 @@
+"""
+Multi-threaded variant of the numba backend.
+
+Select with ``refl1d.use("numba_parallel")`` or ``REFL1D_BACKEND=numba_parallel``.
+The kernels are the same as the serial numba backend except that the loop
+over kz points is split across threads using numba.prange.  Each kz point
+is computed independently, so the results are identical to the serial
+kernel regardless of the number of threads.
+
+The resolution convolutions are split the same way as the OpenMP loops in
+the C extension: each thread takes every n-th output point and keeps its
+own index into the theory points, so the search for the start of the
+resolution window continues from that thread's previous point.
+
+The number of threads defaults to the number of cores, or to the value
+of the ``REFL1D_NUM_THREADS`` environment variable if it is set.  Use
+:func:`set_num_threads` to change it at runtime.  Small calculations
+(fewer than *MIN_PARALLEL_POINTS* kz values) use the serial kernel since
+the cost of starting the threads would exceed the savings.  If the numba
+threading layer is unavailable the serial kernel is used throughout.  The
+threading layer is checked the first time a parallel kernel is needed.
+"""
+
+import os
+import sys
+import warnings
+
+import numba
+
+from . import __all__  # noqa: F401
+from . import reflectivity as serial
+from . import convolve as serial_convolve
+from .clone_module import clone_module
+from .lazy import LazyKernels
+from .reflectivity import _layer_matrix, _matmul, _walk_matrix, _contract
+from .reflectivity import REFLAMP_SIG, REFLAMP_BATCH_SIG, REFLAMP_REPEAT_SIG
+from .reflectivity import REFLAMP_CACHE_SIG, REFLAMP_UPDATE_SIG, REFLAMP_GRADIENT_SIG
+from .convolve import CONVOLVE_THREADED_SIG
+
+MIN_PARALLEL_POINTS = 256
+
+MODULE = clone_module("refl1d.lib.python.reflectivity")
+KERNELS = LazyKernels(__name__)
+
+MODULE.prange = numba.prange
+MODULE._layer_matrix = _layer_matrix
+MODULE._matmul = _matmul
+MODULE._walk_matrix = _walk_matrix
+MODULE._contract = _contract
+
+CONVOLVE = clone_module("refl1d.lib.python.convolve")
+CONVOLVE.prange = numba.prange
+SAMPLED = clone_module("refl1d.lib.python.convolve_sampled")
+SAMPLED.prange = numba.prange
+
+
+def __getattr__(name):
+    # Parallel kernels are built on first use; everything else is the
+    # serial numba kernel.
+    if name in KERNELS.builders:
+        return KERNELS.get(name)
+    if name in __all__:
+        return getattr(sys.modules[__package__], name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _renamed(fn):
+    # The numba cache is keyed by function name and source line but not by
+    # the parallel option, so without a distinct name the parallel kernels
+    # would load the serial kernels from the cache.
+    fn.__qualname__ = "parallel_" + fn.__qualname__
+    return fn
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude_repeat():
+    MODULE.refl_repeat = serial.refl_repeat
+    MODULE.reflectivity_amplitude = KERNELS.get("_parallel_reflectivity_amplitude")
+    kernel = numba.njit(REFLAMP_REPEAT_SIG, parallel=True, cache=True, locals={"offset": numba.int64})(
+        _renamed(MODULE.reflectivity_amplitude_repeat)
+    )
+    MODULE.reflectivity_amplitude_repeat = kernel
+    return kernel
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude():
+    MODULE.refl = serial.refl
+    return numba.njit(REFLAMP_SIG, parallel=True, cache=True, locals={"offset": numba.int64})(
+        _renamed(MODULE.reflectivity_amplitude)
+    )
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude_batch():
+    MODULE.refl = serial.refl
+    return numba.njit(REFLAMP_BATCH_SIG, parallel=True, cache=True, locals={"k": numba.int64, "i": numba.int64})(
+        _renamed(MODULE.reflectivity_amplitude_batch)
+    )
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude_cache():
+    return numba.njit(REFLAMP_CACHE_SIG, parallel=True, cache=True, locals={"offset": numba.int64})(
+        _renamed(MODULE.reflectivity_amplitude_cache)
+    )
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude_update():
+    MODULE.refl = serial.refl
+    return numba.njit(REFLAMP_UPDATE_SIG, parallel=True, cache=True, locals={"offset": numba.int64})(
+        _renamed(MODULE.reflectivity_amplitude_update)
+    )
+
+
+@KERNELS.kernel
+def _compile__parallel_reflectivity_amplitude_gradient():
+    return numba.njit(
+        REFLAMP_GRADIENT_SIG, parallel=True, cache=True, locals={"offset": numba.int64, "s": numba.float64}
+    )(_renamed(MODULE.reflectivity_amplitude_gradient))
+
+
+@KERNELS.kernel
+def _compile__parallel_convolve_uniform():
+    CONVOLVE.convolve_uniform_stride = serial_convolve.convolve_uniform_stride
+    return numba.njit(CONVOLVE_THREADED_SIG, parallel=True, cache=True)(CONVOLVE.convolve_uniform_threaded)
+
+
+@KERNELS.kernel
+def _compile__parallel_convolve_gaussian():
+    CONVOLVE.convolve_gaussian_stride = serial_convolve.convolve_gaussian_stride
+    return numba.njit(CONVOLVE_THREADED_SIG, parallel=True, cache=True)(CONVOLVE.convolve_gaussian_threaded)
+
+
+@KERNELS.kernel
+def _compile__parallel_convolve_sampled():
+    # Importing the convolve_sampled submodule directly would replace the
+    # convolve_sampled kernel in the package namespace with the submodule,
+    # so load it through the package.
+    getattr(sys.modules[__package__], "convolve_sampled")
+    SAMPLED.convolve_sampled_stride = sys.modules[__package__ + ".convolve_sampled"].convolve_sampled_stride
+    return numba.njit(parallel=True, cache=True)(SAMPLED.convolve_sampled_threaded)
+
+
+def set_num_threads(n=None):
+    """
+    Set the number of threads used by the parallel kernels.
+
+    *n* is capped at the number of threads available to numba.  Use
+    None for all available threads.
+    """
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(max_threads if n is None else max(1, min(int(n), max_threads)))
+
+
+def get_num_threads():
+    """Number of threads used by the parallel kernels."""
+    return numba.get_num_threads()
+
+
+@KERNELS.kernel
+def _compile__threading_check():
+    def threading_check(x):
+        for i in numba.prange(len(x)):
+            x[i] = i
+
+    return numba.njit("void(f8[:])", parallel=True, cache=True)(_renamed(threading_check))
+
+
+def _check_threading():
+    """
+    Run a trivial parallel kernel so that a missing threading layer is
+    detected before the first real kernel rather than part way through it.
+    """
+    import numpy as np
+
+    try:
+        KERNELS.get("_threading_check")(np.empty(2))
+    except Exception as exc:
+        warnings.warn(f"numba threading unavailable ({exc}); using serial kernels")
+        return False
+    return True
+
+
+# None until the threading layer is checked on the first parallel call.
+PARALLEL_AVAILABLE = None
+
+
+def _use_parallel(size):
+    global PARALLEL_AVAILABLE
+    if size < MIN_PARALLEL_POINTS:
+        return False
+    if PARALLEL_AVAILABLE is None:
+        PARALLEL_AVAILABLE = _check_threading()
+    return PARALLEL_AVAILABLE
+
+
+def _kernel(name, size):
+    """
+    Parallel version of kernel *name* if there are enough points, otherwise
+    the serial version.
+    """
+    if _use_parallel(size):
+        return KERNELS.get("_parallel_" + name)
+    return getattr(serial, name)
+
+
+def reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r):
+    _kernel("reflectivity_amplitude", len(kz))(depth, sigma, rho, irho, kz, rho_index, r)
+
+
+def reflectivity_amplitude_repeat(depth, sigma, rho, irho, kz, rho_index, repeat_start, repeat_length, repeat_count, r):
+    kernel = _kernel("reflectivity_amplitude_repeat", len(kz))
+    kernel(depth, sigma, rho, irho, kz, rho_index, repeat_start, repeat_length, repeat_count, r)
+
+
+def reflectivity_amplitude_batch(depth, sigma, rho, irho, layers, kz, r):
+    _kernel("reflectivity_amplitude_batch", len(layers) * len(kz))(depth, sigma, rho, irho, layers, kz, r)
+
+
+def reflectivity_amplitude_cache(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, r):
+    kernel = _kernel("reflectivity_amplitude_cache", len(kz))
+    kernel(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, r)
+
+
+def reflectivity_amplitude_update(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, first, last, r):
+    kernel = _kernel("reflectivity_amplitude_update", len(kz))
+    kernel(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, first, last, r)
+
+
+def reflectivity_amplitude_gradient(depth, sigma, rho, irho, kz, rho_index, r, dr_depth, dr_sigma, dr_rho, dr_irho):
+    kernel = _kernel("reflectivity_amplitude_gradient", len(kz))
+    kernel(depth, sigma, rho, irho, kz, rho_index, r, dr_depth, dr_sigma, dr_rho, dr_irho)
+
+
+def convolve_uniform(xi, yi, x, dx, y):
+    if _use_parallel(len(x)):
+        KERNELS.get("_parallel_convolve_uniform")(xi, yi, x, dx, y, numba.get_num_threads())
+    else:
+        serial_convolve.convolve_uniform(xi, yi, x, dx, y)
+
+
+def convolve_gaussian(xin, yin, x, dx, y):
+    if _use_parallel(len(x)):
+        KERNELS.get("_parallel_convolve_gaussian")(xin, yin, x, dx, y, numba.get_num_threads())
+    else:
+        serial_convolve.convolve_gaussian(xin, yin, x, dx, y)
+
+
+def convolve_sampled(xin, yin, xp, yp, x, dx, y):
+    if _use_parallel(len(x)):
+        KERNELS.get("_parallel_convolve_sampled")(xin, yin, xp, yp, x, dx, y, numba.get_num_threads())
+    else:
+        getattr(sys.modules[__package__], "convolve_sampled")(xin, yin, xp, yp, x, dx, y)
+
+
+if "REFL1D_NUM_THREADS" in os.environ:
+    set_num_threads(os.environ["REFL1D_NUM_THREADS"])
@@ -1,9 +1,24 @@
 import numba
 from .clone_module import clone_module
+from .lazy import LazyKernels
 
 MODULE = clone_module("refl1d.lib.python.reflectivity")
+KERNELS = LazyKernels(__name__, MODULE)
+__getattr__ = KERNELS.get
+
+_block_entry = numba.njit(cache=True)(MODULE._block_entry)
+MODULE._block_entry = _block_entry
+_layer_matrix = numba.njit(cache=True)(MODULE._layer_matrix)
+MODULE._layer_matrix = _layer_matrix
+_matmul = numba.njit(cache=True)(MODULE._matmul)
+MODULE._matmul = _matmul
+_matpow = numba.njit(cache=True)(MODULE._matpow)
+MODULE._matpow = _matpow
+_walk_matrix = numba.njit(cache=True)(MODULE._walk_matrix)
+MODULE._walk_matrix = _walk_matrix
 
 _REFL_SIG = "c16(i8, f8, f8[:], f8[:], f8[:], f8[:])"
+_REFL_REPEAT_SIG = "c16(i8, f8, f8[:], f8[:], f8[:], f8[:], i4[:], i4[:], i4[:])"
 _REFL_LOCALS = {
     "cutoff": numba.float64,
     "next": numba.int64,
@@ -17,14 +32,85 @@ _REFL_LOCALS = {
     "J": numba.complex128,
 }
 _REFL_LOCALS.update(("B{i}{j}".format(i=i, j=j), numba.complex128) for i in range(1, 3) for j in range(1, 3))
+_REFL_LOCALS.update(("P{i}{j}".format(i=i, j=j), numba.complex128) for i in range(1, 3) for j in range(1, 3))
 _REFL_LOCALS.update(("M{i}{j}".format(i=i, j=j), numba.complex128) for i in range(1, 3) for j in range(1, 3))
 _REFL_LOCALS.update(("C{i}".format(i=i), numba.complex128) for i in range(1, 3))
 
-refl = numba.njit(_REFL_SIG, parallel=False, cache=True, locals=_REFL_LOCALS)(MODULE.refl)
-MODULE.refl = refl
+
+@KERNELS.kernel
+def _compile_refl():
+    return numba.njit(_REFL_SIG, parallel=False, cache=True, locals=_REFL_LOCALS)(MODULE.refl)
+
+
+@KERNELS.kernel
+def _compile_refl_repeat():
+    return numba.njit(_REFL_REPEAT_SIG, parallel=False, cache=True, locals=_REFL_LOCALS)(MODULE.refl_repeat)
+
 
 REFLAMP_SIG = "void(f8[:], f8[:], f8[:,:], f8[:,:], f8[:], i4[:], c16[:])"
 
-reflectivity_amplitude = numba.njit(REFLAMP_SIG, parallel=False, cache=True, locals={"offset": numba.int64})(
-    MODULE.reflectivity_amplitude
+REFLAMP_REPEAT_SIG = "void(f8[:], f8[:], f8[:,:], f8[:,:], f8[:], i4[:], i4[:], i4[:], i4[:], c16[:])"
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude_repeat():
+    KERNELS.get("refl_repeat")
+    KERNELS.get("reflectivity_amplitude")
+    return numba.njit(REFLAMP_REPEAT_SIG, parallel=False, cache=True, locals={"offset": numba.int64})(
+        MODULE.reflectivity_amplitude_repeat
+    )
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude():
+    KERNELS.get("refl")
+    return numba.njit(REFLAMP_SIG, parallel=False, cache=True, locals={"offset": numba.int64})(
+        MODULE.reflectivity_amplitude
+    )
+
+
+REFLAMP_BATCH_SIG = "void(f8[:,:], f8[:,:], f8[:,:], f8[:,:], i4[:], f8[:], c16[:,:])"
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude_batch():
+    KERNELS.get("refl")
+    return numba.njit(REFLAMP_BATCH_SIG, parallel=False, cache=True, locals={"k": numba.int64, "i": numba.int64})(
+        MODULE.reflectivity_amplitude_batch
+    )
+
+
+REFLAMP_CACHE_SIG = "void(f8[:], f8[:], f8[:,:], f8[:,:], f8[:], i4[:], c16[:,:,:], c16[:,:,:], c16[:])"
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude_cache():
+    return numba.njit(REFLAMP_CACHE_SIG, parallel=False, cache=True, locals={"offset": numba.int64})(
+        MODULE.reflectivity_amplitude_cache
+    )
+
+
+REFLAMP_UPDATE_SIG = "void(f8[:], f8[:], f8[:,:], f8[:,:], f8[:], i4[:], c16[:,:,:], c16[:,:,:], i8, i8, c16[:])"
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude_update():
+    KERNELS.get("refl")
+    return numba.njit(REFLAMP_UPDATE_SIG, parallel=False, cache=True, locals={"offset": numba.int64})(
+        MODULE.reflectivity_amplitude_update
+    )
+
+
+_contract = numba.njit(cache=True)(MODULE._contract)
+MODULE._contract = _contract
+
+REFLAMP_GRADIENT_SIG = (
+    "void(f8[:], f8[:], f8[:,:], f8[:,:], f8[:], i4[:], c16[:], c16[:,:], c16[:,:], c16[:,:], c16[:,:])"
 )
+
+
+@KERNELS.kernel
+def _compile_reflectivity_amplitude_gradient():
+    return numba.njit(
+        REFLAMP_GRADIENT_SIG, parallel=False, cache=True, locals={"offset": numba.int64, "s": numba.float64}
+    )(MODULE.reflectivity_amplitude_gradient)
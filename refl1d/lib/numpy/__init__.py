@@ -0,0 +1,41 @@
+"""
+Backend using whole-array numpy operations.
+
+This is for systems without numba, such as pyodide.  The reflectivity,
+magnetic reflectivity, resolution and profile kernels compute all points
+together rather than looping over them in python; the remaining kernels
+are those of the python backend.  The repeat, cache and gradient kernels
+are not provided, so the callers use the plain reflectivity calculation.
+
+Select with ``refl1d.use("numpy")`` or ``REFL1D_BACKEND=numpy``.
+"""
+
+__all__ = [
+    "reflectivity_amplitude",
+    "magnetic_amplitude",
+    "calculate_u1_u3",
+    "build_profile",
+    "convolve_gaussian",
+    "convolve_uniform",
+    "convolve_sampled",
+    "align_magnetic",
+    "contract_by_area",
+    "contract_by_area_multi",
+    "contract_mag",
+    "rebin_counts",
+    "rebin_counts_2D",
+]
+
+from .reflectivity import reflectivity_amplitude
+from .magnetic import magnetic_amplitude
+from .magnetic import calculate_u1_u3
+from .build_profile import build_profile
+from .convolve import convolve_gaussian
+from ..python.convolve import convolve_uniform
+from ..python.convolve_sampled import convolve_sampled
+from ..python.contract_profile import align_magnetic
+from .contract_profile import contract_by_area
+from .contract_profile import contract_by_area_multi
+from ..python.contract_profile import contract_mag
+from ..python.rebin import rebin_counts
+from ..python.rebin import rebin_counts_2D
@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.special import erf
+
+SQRT1_2 = 1.0 / np.sqrt(2.0)
+
+
+def build_profile(z, offset, roughness, contrast, initial_value, profiles):
+    """
+    Convert a step profile to a smooth profile.
+
+    *z*          calculation points, shape = (NZ,)
+    *offset*     offset for each interface, shape = (NI,)
+    *roughness*  roughness of each interface, shape = (NI,)
+    *contrast*   step value at each interface for each profile, shape = (NP * NI)
+    *initial_value* starting value for each profile, shape = (NP)
+
+    *profiles*   (output) results of calculation, shape = (NP * NZ, order="C")
+    """
+    NZ = len(z)
+    NP = initial_value.shape[0]
+    NI = len(offset)
+
+    # Blend functions for all interfaces at once, shape = (NI, NZ)
+    sigma = roughness[:, None]
+    dz = z[None, :] - offset[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        blended = np.where(sigma > 0.0, 0.5 * erf(SQRT1_2 * dz / sigma) + 0.5, 1.0 * (dz >= 0))
+
+    profiles_shaped = profiles.reshape((NP, NZ))  # view - updates affect profiles
+    profiles_shaped += initial_value.reshape((NP, 1)) + contrast.reshape((NP, NI)) @ blended
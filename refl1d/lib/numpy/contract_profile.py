@@ -0,0 +1,79 @@
+"""
+Profile contraction with the slab search done by array operations.
+
+The slabs are still merged one output layer at a time, but the end of each
+layer is found by scanning a window of input slices with cumulative sums
+and running extrema rather than one slice at a time.
+"""
+
+import numpy as np
+
+# Number of slices examined in the first window for each layer.  The
+# window doubles until the end of the layer is found.
+WINDOW = 16
+
+
+def contract_by_area(d, sigma, rho, irho, dA):
+    return _contract(d, sigma, rho[None, :], irho[None, :], dA)
+
+
+def contract_by_area_multi(d, sigma, rho, irho, dA):
+    return _contract(d, sigma, rho, irho, dA)
+
+
+def _contract(d, sigma, rho, irho, dA):
+    """
+    Contract the profile in place with a row of *rho* and *irho* for each
+    wavelength, returning the new number of slabs.
+    """
+    n = len(d)
+    i = newi = 1  # Skip the substrate
+    while i < n:
+        end = _layer_end(i, d, sigma, rho, irho, dA)
+        dz = np.cumsum(d[i:end])[-1]
+        assert newi < n
+        if end == n:
+            # Last layer uses surface values
+            d[newi] = dz
+            rho[:, newi] = rho[:, n - 1]
+            irho[:, newi] = irho[:, n - 1]
+        else:
+            # Middle layers use average values. The areas are accumulated in
+            # slice order so the results match the sequential version.
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rho[:, newi] = np.cumsum(d[i:end] * rho[:, i:end], axis=1)[:, -1] / dz
+                irho[:, newi] = np.cumsum(d[i:end] * irho[:, i:end], axis=1)[:, -1] / dz
+            d[newi] = dz
+            sigma[newi] = sigma[end - 1]
+        newi += 1
+        i = end
+    return newi
+
+
+def _layer_end(start, d, sigma, rho, irho, dA):
+    """
+    Index of the first slice after *start* which does not fit into the
+    layer starting at *start*.
+
+    A slice j ends the layer if the interface before it is rough, or if
+    adding it would make the area of the box around the values of rho or
+    irho in the layer exceed *dA* for any row.
+    """
+    n = len(d)
+    window = WINDOW
+    while True:
+        stop = min(start + window, n)
+        dz = np.cumsum(d[start:stop])[1:]
+        rho_range = _running_range(rho[:, start:stop])
+        irho_range = _running_range(irho[:, start:stop])
+        too_wide = ((rho_range * dz > dA) | (irho_range * dz > dA)).any(axis=0)
+        split = (sigma[start : stop - 1] != 0.0) | too_wide
+        if split.any():
+            return start + 1 + np.argmax(split)
+        if stop == n:
+            return n
+        window *= 2
+
+
+def _running_range(v):
+    return np.maximum.accumulate(v, axis=1)[:, 1:] - np.minimum.accumulate(v, axis=1)[:, 1:]
@@ -0,0 +1,168 @@
+"""
+Magnetic reflectivity vectorized over kz.
+
+This follows Cr4xa in the python backend, with the 4x4 transfer matrix for
+all kz points and both incident polarizations stored as a stack of matrices.
+"""
+
+import sys
+
+import numpy as np
+
+EPS = sys.float_info.epsilon
+PI4 = 4.0e-6 * np.pi
+B2SLD = 2.31604654  # Scattering factor for B field 1e-6
+
+
+def calculate_u1_u3(H, rhoM, thetaM, Aguide, u1, u3):
+    """
+    array version - rhoM, thetaM, u1 and u3 are arrays
+    rhoM, u1 and u3 are modified in-place
+    """
+    AG = np.radians(Aguide)
+    sld_m_x = rhoM * np.cos(thetaM)
+    sld_m_y = rhoM * np.sin(thetaM)
+    # Rotate M about the x axis so that z is along the guide field.
+    sld_b_x = sld_m_x
+    sld_b_y = sld_m_y * np.cos(AG)
+    sld_b_z = B2SLD * H - sld_m_y * np.sin(AG)
+
+    # avoid divide-by-zero:
+    sld_b_x = sld_b_x + EPS * (sld_b_x == 0)
+    sld_b_y = sld_b_y + EPS * (sld_b_y == 0)
+
+    sld_b = np.sqrt(sld_b_x**2 + sld_b_y**2 + sld_b_z**2)
+    u1[:] = (sld_b + sld_b_x - sld_b_z + 1j * sld_b_y) / (sld_b + sld_b_x + sld_b_z - 1j * sld_b_y)
+    u3[:] = (-sld_b + sld_b_x - sld_b_z + 1j * sld_b_y) / (-sld_b + sld_b_x + sld_b_z - 1j * sld_b_y)
+    rhoM[:] = sld_b
+
+
+def magnetic_amplitude(d, sigma, rho, irho, rhoM, u1, u3, KZ, rho_index, Ra, Rb, Rc, Rd):
+    """
+    numpy version of calculation
+    implicit returns: Ra, Rb, Rc, Rd
+    """
+    Ra[:] = Rd[:] = -1.0
+    Rb[:] = Rc[:] = 0.0
+    up = KZ >= 1e-10
+    down = KZ <= -1e-10
+    _fill(up, KZ[up], d, sigma, rho, irho, rhoM, u1, u3, Ra, Rb, Rc, Rd)
+    # For KZ < 0 reverse the layers.
+    layers = (d[::-1], sigma[len(d) - 2 :: -1], rho[::-1], irho[::-1], rhoM[::-1], u1[::-1], u3[::-1])
+    _fill(down, -KZ[down], *layers, Ra, Rb, Rc, Rd)
+
+
+def _fill(index, KZ, d, sigma, rho, irho, rhoM, u1, u3, Ra, Rb, Rc, Rd):
+    if len(KZ) == 0:
+        return
+    # plus polarization fills in R++, R+-, R-+, R--; minus polarization
+    # then replaces R-+, R--.
+    IP = np.hstack((np.ones_like(KZ), -np.ones_like(KZ)))
+    B = _cr4xa(np.hstack((KZ, KZ)), IP, d, sigma, rho, irho, rhoM, u1, u3)
+    Bp, Bm = B[: len(KZ)], B[len(KZ) :]
+    DETW = Bp[:, 3, 3] * Bp[:, 1, 1] - Bp[:, 1, 3] * Bp[:, 3, 1]
+    Ra[index] = (Bp[:, 1, 3] * Bp[:, 3, 0] - Bp[:, 1, 0] * Bp[:, 3, 3]) / DETW  # ++
+    Rb[index] = (Bp[:, 1, 0] * Bp[:, 3, 1] - Bp[:, 3, 0] * Bp[:, 1, 1]) / DETW  # +-
+    DETW = Bm[:, 3, 3] * Bm[:, 1, 1] - Bm[:, 1, 3] * Bm[:, 3, 1]
+    Rc[index] = (Bm[:, 1, 3] * Bm[:, 3, 2] - Bm[:, 1, 2] * Bm[:, 3, 3]) / DETW  # -+
+    Rd[index] = (Bm[:, 1, 2] * Bm[:, 3, 1] - Bm[:, 3, 2] * Bm[:, 1, 1]) / DETW  # --
+
+
+def _wavevectors(E0, rho, irho, rhoM, u1, u3):
+    """
+    S1, S3 for each kz in a layer along with the B, G spinor factors,
+    swapping the spin states if Bz < 0.
+    """
+    absorption = 1j * PI4 * (abs(irho) + 1e-10)
+    S1 = -np.sqrt(PI4 * (rho + rhoM) - E0 - absorption)
+    S3 = -np.sqrt(PI4 * (rho - rhoM) - E0 - absorption)
+    if abs(u1) <= 1.0:
+        return S1, S3, u1, 1.0 / u3
+    return S3, S1, u3, 1.0 / u1
+
+
+def _cr4xa(KZ, IP, D, SIGMA, RHO, IRHO, RHOM, U1, U3):
+    """
+    Transfer matrix B = A(N) ... A(1) for KZ > 0 with incident polarization
+    IP = +1 or -1 for each KZ.
+    """
+    N = len(D)
+    # Changing the target KZ is equivalent to subtracting the fronting
+    # medium SLD.
+    E0 = KZ * KZ + PI4 * (RHO[0] + IP * RHOM[0])
+
+    S1L, S3L, _, _ = _wavevectors(E0, RHO[0], IRHO[0], RHOM[0], U1[0], U3[0])
+    S1LP, S3LP, BLP, GLP = _wavevectors(E0, RHO[1], IRHO[1], RHOM[1], U1[1], U3[1])
+    SIGMAL = SIGMA[0]
+    DELTA = 0.5 / (1.0 - (BLP * GLP))
+    FS1S1 = S1L / S1LP
+    FS1S3 = S1L / S3LP
+    FS3S1 = S3L / S1LP
+    FS3S3 = S3L / S3LP
+    R11 = np.exp(2.0 * S1L * S1LP * SIGMAL * SIGMAL)
+    R31 = np.exp(2.0 * S3L * S1LP * SIGMAL * SIGMAL)
+    R13 = np.exp(2.0 * S1L * S3LP * SIGMAL * SIGMAL)
+    R33 = np.exp(2.0 * S3L * S3LP * SIGMAL * SIGMAL)
+
+    B = np.empty((len(KZ), 4, 4), complex)
+    B[:, 0, 0] = B[:, 1, 1] = DELTA * (1.0 + FS1S1)
+    B[:, 0, 1] = B[:, 1, 0] = DELTA * (1.0 - FS1S1) * R11
+    B[:, 0, 2] = B[:, 1, 3] = DELTA * -GLP * (1.0 + FS3S1)
+    B[:, 0, 3] = B[:, 1, 2] = DELTA * -GLP * (1.0 - FS3S1) * R31
+    B[:, 2, 0] = B[:, 3, 1] = DELTA * -BLP * (1.0 + FS1S3)
+    B[:, 2, 1] = B[:, 3, 0] = DELTA * -BLP * (1.0 - FS1S3) * R13
+    B[:, 2, 2] = B[:, 3, 3] = DELTA * (1.0 + FS3S3)
+    B[:, 2, 3] = B[:, 3, 2] = DELTA * (1.0 - FS3S3) * R33
+
+    A = np.empty_like(B)
+    Z = D[1]
+    for L in range(1, N - 1):
+        LP = L + 1
+        S1L, S3L, BL, GL = S1LP, S3LP, BLP, GLP
+        S1LP, S3LP, BLP, GLP = _wavevectors(E0, RHO[LP], IRHO[LP], RHOM[LP], U1[LP], U3[LP])
+        SIGMAL = SIGMA[L]
+
+        DELTA = 0.5 / (1.0 - (BLP * GLP))
+        DBB = (BL - BLP) * DELTA
+        DBG = (1.0 - BL * GLP) * DELTA
+        DGB = (1.0 - GL * BLP) * DELTA
+        DGG = (GL - GLP) * DELTA
+
+        ES1L = np.exp(S1L * Z)
+        ENS1L = 1.0 / ES1L
+        ES1LP = np.exp(S1LP * Z)
+        ENS1LP = 1.0 / ES1LP
+        ES3L = np.exp(S3L * Z)
+        ENS3L = 1.0 / ES3L
+        ES3LP = np.exp(S3LP * Z)
+        ENS3LP = 1.0 / ES3LP
+
+        FS1S1 = S1L / S1LP
+        FS1S3 = S1L / S3LP
+        FS3S1 = S3L / S1LP
+        FS3S3 = S3L / S3LP
+        R11 = np.exp(2.0 * S1L * S1LP * SIGMAL * SIGMAL)
+        R31 = np.exp(2.0 * S3L * S1LP * SIGMAL * SIGMAL)
+        R13 = np.exp(2.0 * S1L * S3LP * SIGMAL * SIGMAL)
+        R33 = np.exp(2.0 * S3L * S3LP * SIGMAL * SIGMAL)
+
+        A[:, 0, 0] = DBG * (1.0 + FS1S1) * ES1L * ENS1LP
+        A[:, 1, 1] = DBG * (1.0 + FS1S1) * ENS1L * ES1LP
+        A[:, 0, 1] = DBG * (1.0 - FS1S1) * R11 * ENS1L * ENS1LP
+        A[:, 1, 0] = DBG * (1.0 - FS1S1) * R11 * ES1L * ES1LP
+        A[:, 0, 2] = DGG * (1.0 + FS3S1) * ES3L * ENS1LP
+        A[:, 1, 3] = DGG * (1.0 + FS3S1) * ENS3L * ES1LP
+        A[:, 0, 3] = DGG * (1.0 - FS3S1) * R31 * ENS3L * ENS1LP
+        A[:, 1, 2] = DGG * (1.0 - FS3S1) * R31 * ES3L * ES1LP
+        A[:, 2, 0] = DBB * (1.0 + FS1S3) * ES1L * ENS3LP
+        A[:, 3, 1] = DBB * (1.0 + FS1S3) * ENS1L * ES3LP
+        A[:, 2, 1] = DBB * (1.0 - FS1S3) * R13 * ENS1L * ENS3LP
+        A[:, 3, 0] = DBB * (1.0 - FS1S3) * R13 * ES1L * ES3LP
+        A[:, 2, 2] = DGB * (1.0 + FS3S3) * ES3L * ENS3LP
+        A[:, 3, 3] = DGB * (1.0 + FS3S3) * ENS3L * ES3LP
+        A[:, 2, 3] = DGB * (1.0 - FS3S3) * R33 * ENS3L * ENS3LP
+        A[:, 3, 2] = DGB * (1.0 - FS3S3) * R33 * ES3L * ES3LP
+
+        B = A @ B
+        Z += D[LP]
+    return B
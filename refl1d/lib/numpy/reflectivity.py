@@ -0,0 +1,52 @@
+"""
+Abeles matrix reflectivity vectorized over kz.
+
+The layers are processed one at a time as in the python backend, with the
+transfer matrix for all kz points computed together using array operations.
+"""
+
+import numpy as np
+
+PI4 = 12.566370614359172e-6  # 1e-6 * 4 pi
+
+
+def reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r):
+    rho = rho[rho_index]
+    irho = irho[rho_index]
+    r[:] = -1.0
+    up = kz >= 1e-10
+    down = kz <= -1e-10
+    r[up] = _calc(kz[up], depth, sigma, rho[up], irho[up])
+    # For kz < 0 reverse the layers.  Interface i is between layers i and i+1,
+    # so the reversed interfaces start from the last interface, not the
+    # last entry of sigma, in case sigma has an entry for every layer.
+    n = len(depth)
+    r[down] = _calc(-kz[down], depth[::-1], sigma[n - 2 :: -1], rho[down, ::-1], irho[down, ::-1])
+
+
+def _calc(kz, depth, sigma, rho, irho):
+    """
+    Reflectivity for kz > 0 with *rho* and *irho* given for each kz.
+    """
+    kz_sq = kz * kz + PI4 * rho[:, 0]
+    k = kz.astype(complex)
+    B11 = B22 = np.ones_like(k)
+    B12 = B21 = np.zeros_like(k)
+    for i in range(len(depth) - 1):
+        k_next = np.sqrt(kz_sq - PI4 * (rho[:, i + 1] + 1j * irho[:, i + 1]))
+        F = (k - k_next) / (k + k_next) * np.exp(-2.0 * k * k_next * sigma[i] ** 2)
+        if i > 0:
+            M11 = np.exp(1j * k * depth[i])
+            M22 = np.exp(-1j * k * depth[i])
+        else:
+            M11 = M22 = 1.0
+        M21 = F * M11
+        M12 = F * M22
+        B11, B12, B21, B22 = (
+            B11 * M11 + B21 * M12,
+            B12 * M11 + B22 * M12,
+            B11 * M21 + B21 * M22,
+            B12 * M21 + B22 * M22,
+        )
+        k = k_next
+    return B12 / B11
@@ -1,6 +1,12 @@
 __all__ = [
     "reflectivity_amplitude",
+    "reflectivity_amplitude_batch",
+    "reflectivity_amplitude_repeat",
+    "reflectivity_amplitude_cache",
+    "reflectivity_amplitude_update",
+    "reflectivity_amplitude_gradient",
     "magnetic_amplitude",
+    "magnetic_amplitude_repeat",
     "calculate_u1_u3",
     "build_profile",
     "convolve_gaussian",
@@ -8,13 +14,20 @@ __all__ = [
     "convolve_sampled",
     "align_magnetic",
     "contract_by_area",
+    "contract_by_area_multi",
     "contract_mag",
     "rebin_counts",
     "rebin_counts_2D",
 ]
 
 from .reflectivity import reflectivity_amplitude
+from .reflectivity import reflectivity_amplitude_batch
+from .reflectivity import reflectivity_amplitude_repeat
+from .reflectivity import reflectivity_amplitude_cache
+from .reflectivity import reflectivity_amplitude_update
+from .reflectivity import reflectivity_amplitude_gradient
 from .magnetic import magnetic_amplitude
+from .magnetic import magnetic_amplitude_repeat
 from .magnetic import calculate_u1_u3
 from .build_profile import build_profile
 from .convolve import convolve_gaussian
@@ -22,6 +35,7 @@ from .convolve import convolve_uniform
 from .convolve_sampled import convolve_sampled
 from .contract_profile import align_magnetic
 from .contract_profile import contract_by_area
+from .contract_profile import contract_by_area_multi
 from .contract_profile import contract_mag
 from .rebin import rebin_counts
 from .rebin import rebin_counts_2D
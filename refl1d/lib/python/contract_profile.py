@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 Z_EPS = 1e-6
 
 
@@ -201,7 +203,8 @@ def contract_mag(d, sigma, rho, irho, rhoM, thetaM, dA):
             if (mperphi - mperplo) * (dz + d[i]) > dA:
                 break
 
-        assert newi < m
+        if newi >= m:
+            raise IndexError("more contracted layers than input layers")
         d[newi] = dz
         if dz == 0:
             rho[newi] = rho[i - 1]
@@ -284,7 +287,8 @@ def contract_by_area(d, sigma, rho, irho, dA):
         # /* if (dz == 0) continue; */
 
         # /* Save the layer */
-        assert newi < n
+        if newi >= n:
+            raise IndexError("more contracted layers than input layers")
         d[newi] = dz
         if i == n:
             # /* printf("contract: adding final sld at %d\n",newi); */
@@ -301,3 +305,72 @@ def contract_by_area(d, sigma, rho, irho, dA):
         newi += 1
 
     return newi
+
+
+def contract_by_area_multi(d, sigma, rho, irho, dA):
+    """
+    Like contract_by_area, but with a row of *rho* and *irho* for each
+    wavelength.  Slices are joined only if they fit within *dA* for every
+    wavelength, so all rows share the same layer boundaries.
+    """
+    nprobe = rho.shape[0]
+    n = len(d)
+    rholo, rhohi, rhoarea = np.empty(nprobe), np.empty(nprobe), np.empty(nprobe)
+    irholo, irhohi, irhoarea = np.empty(nprobe), np.empty(nprobe), np.empty(nprobe)
+    i = newi = 1  # /* Skip the substrate */
+    while i < n:
+        # /* Get ready for the next layer */
+        dz = 0.0
+        for k in range(nprobe):
+            rhoarea[k] = irhoarea[k] = 0.0
+            rholo[k] = rhohi[k] = rho[k, i]
+            irholo[k] = irhohi[k] = irho[k, i]
+
+        # /* Accumulate slices into layer */
+        while True:
+            # /* Accumulate next slice */
+            dz += d[i]
+            for k in range(nprobe):
+                rhoarea[k] += d[i] * rho[k, i]
+                irhoarea[k] += d[i] * irho[k, i]
+
+            # /* If no more slices or sigma != 0, break immediately */
+            i += 1
+            if i == n or sigma[i - 1] != 0.0:
+                break
+
+            # /* If next slice won't fit at any wavelength, break */
+            fits = True
+            for k in range(nprobe):
+                if rho[k, i] < rholo[k]:
+                    rholo[k] = rho[k, i]
+                if rho[k, i] > rhohi[k]:
+                    rhohi[k] = rho[k, i]
+                if irho[k, i] < irholo[k]:
+                    irholo[k] = irho[k, i]
+                if irho[k, i] > irhohi[k]:
+                    irhohi[k] = irho[k, i]
+                if (rhohi[k] - rholo[k]) * (dz + d[i]) > dA or (irhohi[k] - irholo[k]) * (dz + d[i]) > dA:
+                    fits = False
+                    break
+            if not fits:
+                break
+
+        # /* Save the layer */
+        if newi >= n:
+            raise IndexError("more contracted layers than input layers")
+        d[newi] = dz
+        if i == n:
+            # /* Last layer uses surface values */
+            for k in range(nprobe):
+                rho[k, newi] = rho[k, n - 1]
+                irho[k, newi] = irho[k, n - 1]
+        else:
+            # /* Middle layers uses average values */
+            for k in range(nprobe):
+                rho[k, newi] = rhoarea[k] / dz
+                irho[k, newi] = irhoarea[k] / dz
+            sigma[newi] = sigma[i - 1]
+        newi += 1
+
+    return newi
@@ -12,10 +12,22 @@ prange = range
 
 
 def convolve_uniform(xi, yi, x, dx, y):
+    convolve_uniform_stride(xi, yi, x, dx, y, 0, 1)
+
+
+def convolve_uniform_threaded(xi, yi, x, dx, y, nthreads):
+    # Each thread takes every nthreads-th output point and tracks its own
+    # window start, as with the OpenMP schedule(static,1) firstprivate(in)
+    # loop in the C extension.
+    for start in prange(nthreads):
+        convolve_uniform_stride(xi, yi, x, dx, y, start, nthreads)
+
+
+def convolve_uniform_stride(xi, yi, x, dx, y, start, step):
     left_index = 0
     N_xi = len(xi)
     N_x = len(x)
-    for k in prange(N_x):
+    for k in range(start, N_x, step):
         x_k = x[k]
         # Convert 1-sigma width to 1/2 width of the region
         limit = dx[k] * root_12_over_2
@@ -158,6 +170,16 @@ def convolve_gaussian_point(xin, yin, k, n, xo, limit, sigma):
 
 
 def convolve_gaussian(xin, yin, x, dx, y):
+    convolve_gaussian_stride(xin, yin, x, dx, y, 0, 1)
+
+
+def convolve_gaussian_threaded(xin, yin, x, dx, y, nthreads):
+    # See convolve_uniform_threaded.
+    for start in prange(nthreads):
+        convolve_gaussian_stride(xin, yin, x, dx, y, start, nthreads)
+
+
+def convolve_gaussian_stride(xin, yin, x, dx, y, start, step):
     # size_t in,out;
     Nin = len(xin)
     Nout = len(x)
@@ -181,7 +203,7 @@ def convolve_gaussian(xin, yin, x, dx, y):
     # */
     k_in = 0
 
-    for k_out in range(Nout):
+    for k_out in range(start, Nout, step):
         # /* width of resolution window for x is w = 2 dx^2. */
         sigma = dx[k_out]
         xo = x[k_out]
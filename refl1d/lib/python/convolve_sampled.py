@@ -88,7 +88,22 @@ def convolve_point_sampled(Nin, xin, yin, Np, xp, yp, xo, dx, _in):
     return sum / norm
 
 
+prange = range
+
+
 def convolve_sampled(xin, yin, xp, yp, x, dx, y):
+    convolve_sampled_stride(xin, yin, xp, yp, x, dx, y, 0, 1)
+
+
+def convolve_sampled_threaded(xin, yin, xp, yp, x, dx, y, nthreads):
+    # Each thread takes every nthreads-th output point and tracks its own
+    # window start, as with the OpenMP schedule(static,1) firstprivate(in)
+    # loop in the C extension.
+    for start in prange(nthreads):
+        convolve_sampled_stride(xin, yin, xp, yp, x, dx, y, start, nthreads)
+
+
+def convolve_sampled_stride(xin, yin, xp, yp, x, dx, y, start, step):
     Nin = len(xin)
     Np = len(xp)
     N = len(x)
@@ -118,7 +133,7 @@ def convolve_sampled(xin, yin, xp, yp, x, dx, y):
     # ifdef _OPENMP
     # pragma omp parallel for firstprivate(in) schedule(static,1)
     # endif
-    for _out in range(N):
+    for _out in range(start, N, step):
         # /* width of resolution window for x is w = 2 dx ^ 2. */
         limit = -dx[_out] * xp[0]
         xo = x[_out]
@@ -1,5 +1,5 @@
 import sys
-from numpy import pi, sin, cos, radians, sqrt, exp, fabs
+from numpy import pi, sin, cos, radians, sqrt, exp, fabs, array, empty, complex128, int32
 
 EPS = sys.float_info.epsilon
 M_PI = pi
@@ -66,7 +66,9 @@ def calculate_u1_u3(H, rhoM, thetaM, Aguide, u1, u3):
 B2SLD = 2.31604654  # Scattering factor for B field 1e-6
 
 
-def Cr4xa(N, D, SIGMA, IP, RHO, IRHO, RHOM, U1, U3, KZ, POINT, YA, YB, YC, YD):
+def Cr4xa(
+    N, D, SIGMA, IP, RHO, IRHO, RHOM, U1, U3, KZ, POINT, YA, YB, YC, YD, REPEAT_START, REPEAT_LENGTH, REPEAT_COUNT
+):
     EPS = 1e-10
 
     if KZ <= -1.0e-10:
@@ -175,9 +177,34 @@ def Cr4xa(N, D, SIGMA, IP, RHO, IRHO, RHOM, U1, U3, KZ, POINT, YA, YB, YC, YD):
         Z += D[LP]
         L = LP
 
+    #    Repeated blocks are visited in the direction of travel, entering
+    #    at the first slab going up and at the last slab going down.
+    BLOCK = 0 if STEP > 0 else len(REPEAT_START) - 1
+    ENTRY = _block_entry(BLOCK, STEP, REPEAT_START, REPEAT_LENGTH, REPEAT_COUNT)
+    REMAINING = -1
+
     #    Process the loop once for each interior layer, either from
     #    front to back or back to front.
-    for I in range(1, N - 1):
+    I = 1
+    while I < N - 1:
+        if L == ENTRY:
+            #    Walk the first period of the block starting from the identity,
+            #    saving the product so far for when the period is complete.
+            BSAVE = array(
+                (
+                    (B11, B12, B13, B14),
+                    (B21, B22, B23, B24),
+                    (B31, B32, B33, B34),
+                    (B41, B42, B43, B44),
+                )
+            )
+            B11 = B22 = B33 = B44 = 1.0
+            B12 = B13 = B14 = B21 = B23 = B24 = B31 = B32 = B34 = B41 = B42 = B43 = 0.0
+            REMAINING = REPEAT_LENGTH[BLOCK]
+            ZSTART = Z
+            SE1 = S1LP
+            SE3 = S3LP
+
         LP = L + STEP
         S1L = S1LP  # copy from the layer before
         S3L = S3LP
@@ -284,6 +311,32 @@ def Cr4xa(N, D, SIGMA, IP, RHO, IRHO, RHOM, U1, U3, KZ, POINT, YA, YB, YC, YD):
 
         Z += D[LP]
         L = LP
+        I += 1
+
+        REMAINING -= 1
+        if REMAINING == 0:
+            #    All periods but the last are identical apart from the shift in
+            #    depth, so the product over them follows from the first period.
+            COUNT = REPEAT_COUNT[BLOCK]
+            SKIP = REPEAT_LENGTH[BLOCK] * (COUNT - 2)
+            PERIOD = array(
+                (
+                    (B11, B12, B13, B14),
+                    (B21, B22, B23, B24),
+                    (B31, B32, B33, B34),
+                    (B41, B42, B43, B44),
+                )
+            )
+            R = _matmul4(_repeat_product(PERIOD, SE1, SE3, Z - ZSTART, COUNT - 1), BSAVE)
+            B11, B12, B13, B14 = R[0, 0], R[0, 1], R[0, 2], R[0, 3]
+            B21, B22, B23, B24 = R[1, 0], R[1, 1], R[1, 2], R[1, 3]
+            B31, B32, B33, B34 = R[2, 0], R[2, 1], R[2, 2], R[2, 3]
+            B41, B42, B43, B44 = R[3, 0], R[3, 1], R[3, 2], R[3, 3]
+            Z += (Z - ZSTART) * (COUNT - 2)
+            L += STEP * SKIP
+            I += SKIP
+            BLOCK += STEP
+            ENTRY = _block_entry(BLOCK, STEP, REPEAT_START, REPEAT_LENGTH, REPEAT_COUNT)
 
     #    Done computing B = A(N)*...*A(2)*A(1)*I
     DETW = B44 * B22 - B24 * B42
@@ -297,11 +350,79 @@ def Cr4xa(N, D, SIGMA, IP, RHO, IRHO, RHOM, U1, U3, KZ, POINT, YA, YB, YC, YD):
     YD[POINT] = (B23 * B42 - B43 * B22) / DETW  # --
 
 
+def _block_entry(BLOCK, STEP, REPEAT_START, REPEAT_LENGTH, REPEAT_COUNT):
+    """
+    Layer at which the walk enters repeated block *BLOCK*, or -1 if there
+    are no more blocks in the direction of travel.
+    """
+    if BLOCK < 0 or BLOCK >= len(REPEAT_START):
+        return -1
+    if STEP > 0:
+        return REPEAT_START[BLOCK]
+    return REPEAT_START[BLOCK] + REPEAT_LENGTH[BLOCK] * REPEAT_COUNT[BLOCK] - 1
+
+
+def _matmul4(A, B):
+    """Product of 4x4 complex matrices."""
+    C = empty((4, 4), complex128)
+    for i in range(4):
+        for j in range(4):
+            C[i, j] = A[i, 0] * B[0, j] + A[i, 1] * B[1, j] + A[i, 2] * B[2, j] + A[i, 3] * B[3, j]
+    return C
+
+
+def _repeat_product(P, S1, S3, T, n):
+    """
+    Transfer matrix for *n* successive periods of a repeated block given
+    the matrix *P* for the first period.
+
+    The layer matrices include the phase exp(S Z) at the depth Z of each
+    interface, so period m is D^-m P D^m with D = diag(exp(c T)) for period
+    thickness *T* and c = (S1, -S1, S3, -S3) in the first layer of the
+    period.  The product over n periods is then D^-(n-1) (P D)^(n-1) P,
+    with the power computed by repeated squaring.
+    """
+    c = array((S1, -S1, S3, -S3))
+    X = empty((4, 4), complex128)
+    R = empty((4, 4), complex128)
+    for i in range(4):
+        for j in range(4):
+            X[i, j] = P[i, j] * exp(c[j] * T)
+            R[i, j] = P[i, j]
+    k = n - 1
+    while k > 0:
+        if k & 1:
+            R = _matmul4(X, R)
+        k >>= 1
+        if k > 0:
+            X = _matmul4(X, X)
+    for i in range(4):
+        scale = exp(-c[i] * T * (n - 1))
+        for j in range(4):
+            R[i, j] *= scale
+    return R
+
+
 def magnetic_amplitude(d, sigma, rho, irho, rhoM, u1, u3, KZ, rho_index, Ra, Rb, Rc, Rd):
     """
     python version of calculation
     implicit returns: Ra, Rb, Rc, Rd
     """
+    no_repeat = empty(0, int32)
+    magnetic_amplitude_repeat(
+        d, sigma, rho, irho, rhoM, u1, u3, KZ, rho_index, no_repeat, no_repeat, no_repeat, Ra, Rb, Rc, Rd
+    )
+
+
+def magnetic_amplitude_repeat(
+    d, sigma, rho, irho, rhoM, u1, u3, KZ, rho_index, repeat_start, repeat_length, repeat_count, Ra, Rb, Rc, Rd
+):
+    """
+    Magnetic reflectivity amplitude for a stack containing repeated blocks.
+
+    See :func:`refl1d.lib.python.reflectivity.reflectivity_amplitude_repeat`
+    for the description of the repeat arrays.
+    """
     # assert rho_index is None
     layers = len(d)
     points = len(KZ)
@@ -310,11 +431,49 @@ def magnetic_amplitude(d, sigma, rho, irho, rhoM, u1, u3, KZ, rho_index, Ra, Rb,
     # fills in all R++, R+-, R-+, R--, but minus polarization only fills
     # in R-+, R--.
     for i in prange(points):
-        Cr4xa(layers, d, sigma, 1.0, rho, irho, rhoM, u1, u3, KZ[i], i, Ra, Rb, Rc, Rd)
+        Cr4xa(
+            layers,
+            d,
+            sigma,
+            1.0,
+            rho,
+            irho,
+            rhoM,
+            u1,
+            u3,
+            KZ[i],
+            i,
+            Ra,
+            Rb,
+            Rc,
+            Rd,
+            repeat_start,
+            repeat_length,
+            repeat_count,
+        )
 
     # minus polarization
     for i in prange(points):
-        Cr4xa(layers, d, sigma, -1.0, rho, irho, rhoM, u1, u3, KZ[i], i, Ra, Rb, Rc, Rd)
+        Cr4xa(
+            layers,
+            d,
+            sigma,
+            -1.0,
+            rho,
+            irho,
+            rhoM,
+            u1,
+            u3,
+            KZ[i],
+            i,
+            Ra,
+            Rb,
+            Rc,
+            Rd,
+            repeat_start,
+            repeat_length,
+            repeat_count,
+        )
 
 
 BASE_GUIDE_ANGLE = 270.0
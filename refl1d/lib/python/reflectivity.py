@@ -1,4 +1,6 @@
-from numpy import fabs, sqrt, exp
+from numpy import fabs, sqrt, exp, empty, complex128
+
+prange = range
 
 
 def refl(layers, kz, depth, sigma, rho, irho):
@@ -55,9 +57,428 @@ def refl(layers, kz, depth, sigma, rho, irho):
     return B12 / B11
 
 
+def refl_repeat(layers, kz, depth, sigma, rho, irho, repeat_start, repeat_length, repeat_count):
+    """
+    As :func:`refl`, but with the repeated blocks described in
+    :func:`reflectivity_amplitude_repeat` computed as matrix powers.
+    """
+    J = 1j
+
+    # // Check that Q is not too close to zero.
+    # // For negative Q, reverse the layers.
+    cutoff = 1e-10
+    sigma_offset = 0
+    if kz >= cutoff:
+        i_next = 0
+        step = 1
+    elif kz <= -cutoff:
+        i_next = layers - 1
+        step = -1
+        sigma_offset = -1
+    else:
+        return complex(-1, 0)
+
+    # // Since sqrt(1/4 * x) = sqrt(x)/2, I'm going to pull the 1/2 into the
+    # // sqrt to save a multiplication later.
+    pi4 = 12.566370614359172e-6  # // 1e-6 * 4 pi
+    kz_sq = kz * kz + pi4 * rho[i_next]  # // kz^2 + 4 pi Vrho
+    k = fabs(kz)
+
+    B11 = B22 = 1
+    B12 = B21 = 0
+
+    # // Repeated blocks are visited in the direction of travel, entering
+    # // at the first slab going up and at the last slab going down.
+    block = 0 if step > 0 else len(repeat_start) - 1
+    entry = _block_entry(block, step, repeat_start, repeat_length, repeat_count)
+
+    i = 0
+    while i < layers - 1:
+        if i_next == entry:
+            # // Transfer matrix for one period of the repeat.  Periods are
+            # // identical apart from the last, whose top interface may differ,
+            # // so the product over all but the last is P^(count-1).
+            period = repeat_length[block]
+            P11 = P22 = complex(1, 0)
+            P12 = P21 = complex(0, 0)
+            for _ in range(period):
+                k_next, M11, M12, M21, M22 = _layer_matrix(
+                    kz_sq, k, depth[i_next], sigma[sigma_offset + i_next], rho[i_next + step], irho[i_next + step]
+                )
+                P11, P12, P21, P22 = _matmul(M11, M12, M21, M22, P11, P12, P21, P22)
+                i_next += step
+                k = k_next
+            P11, P12, P21, P22 = _matpow(P11, P12, P21, P22, repeat_count[block] - 1)
+            B11, B12, B21, B22 = _matmul(P11, P12, P21, P22, B11, B12, B21, B22)
+            i += period * (repeat_count[block] - 1)
+            i_next += step * period * (repeat_count[block] - 2)
+            block += step
+            entry = _block_entry(block, step, repeat_start, repeat_length, repeat_count)
+            continue
+
+        # // The loop index is not the layer number because we may be reversing
+        # // the stack.  Instead, n is set to the incident layer (which may be
+        # // first or last) and incremented or decremented each time through.
+        k_next = sqrt(kz_sq - pi4 * complex(rho[i_next + step], irho[i_next + step]))
+        F = (k - k_next) / (k + k_next) * exp(-2.0 * k * k_next * sigma[sigma_offset + i_next] ** 2)
+        M11 = exp(J * k * depth[i_next]) if i > 0 else 1.0
+        M22 = exp(-J * k * depth[i_next]) if i > 0 else 1.0
+        M21 = F * M11
+        M12 = F * M22
+
+        # // Multiply existing layers B by new layer M
+        # // We have unrolled the matrix multiply for speed.
+        C1 = B11 * M11 + B21 * M12
+        C2 = B11 * M21 + B21 * M22
+        B11 = C1
+        B21 = C2
+        C1 = B12 * M11 + B22 * M12
+        C2 = B12 * M21 + B22 * M22
+        B12 = C1
+        B22 = C2
+        i_next += step
+        k = k_next
+        i += 1
+
+    # // And we are done.
+    return B12 / B11
+
+
+def _block_entry(block, step, repeat_start, repeat_length, repeat_count):
+    """
+    Slab index at which the walk enters repeated block *block*, or -1 if
+    there are no more blocks in the direction of travel.
+    """
+    if block < 0 or block >= len(repeat_start):
+        return -1
+    if step > 0:
+        return repeat_start[block]
+    return repeat_start[block] + repeat_length[block] * repeat_count[block] - 1
+
+
+def _layer_matrix(kz_sq, k, depth, sigma, rho_next, irho_next):
+    """
+    Transfer matrix across an interior layer of thickness *depth* and the
+    interface with roughness *sigma* above it.  Returns k in the next layer
+    along with the matrix elements M11, M12, M21, M22.
+    """
+    pi4 = 12.566370614359172e-6
+    k_next = sqrt(kz_sq - pi4 * complex(rho_next, irho_next))
+    F = (k - k_next) / (k + k_next) * exp(-2.0 * k * k_next * sigma**2)
+    M11 = exp(1j * k * depth)
+    M22 = exp(-1j * k * depth)
+    return k_next, M11, F * M22, F * M11, M22
+
+
+def _matmul(A11, A12, A21, A22, B11, B12, B21, B22):
+    """Matrix product A B of 2x2 matrices given as (X11, X12, X21, X22)."""
+    return (
+        B11 * A11 + B21 * A12,
+        B12 * A11 + B22 * A12,
+        B11 * A21 + B21 * A22,
+        B12 * A21 + B22 * A22,
+    )
+
+
+def _matpow(P11, P12, P21, P22, n):
+    """Raise a 2x2 matrix to the power n >= 0 by repeated squaring."""
+    R11 = R22 = complex(1, 0)
+    R12 = R21 = complex(0, 0)
+    while n > 0:
+        if n & 1:
+            R11, R12, R21, R22 = _matmul(P11, P12, P21, P22, R11, R12, R21, R22)
+        n >>= 1
+        if n > 0:
+            P11, P12, P21, P22 = _matmul(P11, P12, P21, P22, P11, P12, P21, P22)
+    return R11, R12, R21, R22
+
+
 def reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r):
     layers = len(depth)
     points = len(kz)
-    for i in range(points):
+    for i in prange(points):
         offset = rho_index[i]
         r[i] = refl(layers, kz[i], depth, sigma, rho[offset], irho[offset])
+
+
+def reflectivity_amplitude_repeat(depth, sigma, rho, irho, kz, rho_index, repeat_start, repeat_length, repeat_count, r):
+    """
+    Reflectivity amplitude for a stack containing repeated blocks.
+
+    Block j starts at slab repeat_start[j] and consists of repeat_count[j]
+    copies of the repeat_length[j] slabs that follow.  The slabs must be
+    present in full in depth, sigma, rho and irho, but only the first period
+    of each block and the last is walked; the remainder is computed as a
+    matrix power.  Blocks must be sorted, must not overlap, and must not
+    include the substrate or the surface.  Stacks without repeated blocks
+    are walked by :func:`reflectivity_amplitude`.
+    """
+    if len(repeat_count) == 0:
+        reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r)
+        return
+    layers = len(depth)
+    points = len(kz)
+    for i in prange(points):
+        offset = rho_index[i]
+        r[i] = refl_repeat(
+            layers, kz[i], depth, sigma, rho[offset], irho[offset], repeat_start, repeat_length, repeat_count
+        )
+
+
+def reflectivity_amplitude_batch(depth, sigma, rho, irho, layers, kz, r):
+    """
+    Population version of reflectivity_amplitude.
+
+    Row k of depth, sigma, rho and irho holds the slabs for model k padded
+    to a common length, with layers[k] giving the number of slabs in use.
+    The amplitude of model k at kz[i] is returned in r[k, i].
+    """
+    models = len(layers)
+    points = len(kz)
+    for j in prange(models * points):
+        k = j // points
+        i = j - k * points
+        r[k, i] = refl(layers[k], kz[i], depth[k], sigma[k], rho[k], irho[k])
+
+
+def _walk_matrix(t, layers, kz, kz_sq, depth, sigma, rho, irho):
+    """
+    Transfer matrix for step *t* of the walk through the layers in
+    :func:`refl`, which runs from the last layer to the first if kz < 0.
+    Returns M11, M12, M21, M22.
+    """
+    pi4 = 12.566370614359172e-6
+    if kz > 0:
+        i = t
+        step = 1
+        sigma_index = t
+    else:
+        i = layers - 1 - t
+        step = -1
+        sigma_index = i - 1
+    if t == 0:
+        k = complex(fabs(kz), 0)
+    else:
+        k = sqrt(kz_sq - pi4 * complex(rho[i], irho[i]))
+    k_next = sqrt(kz_sq - pi4 * complex(rho[i + step], irho[i + step]))
+    F = (k - k_next) / (k + k_next) * exp(-2.0 * k * k_next * sigma[sigma_index] ** 2)
+    M11 = exp(1j * k * depth[i]) if t > 0 else complex(1, 0)
+    M22 = exp(-1j * k * depth[i]) if t > 0 else complex(1, 0)
+    return M11, F * M22, F * M11, M22
+
+
+def reflectivity_amplitude_cache(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, r):
+    """
+    Reflectivity amplitude along with the partial transfer matrix products.
+
+    With M_t the matrix for step t of the walk through the layers, prefix[i, t]
+    holds (B11, B12, B21, B22) for B = M_t ... M_0 at kz[i], and suffix[i, t]
+    holds the first row of M_(n-1) ... M_(t+1) for n = layers-1 steps.
+    See :func:`reflectivity_amplitude_update`.
+    """
+    layers = len(depth)
+    points = len(kz)
+    steps = layers - 1
+    for i in prange(points):
+        offset = rho_index[i]
+        q = kz[i]
+        if fabs(q) < 1e-10:
+            r[i] = complex(-1, 0)
+        else:
+            kz_sq = q * q + 12.566370614359172e-6 * rho[offset, 0 if q > 0 else layers - 1]
+            # Walk the layers as in refl, carrying k from one step to the next.
+            if q > 0:
+                i_next, step, sigma_offset = 0, 1, 0
+            else:
+                i_next, step, sigma_offset = layers - 1, -1, -1
+            k = complex(fabs(q), 0)
+            B11 = B22 = complex(1, 0)
+            B12 = B21 = complex(0, 0)
+            for t in range(steps):
+                k, M11, M12, M21, M22 = _layer_matrix(
+                    kz_sq,
+                    k,
+                    depth[i_next] if t > 0 else 0.0,
+                    sigma[sigma_offset + i_next],
+                    rho[offset, i_next + step],
+                    irho[offset, i_next + step],
+                )
+                i_next += step
+                B11, B12, B21, B22 = _matmul(M11, M12, M21, M22, B11, B12, B21, B22)
+                prefix[i, t, 0] = B11
+                prefix[i, t, 1] = B12
+                prefix[i, t, 2] = B21
+                prefix[i, t, 3] = B22
+                # Hold on to the matrix for the suffix pass rather than
+                # recomputing it.  It has the form [[M11, F/M11], [F M11, 1/M11]]
+                # so M11 and F are enough.
+                suffix[i, t, 0] = M11
+                suffix[i, t, 1] = M21 / M11
+            r[i] = B12 / B11
+            S1 = complex(1, 0)
+            S2 = complex(0, 0)
+            for t in range(steps - 1, -1, -1):
+                M11, F = suffix[i, t, 0], suffix[i, t, 1]
+                suffix[i, t, 0] = S1
+                suffix[i, t, 1] = S2
+                S1, S2 = (S1 + S2 * F) * M11, (S1 * F + S2) / M11
+
+
+def reflectivity_amplitude_update(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, first, last, r):
+    """
+    Reflectivity amplitude after changing slabs *first* through *last*.
+
+    *prefix* and *suffix* are the partial products computed by
+    :func:`reflectivity_amplitude_cache` for the slabs before the change.
+    Only the transfer matrices which involve the changed slabs are
+    recomputed, unless the incident medium has changed.
+    """
+    layers = len(depth)
+    points = len(kz)
+    steps = layers - 1
+    for i in prange(points):
+        offset = rho_index[i]
+        q = kz[i]
+        if fabs(q) < 1e-10:
+            r[i] = complex(-1, 0)
+        elif (q > 0 and first == 0) or (q < 0 and last == layers - 1):
+            r[i] = refl(layers, q, depth, sigma, rho[offset], irho[offset])
+        else:
+            # The matrix for the step into a layer depends on the layer and
+            # the one before it in the direction of travel.
+            if q > 0:
+                t0, t1 = first - 1, min(last, steps - 1)
+            else:
+                t0, t1 = layers - 2 - last, min(layers - 1 - first, steps - 1)
+            if t0 > 0:
+                B11, B12, B21, B22 = (
+                    prefix[i, t0 - 1, 0],
+                    prefix[i, t0 - 1, 1],
+                    prefix[i, t0 - 1, 2],
+                    prefix[i, t0 - 1, 3],
+                )
+            else:
+                B11 = B22 = complex(1, 0)
+                B12 = B21 = complex(0, 0)
+            kz_sq = q * q + 12.566370614359172e-6 * rho[offset, 0 if q > 0 else layers - 1]
+            for t in range(t0, t1 + 1):
+                M11, M12, M21, M22 = _walk_matrix(t, layers, q, kz_sq, depth, sigma, rho[offset], irho[offset])
+                B11, B12, B21, B22 = _matmul(M11, M12, M21, M22, B11, B12, B21, B22)
+            S1, S2 = suffix[i, t1, 0], suffix[i, t1, 1]
+            r[i] = (S1 * B12 + S2 * B22) / (S1 * B11 + S2 * B21)
+
+
+def _contract(S1, S2, R11, R12, R21, R22, dM11, dM12, dM21, dM22, T11, r):
+    """
+    Change in r = T12/T11 for T = L M R given the change dM in M, where
+    (S1, S2) is the first row of L.
+    """
+    A1 = S1 * dM11 + S2 * dM21
+    A2 = S1 * dM12 + S2 * dM22
+    dT11 = A1 * R11 + A2 * R21
+    dT12 = A1 * R12 + A2 * R22
+    return (dT12 - r * dT11) / T11
+
+
+def reflectivity_amplitude_gradient(depth, sigma, rho, irho, kz, rho_index, r, dr_depth, dr_sigma, dr_rho, dr_irho):
+    """
+    Reflectivity amplitude and its derivatives with respect to the slab
+    parameters.
+
+    dr_depth[i, j] is the derivative of r[i] with respect to depth[j], and
+    similarly for sigma, rho and irho.  The rho derivatives are with respect
+    to row rho_index[i] of rho and irho.
+
+    The derivative with respect to the matrix for step t of the walk is
+    formed from the product of the matrices before and after it, so the
+    full gradient costs about three times the amplitude calculation.
+    """
+    pi4 = 12.566370614359172e-6
+    layers = len(depth)
+    points = len(kz)
+    steps = layers - 1
+    for i in prange(points):
+        offset = rho_index[i]
+        q = kz[i]
+        for j in range(layers):
+            dr_depth[i, j] = dr_rho[i, j] = dr_irho[i, j] = complex(0, 0)
+        for j in range(steps):
+            dr_sigma[i, j] = complex(0, 0)
+        if fabs(q) < 1e-10:
+            r[i] = complex(-1, 0)
+            continue
+        incident = 0 if q > 0 else layers - 1
+        kz_sq = q * q + pi4 * rho[offset, incident]
+
+        # First row of the product of the matrices after each step.
+        suffix = empty((steps, 2), complex128)
+        S1 = complex(1, 0)
+        S2 = complex(0, 0)
+        for t in range(steps - 1, -1, -1):
+            suffix[t, 0] = S1
+            suffix[t, 1] = S2
+            M11, M12, M21, M22 = _walk_matrix(t, layers, q, kz_sq, depth, sigma, rho[offset], irho[offset])
+            S1, S2 = S1 * M11 + S2 * M21, S1 * M12 + S2 * M22
+        T11 = S1
+        r[i] = S2 / S1
+
+        R11 = R22 = complex(1, 0)
+        R12 = R21 = complex(0, 0)
+        for t in range(steps):
+            if q > 0:
+                n = t
+                n_next = t + 1
+                s = sigma[t]
+                sigma_index = t
+            else:
+                n = layers - 1 - t
+                n_next = n - 1
+                s = sigma[n - 1]
+                sigma_index = n - 1
+            if t == 0:
+                k = complex(fabs(q), 0)
+                E = Einv = complex(1, 0)
+            else:
+                k = sqrt(kz_sq - pi4 * complex(rho[offset, n], irho[offset, n]))
+                E = exp(1j * k * depth[n])
+                Einv = exp(-1j * k * depth[n])
+            k_next = sqrt(kz_sq - pi4 * complex(rho[offset, n_next], irho[offset, n_next]))
+            f = (k - k_next) / (k + k_next)
+            g = exp(-2.0 * k * k_next * s * s)
+            F = f * g
+            M11, M12, M21, M22 = E, F * Einv, F * E, Einv
+            S1, S2 = suffix[t, 0], suffix[t, 1]
+
+            # Changes in k_next through rho and irho of the next layer
+            dF = g * (-2.0 * k / (k + k_next) ** 2) - 2.0 * k * s * s * F
+            dr = _contract(S1, S2, R11, R12, R21, R22, 0.0, dF * Einv, dF * E, 0.0, T11, r[i])
+            dk = -0.5 * pi4 / k_next
+            dr_rho[i, n_next] += dr * dk
+            dr_irho[i, n_next] += dr * dk * 1j
+
+            # Changes in roughness of the interface
+            dF = -4.0 * k * k_next * s * F
+            dr_sigma[i, sigma_index] = _contract(S1, S2, R11, R12, R21, R22, 0.0, dF * Einv, dF * E, 0.0, T11, r[i])
+
+            if t > 0:
+                # Changes in thickness of the layer
+                dE = 1j * k * E
+                dEinv = -1j * k * Einv
+                dr_depth[i, n] = _contract(S1, S2, R11, R12, R21, R22, dE, F * dEinv, F * dE, dEinv, T11, r[i])
+
+                # Changes in k through rho and irho of the layer
+                dE = 1j * depth[n] * E
+                dEinv = -1j * depth[n] * Einv
+                dF = g * (2.0 * k_next / (k + k_next) ** 2) - 2.0 * k_next * s * s * F
+                dr = _contract(S1, S2, R11, R12, R21, R22, dE, dF * Einv + F * dEinv, dF * E + F * dE, dEinv, T11, r[i])
+                dk = -0.5 * pi4 / k
+                dr_rho[i, n] += dr * dk
+                dr_irho[i, n] += dr * dk * 1j
+
+            R11, R12, R21, R22 = _matmul(M11, M12, M21, M22, R11, R12, R21, R22)
+
+        # k in every layer but the incident medium depends on rho - rho_incident.
+        total = complex(0, 0)
+        for j in range(layers):
+            total += dr_rho[i, j]
+        dr_rho[i, incident] = -total
@@ -5,6 +5,12 @@ Run bumps with refl1d plugin.
 The *align* subcommand can be used on a completed DREAM fit to redraw the
 profile contours aligned to a different layer boundary.
 See :func:`refl1d.uncertainty.run_errors` for details.
+
+The *benchmark* subcommand times the reflectivity kernels for each backend.
+See :mod:`refl1d.benchmarks` for details.
+
+The *precompile* subcommand compiles the numba kernels ahead of time.
+See :mod:`refl1d.precompile` for details.
 """
 
 import sys
@@ -47,6 +53,14 @@ def cli():
 
         del sys.argv[1]
         run_errors()
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        from .benchmarks import main
+
+        sys.exit(main(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "precompile":
+        from .precompile import main
+
+        sys.exit(main(sys.argv[2:]))
     else:
         import bumps.cli
 
@@ -0,0 +1,148 @@
+"""
+Compile the numba kernels ahead of time.
+
+The numba backend compiles each kernel on first use and saves the result in
+the numba cache.  On a cluster each fresh worker may start with an empty
+cache and pay several seconds of compilation per kernel.  Instead, populate a
+cache directory once::
+
+    refl1d precompile --cache-dir /shared/refl1d-cache
+
+and point the workers at it with::
+
+    export NUMBA_CACHE_DIR=/shared/refl1d-cache
+
+Numba checks the cache entries against the path and timestamp of the source
+files, so the cache is only valid for the same refl1d installation (for
+example a shared environment or a container image).  It is also specific
+to the CPU and the numba version, so build it on the same kind of machine
+as the workers.  Kernels without a cache entry are compiled as usual.
+
+Kernels with an explicit signature are compiled directly.  The remaining
+kernels are compiled for the argument types seen in practice by running
+them on a small model through the usual refl1d entry points.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+
+from .backends import BACKEND_MODULE_NAMES
+
+NUMBA_BACKENDS = ("numba", "numba_parallel")
+
+
+def set_cache_dir(cache_dir):
+    """
+    Direct the numba cache to *cache_dir*.
+
+    This must be called before the numba kernels are first used.
+    """
+    os.environ["NUMBA_CACHE_DIR"] = os.path.abspath(cache_dir)
+    if "numba" in sys.modules:
+        from numba.core import config
+
+        config.reload_config()
+
+
+def _exercise():
+    """
+    Call the kernels which infer their signature from the arguments.
+    """
+    from .probe.data_loaders.rebin import rebin, rebin2d
+    from .profile import _build_profiles_backend
+    from .sample.reflectivity import calculate_u1_u3, convolve, convolve_sampled
+
+    x = np.linspace(0.0, 1.0, 11)
+    _build_profiles_backend(
+        x, np.array([0.2, 0.5]), np.array([0.05, 0.0]), np.array([[1.0, 2.0, 3.0], [0.0, 0.1, 0.0]])
+    )
+    convolve(x, x, x[1:-1], np.full(9, 0.05))
+    convolve_sampled(x, x, np.linspace(-1, 1, 5), np.ones(5), x[1:-1], np.full(9, 0.05))
+    # Enough points for the threaded kernel in the parallel backend.
+    xo = np.linspace(0.1, 0.9, 512)
+    convolve_sampled(x, x, np.linspace(-1, 1, 5), np.ones(5), xo, np.full(xo.shape, 0.05))
+    rebin(x, np.ones(10), np.linspace(0.0, 1.0, 5))
+    rebin2d(x, x, np.ones((10, 10)), np.linspace(0.0, 1.0, 5), np.linspace(0.0, 1.0, 5))
+    calculate_u1_u3(0.0, np.ones(3), np.full(3, 270.0), 270.0)
+
+
+def _exercise_profile(backend):
+    """
+    Call the profile contraction kernels as :class:`refl1d.profile.Microslabs` does.
+    """
+    n = 10
+    w, sigma = np.ones(n), np.zeros(n - 1)
+    rho, irho = np.linspace(0, 1, n), np.zeros(n)
+    rhoM, thetaM = np.ones(n), np.full(n, 270.0)
+    backend.contract_by_area(w.copy(), sigma.copy(), rho.copy(), irho.copy(), 0.1)
+    backend.contract_by_area_multi(w.copy(), sigma.copy(), np.vstack((rho, rho)), np.vstack((irho, irho)), 0.1)
+    backend.contract_mag(w.copy(), sigma.copy(), rho.copy(), irho.copy(), rhoM.copy(), thetaM.copy(), 0.1)
+    output = np.empty((2 * n, 6), "d")
+    backend.align_magnetic(w, sigma, rho, irho, w, sigma, rhoM, thetaM, output)
+
+
+def precompile(backends=NUMBA_BACKENDS, cache_dir=None, log=None):
+    """
+    Compile all kernels for the numba *backends*, saving them to the cache.
+
+    If *cache_dir* is given, the numba cache is moved there first.  Progress
+    is reported through *log* if it is given.
+    """
+    if cache_dir is not None:
+        set_cache_dir(cache_dir)
+    from . import backends as backend_loader
+
+    previous = backend_loader.backend
+    try:
+        for name in backends:
+            if name not in NUMBA_BACKENDS:
+                raise ValueError(f"Backend {name} is not a numba backend")
+            start = time.perf_counter()
+            module = importlib.import_module(BACKEND_MODULE_NAMES[name])
+            # Looking up a kernel compiles it along with the kernels it calls.
+            for kernel in module.__all__:
+                getattr(module, kernel)
+            # The parallel backend chooses its kernels at call time.
+            kernels = getattr(module, "KERNELS", None)
+            if kernels is not None:
+                kernels.compile_all()
+            backend_loader.backend = module
+            _exercise()
+            _exercise_profile(module)
+            if log is not None:
+                log(f"compiled {name} kernels in {time.perf_counter() - start:.1f} s")
+    finally:
+        backend_loader.backend = previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="refl1d precompile",
+        description="Compile the numba kernels and save them to the numba cache.",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default=",".join(NUMBA_BACKENDS),
+        help="comma separated numba backends (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="cache directory; set NUMBA_CACHE_DIR to this path when running fits",
+    )
+    opts = parser.parse_args(argv)
+    precompile(backends=opts.backend.split(","), cache_dir=opts.cache_dir, log=print)
+    if opts.cache_dir is not None:
+        print(f"Use NUMBA_CACHE_DIR={os.environ['NUMBA_CACHE_DIR']} to load the compiled kernels.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,58 @@
 import argparse
+import os
+import time
 
 import numpy as np
 
+SQRT2PI = np.sqrt(2 * np.pi)
 
-def get_optimal_single_oversampling(model, tolerance=0.05, max_oversampling=201, seed=1, verbose=False):
+
+def fringe_oversampling(dQ, thickness, tolerance=0.05, max_oversampling=201):
+    r"""
+    Number of calculation points needed for each measurement to resolve the
+    Kiessig fringes of a film.
+
+    A film of total *thickness* $D$ produces fringes with period $2\pi/D$
+    in $Q$.  The theory is linearly interpolated between the calculation
+    points when applying the resolution, which for evenly spaced points a
+    distance $h$ apart misestimates a fringe by about $(Dh)^2/12$ of its
+    amplitude, and this error survives the resolution smearing.  The points
+    are drawn at random, and the uneven gaps raise the error to about
+    $(Dh)^2/2$ for a mean spacing $h$.  Drawing $n$ points from a gaussian
+    resolution of width $\Delta Q$ gives a mean spacing of about
+    $\sqrt{2\pi}\,\Delta Q/n$ near the measurement, so the fringe error
+    is held below *tolerance* with
+
+    .. math::
+
+        n = \lceil \sqrt{2\pi}\,\Delta Q\,D / \sqrt{2\,\text{tolerance}} \rceil
+
+    clipped to the range [1, *max_oversampling*].  Measurements whose
+    resolution spans less than a fringe need no extra points.
+
+    Returns an integer array with one count per point of *dQ*.
+    """
+    spacing = np.sqrt(2 * tolerance) / thickness if thickness > 0 else np.inf
+    n = np.ceil(SQRT2PI * np.asarray(dQ, "d") / spacing)
+    return np.clip(n, 1, max_oversampling).astype(int)
+
+
+def resolution_quadrature(n):
+    r"""
+    Gauss-Hermite nodes *z* and weights *w* for averaging over a standard
+    normal resolution.
+
+    The *n* point rule is exact for polynomials of degree $2n-1$, so a
+    smooth reflectivity needs only a handful of nodes where random
+    sampling converges as $1/\sqrt{n}$.  The weights sum to one.
+    """
+    x, w = np.polynomial.hermite.hermgauss(n)
+    return np.sqrt(2) * x, w / np.sqrt(np.pi)
+
+
+def get_optimal_single_oversampling(
+    model, tolerance=0.05, max_oversampling=201, seed=1, verbose=False, method="bisect", stats=None
+):
     """
     Determine how much oversampling is required to adequately calculate resolution smearing
 
@@ -15,16 +64,40 @@ def get_optimal_single_oversampling(model, tolerance=0.05, max_oversampling=201,
       - the value of oversampling at which a point becomes within tolerance is recorded for that point
       - when all points are within tolerance the loop ends and the function reports the recommended oversampling
 
+    With *method="scan"* the oversampling is increased by one on each
+    iteration.  With *method="bisect"* the oversampling for each point is
+    found by doubling until the point is within tolerance then bisecting,
+    and the recommended oversampling is found the same way starting from
+    the largest of these.  The oversampling points are drawn once at
+    *max_oversampling*, with the points for a smaller oversampling being
+    a subset of those for a larger one, so the theory from the reference
+    evaluation is reused and only the resolution is recomputed at each
+    step.
+
     Args:
         model (refl1d.experiment.Experiment): an Experiment, containing probe and sample
         tolerance (float, optional): allowed deviation of R from ideal R (multiplied by dR). Defaults to 0.05
         max_oversampling (int, optional): A very high oversampling that is expected to exceed
             the requirements for support (used to generate reference R). Defaults to 201.
+        method (str, optional): "bisect" or "scan". Defaults to "bisect".
+        stats (dict, optional): if given, it is filled in with the number of
+            model "evaluations" and the wall "time" in seconds.
 
     Returns:
         oversampling (int): suggested oversampling to get all R within tolerance
         optimal_oversampling: for each probe, per-Q array of oversampling needed to get R(Q) within tolerance
     """
+    if method not in ("bisect", "scan"):
+        raise ValueError(f"unknown oversampling search method {method!r}")
+    search = _search_oversampling if method == "bisect" else _scan_oversampling
+    start = time.perf_counter()
+    result, evaluations = search(model, tolerance, max_oversampling, seed, verbose)
+    if stats is not None:
+        stats.update(evaluations=evaluations, time=time.perf_counter() - start)
+    return result
+
+
+def _scan_oversampling(model, tolerance, max_oversampling, seed, verbose):
     # get a list of probes, which will have length one for unpolarized:
     probes = model.probe.xs if hasattr(model.probe, "xs") else [model.probe]
     # sample = model.sample
@@ -44,7 +117,7 @@ def get_optimal_single_oversampling(model, tolerance=0.05, max_oversampling=201,
         oversampling += 1
         if verbose:
             print("trying oversampling = {:d}".format(oversampling), end="\r")
-        model.probe.oversample(oversampling)
+        model.probe.oversample(oversampling, seed=seed)
         model._cache = {}
         R = model.reflectivity()
         if not isinstance(R, list):
@@ -77,28 +150,227 @@ def get_optimal_single_oversampling(model, tolerance=0.05, max_oversampling=201,
     if verbose:
         print("Recommended oversampling: {:d}".format(oversampling))
 
-    return oversampling, optimal_oversampling, Q
+    return (oversampling, optimal_oversampling, Q), oversampling + 1
+
+
+class _NestedOversampling:
+    """
+    Oversampling points for *model* drawn once for *max_oversampling*.
+
+    Points for a smaller oversampling are the first draws for each Q, so
+    the calculation points for any set of per-point oversampling counts
+    are a subset of the reference calculation points.  If the model keeps
+    its theory in the "calc_r" cache entry then the reference theory is
+    reused for the subset rather than recomputed.
+    """
+
+    def __init__(self, model, max_oversampling, seed):
+        self.model = model
+        self.probes = model.probe.xs if hasattr(model.probe, "xs") else [model.probe]
+        self.max_oversampling = max_oversampling
+        rng = np.random.RandomState(seed=seed)
+        self.draws = [
+            None if p is None else rng.standard_normal((2, len(p.Q), max_oversampling - 1)) for p in self.probes
+        ]
+        self.evaluations = 0
+        self.theory = None
+        self.R_ref = self.evaluate([None if p is None else max_oversampling for p in self.probes])
+        amplitude = model._cache.get("calc_r", None)
+        if amplitude is not None:
+            calc_q, calc_r = amplitude
+            self.theory = (calc_q, np.asarray(calc_r), np.argsort(calc_q))
+
+    def evaluate(self, counts):
+        """
+        Reflectivity with counts[k][i] calculation points for Q point i of
+        cross section k.  A scalar count applies to every point.
+        """
+        for p, z, n in zip(self.probes, self.draws, counts):
+            if p is None:
+                continue
+            n = np.broadcast_to(n, p.Q.shape)
+            keep = np.arange(self.max_oversampling - 1)[None, :] < (n - 1)[:, None]
+            if hasattr(p, "T"):
+                T = (p.T[:, None] + p.dT[:, None] * z[0])[keep]
+                L = (p.L[:, None] + p.dL[:, None] * z[1])[keep]
+                p._set_calc(np.hstack((p.T, T)), np.hstack((p.L, L)))
+            else:
+                Q = (p.Q[:, None] + p.dQ[:, None] * z[0])[keep]
+                p.calc_Qo = np.sort(np.hstack((p.Q, Q)))
+        if hasattr(self.model.probe, "xs"):
+            self.model.probe._theta_offsets = None
+        self.model._cache = {}
+        if self.theory is not None:
+            ref_q, ref_r, order = self.theory
+            calc_q = self.model.probe.calc_Q
+            index = order[np.minimum(np.searchsorted(ref_q, calc_q, sorter=order), len(order) - 1)]
+            if np.array_equal(ref_q[index], calc_q):
+                self.model._cache["calc_r"] = calc_q, ref_r[..., index]
+            else:
+                self.theory = None
+        self.evaluations += 1
+        R = self.model.reflectivity()
+        return R if isinstance(R, list) else [R]
+
+    def within_tolerance(self, counts, tolerance):
+        """
+        For each cross section, which points are within *tolerance* of the
+        reference reflectivity given the per-point *counts*.
+        """
+        R = self.evaluate(counts)
+        return [
+            None if p is None else np.abs(r[1] - r_ref[1]) / p.dR <= tolerance
+            for p, r, r_ref in zip(self.probes, R, self.R_ref)
+        ]
+
+
+def _search_oversampling(model, tolerance, max_oversampling, seed, verbose):
+    sampler = _NestedOversampling(model, max_oversampling, seed)
+    probes = sampler.probes
+
+    def within(counts):
+        return sampler.within_tolerance([counts] * len(probes) if np.isscalar(counts) else counts, tolerance)
+
+    # Double the oversampling until every point has been within tolerance
+    # and all points are within tolerance together.  This brackets the
+    # oversampling needed for each point, with lo out of tolerance (or
+    # zero) and hi within tolerance, and the recommended oversampling
+    # between bad and good.  The reference oversampling is always good.
+    lo = [None if p is None else np.zeros(len(p.Q), int) for p in probes]
+    hi = [None if p is None else np.full(len(p.Q), max_oversampling) for p in probes]
+    n, previous, good = 1, 0, None
+    while good is None or any(h is not None and (h == max_oversampling).any() for h in hi):
+        passed = within(n)
+        for k, ok in enumerate(passed):
+            if ok is None:
+                continue
+            found = ok & (hi[k] == max_oversampling)
+            hi[k][found] = n
+            lo[k][found] = previous
+            lo[k][hi[k] == max_oversampling] = n
+        if good is None and all(ok is None or ok.all() for ok in passed):
+            good, bad = n, previous
+        if n >= max_oversampling:
+            break
+        n, previous = min(2 * n, max_oversampling), n
+    if good is None:
+        good, bad = max_oversampling, previous
+
+    # Bisect the brackets for every point at once, keeping the settled
+    # points at their known good oversampling.
+    while any(v is not None and (h - v > 1).any() for v, h in zip(lo, hi)):
+        if verbose:
+            print("bisecting, evaluation {:d}".format(sampler.evaluations), end="\r")
+        mid = [None if v is None else np.where(h - v > 1, (v + h) // 2, h) for v, h in zip(lo, hi)]
+        for k, ok in enumerate(within(mid)):
+            if ok is None:
+                continue
+            active = hi[k] - lo[k] > 1
+            hi[k][active & ok] = mid[k][active & ok]
+            lo[k][active & ~ok] = mid[k][active & ~ok]
+
+    # Bisect the recommended oversampling.
+    while good - bad > 1:
+        mid = (good + bad) // 2
+        if all(ok is None or ok.all() for ok in within(mid)):
+            good = mid
+        else:
+            bad = mid
+
+    # The search used the nested draws, but the probe draws its own points
+    # for the recommended oversampling.  Check those against the reference
+    # as well, stepping up the oversampling until they are within tolerance.
+    while True:
+        model.probe.oversample(good, seed=seed)
+        model._cache = {}
+        sampler.evaluations += 1
+        R = model.reflectivity()
+        R = R if isinstance(R, list) else [R]
+        if good >= max_oversampling or all(
+            p is None or (np.abs(r[1] - r_ref[1]) / p.dR <= tolerance).all()
+            for p, r, r_ref in zip(probes, R, sampler.R_ref)
+        ):
+            break
+        if verbose:
+            print("oversampling {:d} is out of tolerance with the probe draws".format(good))
+        good += 1
+    model._cache = {}
+    if verbose:
+        print("Recommended oversampling: {:d} ({:d} evaluations)".format(good, sampler.evaluations))
+    Q = [None if p is None else p.Q for p in probes]
+    return (good, hi, Q), sampler.evaluations
+
+
+def _analyze_part(part, tolerance, max_oversampling, seed, method):
+    stats = {}
+    result = get_optimal_single_oversampling(part, tolerance, max_oversampling, seed=seed, method=method, stats=stats)
+    return result, stats
+
+
+def _analyze_parts(tasks, workers):
+    """
+    Yield the results of :func:`_analyze_part` for each set of arguments
+    in *tasks*, in order, using *workers* processes.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        for args in tasks:
+            yield _analyze_part(*args)
+        return
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    import refl1d
 
+    # Forking is not safe once the numba parallel kernels have started their
+    # thread pool, so start fresh worker processes.  They use the backend
+    # selected in this process, even if it was chosen with refl1d.use().
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        workers, mp_context=context, initializer=refl1d.use, initargs=(refl1d.BACKEND_NAME,)
+    ) as pool:
+        futures = [pool.submit(_analyze_part, *args) for args in tasks]
+        for future in futures:
+            yield future.result()
 
-def analyze_fitproblem(problem, tolerance=0.05, max_oversampling=201, seed=1, plot=False):
+
+def analyze_fitproblem(problem, tolerance=0.05, max_oversampling=201, seed=1, plot=False, method="bisect", workers=1):
+    """
+    Find the oversampling needed for each model in *problem* using
+    :func:`get_optimal_single_oversampling`, then oversample the models.
+
+    The models are analyzed in *workers* separate processes, or one per
+    CPU if *workers* is zero.  Each worker analyzes a copy of its model,
+    so the oversampling is applied to the models in *problem* once all
+    the results are in.
+    """
     if plot:
         from matplotlib import pyplot as plt
+    start = time.perf_counter()
     models = problem.models if hasattr(problem, "models") else [problem]
+    model_parts = [model.parts if hasattr(model, "parts") else [model] for model in models]
+    tasks = [(part, tolerance, max_oversampling, seed, method) for parts in model_parts for part in parts]
+    results = _analyze_parts(tasks, workers)
     oversampling = []
     local_oversampling = []
-    for i_model, model in enumerate(models):
+    evaluations = 0
+    for i_model, parts in enumerate(model_parts):
         print("model: {:d}".format(i_model))
         oversampling_i = []
         local_oversampling_i = []
         oversampling.append(oversampling_i)
         local_oversampling.append(local_oversampling_i)
-        parts = model.parts if hasattr(model, "parts") else [model]
-        for i_part, part in enumerate(parts):
-            # print(part)
-            oversampling_ii, local_oversampling_ii, Q = get_optimal_single_oversampling(
-                part, tolerance, max_oversampling, seed=seed
+        for i_part in range(len(parts)):
+            (oversampling_ii, local_oversampling_ii, Q), stats = next(results)
+            evaluations += stats["evaluations"]
+            print(
+                "\tpart: {:d}, oversampling: {:d} ({:d} evaluations in {:.2f} s)".format(
+                    i_part, oversampling_ii, stats["evaluations"], stats["time"]
+                )
             )
-            print("\tpart: {:d}, oversampling: {:d}".format(i_part, oversampling_ii))
             oversampling_i.append(oversampling_ii)
             local_oversampling_i.append(local_oversampling_ii)
             if plot:
@@ -113,7 +385,10 @@ def analyze_fitproblem(problem, tolerance=0.05, max_oversampling=201, seed=1, pl
 
         # there is one probe instance shared between parts in MixedExperiment: use
         # largest recommended oversampling.
-        parts[0].probe.oversample(max(oversampling_i))
+        parts[0].probe.oversample(max(oversampling_i), seed=seed)
+        for part in parts:
+            part.update()
+    print("{:d} evaluations in {:.2f} s".format(evaluations, time.perf_counter() - start))
 
     if plot:
         plt.show()
@@ -134,6 +409,9 @@ def main():
       - points are "within tolerance" if (R(Q) - R_ref(Q)) / dR(Q) < tolerance
       - the value of oversampling at which a point becomes within tolerance is recorded for that point
       - when all points are within tolerance the loop ends and the function reports the recommended oversampling
+
+        With --method=bisect (the default) the oversampling is doubled then bisected rather than
+        increased one step at a time, reusing the theory from the reference calculation.
       """,
         formatter_class=argparse.RawTextHelpFormatter,
     )
@@ -154,6 +432,19 @@ def main():
         default=201,
         help="Max oversampling (also used to calculate R_ideal; default=201)",
     )
+    parser.add_argument(
+        "--method",
+        choices=("bisect", "scan"),
+        default="bisect",
+        help="bisect the oversampling, or scan it one step at a time (default = bisect)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to analyze the models, or 0 for one per CPU (default = 1)",
+    )
     parser.add_argument("-p", "--pars", type=str, default="", help="retrieve starting point from .par file")
 
     parser.add_argument("modelfile", type=str, nargs=1, help="refl1d model file")
@@ -165,7 +456,14 @@ def main():
     if opts.pars:
         load_best(problem, opts.pars)
 
-    analyze_fitproblem(problem, opts.tolerance, opts.max_oversampling, opts.plot)
+    analyze_fitproblem(
+        problem,
+        opts.tolerance,
+        opts.max_oversampling,
+        plot=opts.plot,
+        method=opts.method,
+        workers=opts.workers,
+    )
 
 
 if __name__ == "__main__":
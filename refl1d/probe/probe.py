@@ -53,12 +53,19 @@ from numpy import log, pi, sign, sqrt
 from periodictable import nsf, xsf
 
 from ..sample.material import Vacuum
-from ..sample.reflectivity import BASE_GUIDE_ANGLE, convolve
+from ..sample.reflectivity import BASE_GUIDE_ANGLE, convolve, convolve_matrix
 from ..utils import asbytes
 from . import fresnel
+from .oversampling import fringe_oversampling, resolution_quadrature
 from .resolution import QL2T, TL2Q, dQ_broadening, dTdL2dQ
 from .stitch import stitch
 
+# Largest resolution matrix kept by a probe, in weights.  Each takes about
+# 12 bytes, plus temporaries while the matrix is built.  Larger problems are
+# convolved directly on each call, which the numba_parallel backend spreads
+# over threads.
+RESOLUTION_MATRIX_MAX_ENTRIES = 4_000_000
+
 PROBE_KW = (
     "T",
     "dT",
@@ -107,6 +114,15 @@ class BaseProbe:
     plot_shift = 0
     residuals_shift = 0
     show_resolution = True
+    _quadrature = None
+
+    def __getstate__(self):
+        # The resolution matrices are rebuilt on demand, so leave them out
+        # of pickles and copies.
+        state = self.__dict__.copy()
+        state.pop("_resolution_cache", None)
+        state.pop("_quadrature_cache", None)
+        return state
 
     @property
     def calc_Q(self):
@@ -215,7 +231,14 @@ class BaseProbe:
         Apply the instrument resolution function
         """
         Q, dQ = _interpolate_Q(self.Q, self.dQ, interpolation)
-        if np.iscomplex(Rin).any():
+        W = None
+        if interpolation == 0:
+            W = self._quadrature_matrix(Qin)
+            if W is None:
+                W = self._resolution_matrix(Qin, Q, dQ)
+        if W is not None:
+            R = W @ Rin
+        elif np.iscomplex(Rin).any():
             R_real = convolve(Qin, Rin.real, Q, dQ, resolution=self.resolution)
             R_imag = convolve(Qin, Rin.imag, Q, dQ, resolution=self.resolution)
             R = R_real + 1j * R_imag
@@ -223,6 +246,75 @@ class BaseProbe:
             R = convolve(Qin, Rin, Q, dQ, resolution=self.resolution)
         return Q, R
 
+    def _resolution_matrix(self, Qin, Q, dQ):
+        """
+        Return the resolution matrix for calculation points *Qin* and
+        measurement points *Q* with resolution *dQ*, or None.
+
+        The matrix is used when the calculation points and resolution do not
+        depend on fitted parameters such as theta_offset and
+        sample_broadening, and it has at most *RESOLUTION_MATRIX_MAX_ENTRIES*
+        weights.  It is built on first use and kept until the points or
+        resolution change, so the result does not depend on the earlier
+        calls.  Otherwise the convolution is computed directly.
+        """
+        if not self._fixed_resolution():
+            return None
+        cache = getattr(self, "_resolution_cache", None)
+        if (
+            cache is not None
+            and cache[0] == self.resolution
+            and all(np.array_equal(a, b) for a, b in zip(cache[1:4], (Qin, Q, dQ)))
+        ):
+            return cache[4]
+        matrix = convolve_matrix(Qin, Q, dQ, resolution=self.resolution, max_entries=RESOLUTION_MATRIX_MAX_ENTRIES)
+        # Too large a matrix is recorded as None so it is not tried again.
+        self._resolution_cache = (self.resolution, np.array(Qin), np.array(Q), np.array(dQ), matrix)
+        return matrix
+
+    def _fixed_resolution(self):
+        """
+        True if none of the parameters moving the calculation points or the
+        resolution are fitted.
+        """
+        for name in ("theta_offset", "sample_broadening"):
+            par = getattr(self, name, None)
+            if par is not None and not getattr(par, "fixed", False):
+                return False
+        return True
+
+    def _quadrature_nodes(self):
+        """
+        Q values of the quadrature nodes from :meth:`oversample`, or None if
+        the resolution should be applied by convolution.
+        """
+        return None
+
+    def _quadrature_matrix(self, Qin):
+        """
+        Return the matrix of quadrature weights taking the theory at the
+        calculation points *Qin* to the measurement points, or None.
+
+        The nodes are matched to *Qin* by value, so this works for any set
+        of calculation points containing them, such as the union over the
+        cross sections of a polarized measurement.
+        """
+        nodes = self._quadrature_nodes()
+        if nodes is None:
+            return None
+        cache = getattr(self, "_quadrature_cache", None)
+        if cache is not None and np.array_equal(cache[0], Qin) and np.array_equal(cache[1], nodes):
+            return cache[2]
+        from scipy.sparse import csr_matrix
+
+        column = np.minimum(np.searchsorted(Qin, nodes), len(Qin) - 1)
+        matrix = None
+        if np.array_equal(Qin[column], nodes):
+            owner, weights = self._quadrature[:2]
+            matrix = csr_matrix((weights, (owner, column)), shape=(len(self.Q), len(Qin)))
+        self._quadrature_cache = (np.array(Qin), nodes, matrix)
+        return matrix
+
     def apply_beam(self, calc_Q, calc_R, resolution=True, interpolation=0):
         r"""
         Apply factors such as beam intensity, background, backabsorption,
@@ -696,6 +788,10 @@ class Probe(BaseProbe):
     resolution: Literal["normal", "uniform"] = "uniform"
     oversampling: Optional[int] = None
     oversampling_seed: int = 1
+    oversampling_scheme: Literal["random", "hermite", "adaptive"] = "random"
+    oversampling_thickness: Optional[float] = None
+    oversampling_tolerance: float = 0.05
+    oversampling_max: Optional[int] = None
     radiation: Literal["neutron", "xray"] = "xray"
 
     polarized = False
@@ -736,6 +832,10 @@ class Probe(BaseProbe):
         resolution: Literal["normal", "uniform"] = "normal",
         oversampling=None,
         oversampling_seed=1,
+        oversampling_scheme="random",
+        oversampling_thickness=None,
+        oversampling_tolerance=0.05,
+        oversampling_max=None,
     ):
         if T is None or L is None:
             raise TypeError("T and L required")
@@ -763,8 +863,20 @@ class Probe(BaseProbe):
         self.name = name
         self.filename = filename
         self.resolution = resolution
-        if oversampling is not None:
-            self.oversample(oversampling, oversampling_seed)
+        if oversampling_scheme == "adaptive":
+            if oversampling_thickness is None:
+                raise ValueError(
+                    "adaptive oversampling needs oversampling_thickness;"
+                    " use Experiment.adaptive_oversample to take it from the sample"
+                )
+            self.adaptive_oversample(
+                oversampling_thickness,
+                tolerance=oversampling_tolerance,
+                max_oversampling=oversampling_max if oversampling_max is not None else 201,
+                seed=oversampling_seed,
+            )
+        elif oversampling is not None:
+            self.oversample(oversampling, oversampling_seed, scheme=oversampling_scheme)
 
     def _set_TLR(self, T, dT, L, dL, R, dR, dQ):
         # if L is None:
@@ -857,11 +969,22 @@ class Probe(BaseProbe):
         self.calc_T = T[idx]
         self.calc_L = L[idx]
         self.calc_Qo = Q[idx]
+        self._quadrature = None
 
         # Only keep the scattering factors that you need
         self.unique_L = np.unique(self.calc_L)
         self._L_idx = np.searchsorted(self.unique_L, L)
 
+    def _quadrature_nodes(self):
+        # The nodes follow theta_offset, but sample broadening changes the
+        # resolution they were drawn from, so fall back to convolution.
+        if self._quadrature is None or self.sample_broadening.value != 0:
+            return None
+        T, L = self._quadrature[2:]
+        if self.theta_offset.value != 0:
+            T = T + self.theta_offset.value
+        return TL2Q(T=T, L=L)
+
     @property
     def Q(self):
         if self.theta_offset.value != 0:
@@ -1007,8 +1130,8 @@ class Probe(BaseProbe):
         # print Q
         self._set_calc(T, L)
 
-    def oversample(self, n=20, seed=1):
-        """
+    def oversample(self, n=20, seed=1, scheme="random"):
+        r"""
         Generate an over-sampling of Q to avoid aliasing effects.
 
         Oversampling is needed for thick layers, in which the underlying
@@ -1034,16 +1157,75 @@ class Probe(BaseProbe):
 
         Note: :meth:`oversample` will remove the extra Q calculation
         points introduced by :meth:`critical_edge`.
+
+        The random points converge slowly, as $1/\sqrt{n}$.  With
+        *scheme="hermite"* each measurement is instead computed from the
+        $n$ point Gauss-Hermite rule across its gaussian $Q$ resolution,
+        with the nodes placed by varying the angle at the measured
+        wavelength, and the measurement is the weighted sum of the theory
+        at its own nodes.  This replaces the convolution unless theory is
+        requested between the measured points or the sample broadening is
+        not zero.  The rule is exact for reflectivity which is polynomial
+        across the resolution, and 5 to 10 nodes usually match the
+        accuracy of 50 to 100 random points.  It requires
+        *resolution="normal"*.
         """
+        if scheme == "random":
+            rng = numpy.random.RandomState(seed=seed)
+            T = rng.normal(self.T[:, None], self.dT[:, None], size=(len(self.dT), n - 1))
+            L = rng.normal(self.L[:, None], self.dL[:, None], size=(len(self.dL), n - 1))
+            T = np.hstack((self.T, T.flatten()))
+            L = np.hstack((self.L, L.flatten()))
+            self._set_calc(T, L)
+        elif scheme == "hermite":
+            if self.resolution != "normal":
+                raise ValueError("hermite oversampling requires normal resolution")
+            z, w = resolution_quadrature(n)
+            L = np.repeat(self.L, n)
+            T = QL2T(Q=(self.Qo[:, None] + self.dQo[:, None] * z).ravel(), L=L)
+            self._set_calc(T, L)
+            self._quadrature = (np.repeat(np.arange(len(self.T)), n), np.tile(w, len(self.T)), T, L)
+        else:
+            raise ValueError(f"unknown oversampling scheme {scheme!r}")
+        self.oversampling = n
+        self.oversampling_seed = seed
+        self.oversampling_scheme = scheme
+        self.oversampling_thickness = None
+        self.oversampling_max = None
 
+    def adaptive_oversample(self, thickness, tolerance=0.05, max_oversampling=201, seed=1):
+        r"""
+        Oversample each Q point according to the Kiessig fringe spacing of a
+        film of total *thickness*.
+
+        Like :meth:`oversample`, but the number of points drawn for each
+        measurement is chosen by :func:`refl1d.probe.oversampling.fringe_oversampling`
+        from the resolution and the fringe period $2\pi/D$ rather than
+        being the same everywhere.  Measurements with narrow resolution, such
+        as those near the critical edge, get few or no extra points while
+        the broad resolution at high Q gets as many as it needs to keep the
+        interpolation error below *tolerance* times the fringe amplitude.
+
+        The thickness is usually taken from the model, as in
+        :meth:`refl1d.experiment.Experiment.adaptive_oversample`.  It is
+        saved with the probe as *oversampling_thickness*, along with the
+        *tolerance*, the *seed* and *max_oversampling* as *oversampling_max*,
+        with *oversampling_scheme="adaptive"*, so the same points are drawn
+        when the model is reloaded.  *oversampling* is None since the number
+        of points varies from measurement to measurement.  The thickness is not updated as the
+        fit changes the model.
+        """
+        n = fringe_oversampling(self.dQ, thickness, tolerance=tolerance, max_oversampling=max_oversampling)
         rng = numpy.random.RandomState(seed=seed)
-        T = rng.normal(self.T[:, None], self.dT[:, None], size=(len(self.dT), n - 1))
-        L = rng.normal(self.L[:, None], self.dL[:, None], size=(len(self.dL), n - 1))
-        T = np.hstack((self.T, T.flatten()))
-        L = np.hstack((self.L, L.flatten()))
-        self._set_calc(T, L)
-        self.oversampling = n
+        T = rng.normal(np.repeat(self.T, n - 1), np.repeat(self.dT, n - 1))
+        L = rng.normal(np.repeat(self.L, n - 1), np.repeat(self.dL, n - 1))
+        self._set_calc(np.hstack((self.T, T)), np.hstack((self.L, L)))
+        self.oversampling = None
+        self.oversampling_max = max_oversampling
         self.oversampling_seed = seed
+        self.oversampling_scheme = "adaptive"
+        self.oversampling_thickness = float(thickness)
+        self.oversampling_tolerance = tolerance
 
 
 class XrayProbe(Probe):
@@ -1173,6 +1355,12 @@ class ProbeSet(Probe):
 
     oversample.__doc__ = Probe.oversample.__doc__
 
+    def adaptive_oversample(self, thickness, **kw):
+        for p in self.probes:
+            p.adaptive_oversample(thickness, **kw)
+
+    adaptive_oversample.__doc__ = Probe.adaptive_oversample.__doc__
+
     def scattering_factors(self, material, density):
         # TODO: support wavelength dependent systems
         return self.probes[0].scattering_factors(material, density)
@@ -1417,19 +1605,43 @@ class QProbe(BaseProbe):
 
     scattering_factors.__doc__ = Probe.scattering_factors.__doc__
 
-    def oversample(self, n=20, seed=1):
-        rng = numpy.random.RandomState(seed=seed)
-        extra = rng.normal(self.Q, self.dQ, size=(n - 1, len(self.Q)))
-        calc_Q = np.hstack((self.Q, extra.flatten()))
-        self.calc_Qo = np.sort(calc_Q)
+    def oversample(self, n=20, seed=1, scheme="random"):
+        if scheme == "random":
+            rng = numpy.random.RandomState(seed=seed)
+            extra = rng.normal(self.Q, self.dQ, size=(n - 1, len(self.Q)))
+            calc_Q = np.hstack((self.Q, extra.flatten()))
+            self.calc_Qo = np.sort(calc_Q)
+            self._quadrature = None
+        elif scheme == "hermite":
+            if self.resolution != "normal":
+                raise ValueError("hermite oversampling requires normal resolution")
+            z, w = resolution_quadrature(n)
+            Q = (self.Q[:, None] + self.dQ[:, None] * z).ravel()
+            self.calc_Qo = np.sort(Q)
+            self._quadrature = (np.repeat(np.arange(len(self.Q)), n), np.tile(w, len(self.Q)), Q)
+        else:
+            raise ValueError(f"unknown oversampling scheme {scheme!r}")
 
     oversample.__doc__ = Probe.oversample.__doc__
 
+    def _quadrature_nodes(self):
+        return None if self._quadrature is None else self._quadrature[2]
+
+    def adaptive_oversample(self, thickness, tolerance=0.05, max_oversampling=201, seed=1):
+        n = fringe_oversampling(self.dQ, thickness, tolerance=tolerance, max_oversampling=max_oversampling)
+        rng = numpy.random.RandomState(seed=seed)
+        extra = rng.normal(np.repeat(self.Q, n - 1), np.repeat(self.dQ, n - 1))
+        self.calc_Qo = np.sort(np.hstack((self.Q, extra)))
+        self._quadrature = None
+
+    adaptive_oversample.__doc__ = Probe.adaptive_oversample.__doc__
+
     def critical_edge(self, substrate=None, surface=None, n=51, delta=0.25):
         Q_c = self.Q_c(substrate, surface)
         extra = np.linspace(Q_c * (1 - delta), Q_c * (1 + delta), n)
         calc_Q = np.hstack((self.Q, extra, 0))
         self.calc_Qo = np.sort(calc_Q)
+        self._quadrature = None
 
     critical_edge.__doc__ = Probe.critical_edge.__doc__
 
@@ -1607,14 +1819,22 @@ class PolarizedNeutronProbe:
                 x.theta_offset = theta_offset
                 x.sample_broadening = sample_broadening
 
-    def oversample(self, n, seed=1):
+    def oversample(self, n, seed=1, scheme="random"):
         for xs in self.xs:
             if xs is not None:
-                xs.oversample(n, seed=1)
+                xs.oversample(n, seed=1, scheme=scheme)
         self._theta_offsets = None
 
     oversample.__doc__ = Probe.oversample.__doc__
 
+    def adaptive_oversample(self, thickness, tolerance=0.05, max_oversampling=201, seed=1):
+        for xs in self.xs:
+            if xs is not None:
+                xs.adaptive_oversample(thickness, tolerance=tolerance, max_oversampling=max_oversampling, seed=seed)
+        self._theta_offsets = None
+
+    adaptive_oversample.__doc__ = Probe.adaptive_oversample.__doc__
+
     def _calculate_union(self):
         theta_offsets = [x.theta_offset.value for x in self.xs if x is not None]
         if self._theta_offsets is not None and theta_offsets == self._theta_offsets:
@@ -63,6 +63,11 @@ from scipy.special import erf
 
 from .sample.reflectivity import BASE_GUIDE_ANGLE as DEFAULT_THETA_M
 
+# Tolerance on depth (A) when locating repeated blocks after rendering
+Z_TOL = 1e-6
+# Tolerance on slab values when checking that repeated blocks are periodic
+PERIODIC_TOL = 1e-9
+
 
 class Microslabs(object):
     """
@@ -93,6 +98,9 @@ class Microslabs(object):
         self._slabs_mag = np.empty(shape=(0, nprobe, 2))
         self.dz = dz
         self._magnetic_sections = []
+        self._repeats = []
+        self._repeat_blocks = None
+        self._render_cache = {}
         self._z_left = self._z_right = 0.0
         self._z_offset = 0.0
 
@@ -130,24 +138,76 @@ class Microslabs(object):
         """
         self._num_slabs = 0
         self._magnetic_sections = []
+        self._repeats = []
+        self._repeat_blocks = None
 
     def __len__(self):
         return self._num_slabs
 
+    def clear_cache(self):
+        """
+        Forget the slabs saved by :meth:`render_cached`.
+        """
+        self._render_cache = {}
+
+    def render_cached(self, owner, key, render):
+        """
+        Add the slabs for *owner* by calling *render()*, or reuse the slabs
+        it added last time if *key* has not changed.
+
+        The slabs, magnetic sections and repeats added by *render* are
+        saved relative to the top of the profile, so the block can be
+        restored at a different depth when the layers below it change.
+        The cache survives :meth:`clear`.
+        """
+        entry = self._render_cache.get(id(owner), None)
+        if entry is not None and entry[0] is owner and entry[1] == key:
+            _, _, slabs, slabs_rho, sections, repeats = entry
+            z = self.thickness() if self._num_slabs else 0.0
+            n = len(slabs)
+            self._reserve(n)
+            idx = slice(self._num_slabs, self._num_slabs + n)
+            self._slabs[idx, :2] = slabs
+            self._slabs_rho[idx] = slabs_rho
+            self._num_slabs += n
+            self._magnetic_sections.extend((B.copy(), anchor + z, sigma) for B, anchor, sigma in sections)
+            self._repeats.extend((z_start + z, period, count) for z_start, period, count in repeats)
+            return
+
+        start, nmag, nrep = self._num_slabs, len(self._magnetic_sections), len(self._repeats)
+        z = self.thickness() if self._num_slabs else 0.0
+        render()
+        idx = slice(start, self._num_slabs)
+        self._render_cache[id(owner)] = (
+            owner,
+            key,
+            self._slabs[idx, :2].copy(),
+            self._slabs_rho[idx].copy(),
+            [(B.copy(), anchor - z, sigma) for B, anchor, sigma in self._magnetic_sections[nmag:]],
+            [(z_start - z, period, count) for z_start, period, count in self._repeats[nrep:]],
+        )
+
     def repeat(self, start=0, count=1, interface=0):
         """
         Extend the model so that there are *count* versions of the slabs
         from *start* to the final slab.
 
         This is equivalent to L.extend(L[start:]*(count-1)) for list L.
+        Magnetic sections anchored within the repeated slabs are repeated
+        as well.
+
+        The slabs are stored in full so that profiles and slab contraction
+        work as usual, but the repeat is also recorded by depth.  After
+        :meth:`finalize`, any repeat which is still periodic is available
+        in :attr:`repeats`, allowing the reflectivity calculation to raise
+        the transfer matrix for one period to the power *count* rather than
+        walking every slab.
         """
-        # For now use the dumb implementation; a better implementation
-        # would remember the repeats and pre-calculate the matrix product
-        # for the repeating region, saving much work later.  This has
-        # to work in conjunction with interfaces and with magnetic profiles.
         repeats = count - 1
         end = len(self)
         length = end - start
+        period = np.sum(self._slabs[start:end, 0])
+        top_sigma = self._slabs[end - 1, 1] if end > 0 else 0.0
         fromidx = slice(start, end)
         toidx = slice(end, end + repeats * length)
         self._reserve(repeats * length)
@@ -158,8 +218,24 @@ class Microslabs(object):
         # Replace interface on the top
         self._slabs[self._num_slabs - 1, 1] = interface
 
-        if self._magnetic_sections:
-            raise NotImplementedError("Repeated magnetic layers not implemented")
+        z_start = np.sum(self._slabs[1:start, 0])
+        if start > 0 and period > 0:
+            self._repeats.append((z_start, period, count))
+
+        # Repeat the magnetism within the block.  A magnetic layer at the
+        # start of the repeated stack has no interface below it, so use the
+        # nuclear interface, as would happen for a layer in any other stack.
+        first = len(self._magnetic_sections)
+        while first > 0 and self._magnetic_sections[first - 1][1] >= z_start - 1e-6:
+            first -= 1
+        unit = self._magnetic_sections[first:]
+        sections = []
+        for m in range(count):
+            for B, anchor, (s_below, s_above) in unit:
+                if isnan(s_below):
+                    s_below = top_sigma if m > 0 else self._slabs[start - 1, 1] if start > 0 else nan
+                sections.append((B if m == 0 else B.copy(), anchor + m * period, (s_below, s_above)))
+        self._magnetic_sections[first:] = sections
 
     def _reserve(self, nadd):
         """
@@ -293,6 +369,9 @@ class Microslabs(object):
 
         *dA* is the tolerance to use when deciding if similar layers can
         be merged.
+
+        Blocks recorded by :meth:`repeat` which are still periodic after
+        all this are made available in :attr:`repeats`.
         """
         if self.ismagnetic:
             self._align_magnetic_and_nuclear()
@@ -308,6 +387,71 @@ class Microslabs(object):
         else:
             self._contract_profile(dA)
 
+        # Sampled interfaces are not aligned with the repeats.
+        self._repeat_blocks = None if step_interfaces else self._find_repeats()
+
+    @property
+    def repeats(self):
+        """
+        Repeated blocks as integer arrays (start, length, count), or None.
+
+        Block k starts at slab start[k] and holds count[k] copies of the
+        length[k] slabs that follow.  The slabs of each copy are identical
+        except for the interface at the top of the block.  Blocks are
+        sorted, do not overlap, and lie between the substrate and surface.
+        """
+        return self._repeat_blocks
+
+    def _find_repeats(self):
+        """
+        Locate the blocks recorded by :meth:`repeat` in the final slabs.
+
+        Magnetic alignment and slab contraction can change the number of
+        slabs, so blocks are located by depth and kept only if the slabs
+        are still periodic.  Only the outer block of nested repeats is used.
+        """
+        n = self._num_slabs
+        if not self._repeats or n < 3:
+            return None
+
+        # Values which must repeat with each period, with the interface at
+        # the top of the block excluded from the comparison.
+        values = [self.w, np.hstack((self.sigma, 0.0)), *self.rho, *self.irho]
+        if self.ismagnetic:
+            values.extend([self.rhoM, self.thetaM])
+        values = np.vstack(values)
+        # edges[k] is the depth at the top of slab k+1
+        edges = np.cumsum(np.hstack((0.0, self.w[1:])))
+
+        candidates = []
+        for z_start, period, count in self._repeats:
+            if count < 3:
+                continue
+            z_end = z_start + count * period
+            k1 = np.searchsorted(edges, z_start - Z_TOL)
+            k2 = np.searchsorted(edges, z_end + Z_TOL, side="right") - 1
+            if k1 >= n or abs(edges[k1] - z_start) > Z_TOL or abs(edges[k2] - z_end) > Z_TOL:
+                continue
+            start, stop = k1 + 1, k2 + 1
+            length = (stop - start) // count
+            if length < 1 or length * count != stop - start or stop >= n:
+                continue
+            block = values[:, start:stop].copy()
+            block[1, -1] = block[1, length - 1]
+            block = block.reshape(len(values), count, length)
+            if not np.allclose(block, block[:, :1, :], rtol=PERIODIC_TOL, atol=PERIODIC_TOL):
+                continue
+            candidates.append((start, length, count))
+
+        # Keep the blocks with the most savings when they overlap.
+        blocks = []
+        for start, length, count in sorted(candidates, key=lambda b: -(b[2] - 2) * b[1]):
+            if all(start + length * count <= b[0] or b[0] + b[1] * b[2] <= start for b in blocks):
+                blocks.append((start, length, count))
+        if not blocks:
+            return None
+        return tuple(np.array(v, "i") for v in zip(*sorted(blocks)))
+
     def _set_z_range(self):
         """
         Make sure z-range includes 3-sigma around every interface.
@@ -405,10 +549,19 @@ class Microslabs(object):
         if dA is None:
             return
 
-        # TODO: need a separate implementation for multiple wavelengths
         if self.rho.shape[0] > 1:
-            # Note: should at least check for duplicates otherwise thick
-            # layers will get extremely slow
+            # Multiple wavelengths are merged jointly so that the slab
+            # boundaries are the same for every wavelength.
+            kernel = getattr(backend, "contract_by_area_multi", None)
+            if kernel is None:
+                return
+            w, sigma, rho, irho = [np.ascontiguousarray(v, "d") for v in (self.w, self.sigma, self.rho, self.irho)]
+            n = kernel(w, sigma, rho, irho, dA)
+            self._num_slabs = n
+            self.w[:] = w[:n]
+            self.rho[:] = rho[:, :n]
+            self.irho[:] = irho[:, :n]
+            self.sigma[:] = sigma[: n - 1]
             return
 
         w, sigma, rho, irho = [np.ascontiguousarray(v, "d") for v in (self.w, self.sigma, self.rho[0], self.irho[0])]
@@ -100,6 +100,8 @@ class FreeformCheby(Layer):
     polynomial orders.
     """
 
+    cache_render = True
+
     def __init__(self, thickness=0, interface=0, rho=(), irho=(), name="Cheby", method="interp"):
         if interface != 0:
             raise NotImplementedError("interface not yet supported")
@@ -172,6 +174,8 @@ class ChebyVF(Layer):
            sld(z) = material.sld * profile(z) + solvent.sld * (1 - profile(z))
     """
 
+    cache_render = True
+
     def __init__(self, thickness=0, interface=0, material=None, solvent=None, vf=None, name="ChebyVF", method="interp"):
         if interface != 0:
             raise NotImplementedError("interface not yet supported")
@@ -56,6 +56,8 @@ class FunctionalProfile(Layer):
 
     RESERVED = ("thickness", "interface", "profile", "tol", "magnetism", "name")
 
+    cache_render = True
+
     # TODO: test that thickness(z) matches the thickness of the layer
     def __init__(self, thickness=0, interface=0, profile=None, tol=1e-3, magnetism=None, name=None, **kw):
         if not name:
@@ -23,12 +23,13 @@ scattering density may vary with depth in the layer.
 
 __all__ = ["Repeat", "Slab", "Stack", "Layer"]
 
+import weakref
 from copy import copy
 from dataclasses import dataclass, field
 from typing import List, Literal, Optional, Union
 
 import numpy as np
-from bumps.parameter import Calculation, Parameter
+from bumps.parameter import Calculation, Parameter, ValueProtocol, flatten
 
 from .. import profile
 from ..probe.probe import NeutronProbe, XrayProbe
@@ -54,6 +55,11 @@ class Layer:  # Abstract base class
     interface: Optional[Parameter] = None
     magnetism: Optional[BaseMagnetism] = None
 
+    # Layers which are expensive to render set this to True so that the
+    # rendered slabs are reused while the layer parameters are unchanged.
+    # The layer must depend only on its own parameters and the probe.
+    cache_render = False
+
     # Trap calls to set magnetism attr so we can update the magnetism parameter
     # names with the layer name when we assign magnetism to the layer
     def __setattr__(self, name, value):
@@ -157,6 +163,80 @@ class Layer:  # Abstract base class
         return c
 
 
+def _render_layer(layer, probe, slabs):
+    """
+    Render *layer* into *slabs*, reusing the slabs from the previous render
+    if the layer supports caching and its inputs have not changed.
+
+    The inputs are the probe, the values of the layer parameters and the
+    other public attributes of the layer, such as a profile function or a
+    tolerance.  Attributes which are not numbers, strings or arrays are
+    compared by identity, so a function must be replaced rather than
+    modified to trigger a new render.
+    """
+    if not layer.cache_render:
+        layer.render(probe, slabs)
+        return
+    # Magnetism is rendered separately by the stack.
+    pars = layer.layer_parameters()
+    pars.pop("magnetism", None)
+    key = (_SameRef(probe), _render_inputs(layer), *(p.value for p in flatten(pars)))
+    slabs.render_cached(layer, key, lambda: layer.render(probe, slabs))
+
+
+class _SameRef(weakref.ref):
+    """
+    Weak reference which is equal to another only if both refer to the same
+    live object, so a new object at a reused address does not match.
+    """
+
+    def __eq__(self, other):
+        return isinstance(other, weakref.ref) and self() is not None and self() is other()
+
+    __hash__ = None
+
+
+class _Same:
+    """
+    Reference which compares equal to another only if both refer to the
+    same object.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __eq__(self, other):
+        return isinstance(other, _Same) and self.obj is other.obj
+
+    __hash__ = None
+
+
+def _render_inputs(layer):
+    """
+    Snapshot of the public attributes of *layer* other than magnetism, for
+    comparing against the previous render.
+    """
+    return tuple(
+        (name, _snapshot(value))
+        for name, value in sorted(vars(layer).items())
+        if not name.startswith("_") and name != "magnetism"
+    )
+
+
+def _snapshot(value):
+    if isinstance(value, ValueProtocol):
+        return value.value
+    if value is None or isinstance(value, (bool, int, float, complex, str)):
+        return value
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(_snapshot(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((k, _snapshot(v)) for k, v in value.items())
+    return _Same(value)
+
+
 def _parinit(p, v):
     """
     If v is a parameter use v, otherwise use p but with value v.
@@ -348,7 +428,7 @@ class Stack(Layer):
         Render and sld stack in which no layers are magnetic.
         """
         for layer in self._layers:
-            layer.render(probe, slabs)
+            _render_layer(layer, probe, slabs)
 
     def _render_magnetic(self, probe, slabs):
         """
@@ -377,7 +457,7 @@ class Stack(Layer):
                 end_layer = i + magnetism.extent - 1
 
             # Render nuclear layer
-            layer.render(probe, slabs)
+            _render_layer(layer, probe, slabs)
 
             # Wait for end of magnetic layer
             if i == end_layer:
@@ -124,6 +124,8 @@ class FreeInterface(Layer):
     dp: List[Union[float, Par]]
     # inflections: List[Any]
 
+    cache_render = True
+
     def __init__(self, thickness=0, interface=0, below=None, above=None, dz=None, dp=None, name="Interface"):
         self.name = name
         self.below, self.above = below, above
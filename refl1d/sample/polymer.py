@@ -48,7 +48,9 @@ Profile\ [#Cosgrove]_\ [#deVos]_\ [#Sheridan]_
 __all__ = ["PolymerBrush", "PolymerMushroom", "EndTetheredPolymer", "VolumeProfile", "layer_thickness"]
 
 import inspect
+import os
 from collections import OrderedDict
+from pathlib import Path
 from time import time
 
 from bumps.parameter import Parameter
@@ -72,6 +74,13 @@ LAMBDA_ARRAY = np.array([LAMBDA_1, LAMBDA_0, LAMBDA_1])
 MINLAT = 25
 MINBULK = 5
 SQRT_PI = sqrt(pi)
+# Default relative residual for the linear solve in each Newton step of
+# SCFsolve, or None for the scipy schedule.  Each Krylov iteration costs a
+# full sweep of the propagators, and the scipy schedule solves the early
+# steps far more precisely than needed.  0.1 takes about a third fewer
+# sweeps, but the solutions then differ from the scipy schedule by up to
+# the solver tolerance.
+SCF_INNER_RTOL = None
 
 
 class PolymerBrush(Layer):
@@ -123,6 +132,8 @@ class PolymerBrush(Layer):
     length density of the profile.
     """
 
+    cache_render = True
+
     def __init__(
         self,
         thickness=0,
@@ -262,6 +273,8 @@ class VolumeProfile(Layer):
 
     """
 
+    cache_render = True
+
     # TODO: test that thickness(z) matches the thickness of the layer
     def __init__(self, thickness=0, interface=0, name="VolumeProfile", material=None, solvent=None, profile=None, **kw):
         if interface != 0:
@@ -372,6 +385,8 @@ class PolymerMushroom(Layer):
     Solutions are only strictly valid for vf << 1.
     """
 
+    cache_render = True
+
     def __init__(self, thickness=0, interface=0, name="Mushroom", polymer=None, solvent=None, sigma=0, vf=0, delta=0):
         self.thickness = Parameter.default(thickness, name="Mushroom thickness")
         self.interface = Parameter.default(interface, name="Mushroom interface")
@@ -511,6 +526,9 @@ class EndTetheredPolymer(Layer):
             the polymer material
         *solvent*
             the solvent material
+        *inner_rtol*
+            relative residual for the linear solve in each Newton step of
+            :func:`SCFsolve`, or None for the scipy schedule
 
     Previous layer should not have roughness! Use a spline to simulate it.
 
@@ -531,8 +549,14 @@ class EndTetheredPolymer(Layer):
         p_l = \frac16 \frac{1+1/Z}{1-1/Z}
 
     with coordination number $Z = 6$ for a cubic lattice, $p_l = .233$.
+
+    Each new profile is solved by walking from the closest solution found so
+    far.  Call :func:`use_scf_store` in the model file to keep the solutions
+    on disk so that they are shared by the fit workers and later fits.
     """
 
+    cache_render = True
+
     def __init__(
         self,
         thickness=0,
@@ -548,6 +572,7 @@ class EndTetheredPolymer(Layer):
         m_lat=1,
         pdi=1,
         phi_b=0,
+        inner_rtol=SCF_INNER_RTOL,
     ):
         if interface != 0:
             raise NotImplementedError("interface not yet supported")
@@ -567,6 +592,7 @@ class EndTetheredPolymer(Layer):
         self.solvent = solvent
         self.polymer = polymer
         self.name = name
+        self.inner_rtol = inner_rtol
 
     def parameters(self):
         return {
@@ -595,6 +621,7 @@ class EndTetheredPolymer(Layer):
             m_lat=self.m_lat.value,
             pdi=self.pdi.value,
             phi_b=self.phi_b.value,
+            inner_rtol=self.inner_rtol,
         )
 
     def render(self, probe, slabs):
@@ -624,7 +651,19 @@ class EndTetheredPolymer(Layer):
         slabs.extend(rho=[Pr], irho=[Pi], w=Pw)
 
 
-def SCFprofile(z, chi=None, chi_s=None, h_dry=None, l_lat=1, mn=None, m_lat=1, phi_b=0, pdi=1, disp=False):
+def SCFprofile(
+    z,
+    chi=None,
+    chi_s=None,
+    h_dry=None,
+    l_lat=1,
+    mn=None,
+    m_lat=1,
+    phi_b=0,
+    pdi=1,
+    disp=False,
+    inner_rtol=SCF_INNER_RTOL,
+):
     """
     Generate volume fraction profile for Refl1D based on real parameters.
 
@@ -639,6 +678,8 @@ def SCFprofile(z, chi=None, chi_s=None, h_dry=None, l_lat=1, mn=None, m_lat=1, p
 
     This function is suitable for use as a VolumeProfile, as well as the
     default EndTetheredPolymer class.
+
+    *inner_rtol* is the Newton step tolerance passed to :func:`SCFsolve`.
     """
 
     # calculate lattice space parameters
@@ -649,7 +690,7 @@ def SCFprofile(z, chi=None, chi_s=None, h_dry=None, l_lat=1, mn=None, m_lat=1, p
     # solve the self consistent field equations using the cache
     if disp:
         print("\n=====Begin calculations=====\n")
-    phi_lat = SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp)
+    phi_lat = SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp, inner_rtol=inner_rtol)
     if disp:
         print("\n============================\n")
 
@@ -668,55 +709,390 @@ def SCFprofile(z, chi=None, chi_s=None, h_dry=None, l_lat=1, mn=None, m_lat=1, p
     return phi
 
 
+SCF_STORE_CAPACITY = 10000
+# Number of solutions added since the nearest neighbour tree was built
+# which are searched directly before rebuilding the tree.
+SCF_STORE_TAIL = 64
+# Seconds after which the prune lock of a process which died while pruning
+# the store is removed.
+SCF_STORE_LOCK_TIMEOUT = 60
+
+
+class SCFstore:
+    """
+    On-disk store of SCF solutions shared between processes.
+
+    Each solution is saved in *directory* as a .npy file named by the hex
+    digits of its key, which is the scaled parameters followed by the
+    Newton step tolerance if one was given.  The name is appended to the
+    *index* file in the same directory.  The index starts with a random
+    header line which changes whenever the index is rewritten.  Each
+    process reads only the names appended since it last looked, so
+    solutions saved by other processes, such as the workers of a parallel
+    fit, are found by the nearest neighbour search without rescanning the
+    directory.  Solutions are marked as used by touching the file, and once
+    there are more than *capacity* solutions the least recently used are
+    removed and the index is rewritten from the directory listing.
+
+    Only one process prunes at a time, holding the *prune.lock* file.  Names
+    appended while the index is being rewritten are copied to the new index,
+    and a process which appended to the old index after it was replaced
+    appends its name again, so no solutions are lost from the index.
+    """
+
+    def __init__(self, directory, capacity=SCF_STORE_CAPACITY):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self._index = self.directory / "index"
+        self._reset(None)
+
+    def __len__(self):
+        self._refresh()
+        return len(self._names)
+
+    def _reset(self, header):
+        self._header = header
+        self._offset = 0
+        self._names = []
+        self._positions = {}
+        self._keys = np.empty((0, 6))
+        self._tree = None
+        self._tree_size = 0
+        # Number of solutions added by this process since the last refresh.
+        self._unread = 0
+
+    def _refresh(self):
+        """
+        Add the names appended to the index since the last refresh.
+        """
+        try:
+            fid = open(self._index, "rb")
+        except FileNotFoundError:
+            if not self.directory.is_dir() or not self._write_index():
+                return
+            fid = open(self._index, "rb")
+        with fid:
+            header = fid.readline()
+            if header != self._header:
+                # New or rewritten index, so start again from the top.
+                self._reset(header)
+                self._offset = fid.tell()
+            fid.seek(self._offset)
+            data = fid.read()
+        # Skip a name which is still being appended.
+        data = data[: data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        self._unread = 0
+        # Names may be repeated by processes appending while the index is pruned.
+        names = [
+            name
+            for name in dict.fromkeys(data.decode("ascii").split())
+            if len(name) in (96, 112) and name not in self._positions
+        ]
+        if names:
+            self._positions.update((name, len(self._names) + k) for k, name in enumerate(names))
+            self._names.extend(names)
+            keys = np.array([np.frombuffer(bytes.fromhex(name[:96]), "d") for name in names])
+            self._keys = np.vstack((self._keys, keys))
+
+    def _write_index(self, names=None):
+        """
+        Replace the index with *names*, or with the solutions in the
+        directory if *names* is not given.  Returns False on failure.
+        """
+        try:
+            if names is None:
+                names = [entry.name[:-4] for entry in os.scandir(self.directory) if entry.name.endswith(".npy")]
+            partial = self.directory / f"index.{os.getpid()}.tmp"
+            with open(partial, "w") as fid:
+                fid.write(os.urandom(16).hex() + "\n")
+                fid.write("".join(name + "\n" for name in names))
+            os.replace(partial, self._index)
+        except OSError:
+            return False
+        return True
+
+    def _path(self, name):
+        return self.directory / (name + ".npy")
+
+    def nearest(self, key):
+        """
+        Return (key, phi) for the stored solution for *key* if there is one,
+        or else the one whose scaled parameters are closest to those of
+        *key*, or None if the store is empty.  The returned key includes the
+        tolerance, if any, of the stored solution.
+        """
+        from scipy.spatial import cKDTree
+
+        self._refresh()
+        if not self._names:
+            return None
+        index = self._positions.get(np.asarray(key, "d").tobytes().hex(), None)
+        if index is None:
+            if self._tree is None or len(self._names) - self._tree_size > SCF_STORE_TAIL:
+                self._tree, self._tree_size = cKDTree(self._keys), len(self._keys)
+            key = np.asarray(key[:6], "d")
+            distance, index = self._tree.query(key)
+            # Solutions added since the tree was built are checked directly.
+            tail = self._keys[self._tree_size :]
+            if len(tail):
+                squared = np.sum((tail - key) ** 2, axis=1)
+                closest = np.argmin(squared)
+                if squared[closest] < distance**2:
+                    index = self._tree_size + closest
+        path = self._path(self._names[index])
+        try:
+            phi = np.load(path, allow_pickle=False)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Removed or still being written by another process.
+            return None
+        stored = np.frombuffer(bytes.fromhex(self._names[index]), "d")
+        return tuple(float(v) for v in stored), phi
+
+    def add(self, key, phi):
+        """
+        Save the solution *phi* for *key*, which is the scaled parameters
+        followed by the Newton step tolerance if one was given.
+        """
+        name = np.asarray(key, "d").tobytes().hex()
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if self._header is None:
+                # Make sure the index exists before appending to it.
+                self._refresh()
+            # Write to a temporary file first so readers never see a partial entry.
+            partial = self.directory / f"{name}.{os.getpid()}.tmp"
+            with open(partial, "wb") as fid:
+                np.save(fid, np.asarray(phi, "d"), allow_pickle=False)
+            os.replace(partial, self._path(name))
+            self._append(name)
+        except OSError:
+            return
+        # Count the solutions without rereading the index.  Solutions added by
+        # other processes are counted at the next refresh.
+        self._unread += 1
+        if len(self._names) + self._unread > self.capacity:
+            self._prune()
+
+    def _append(self, name):
+        """
+        Append *name* to the index, again if the index was replaced while
+        appending.
+        """
+        while True:
+            with open(self._index, "a") as fid:
+                fid.write(name + "\n")
+                fid.flush()
+                if os.fstat(fid.fileno()).st_ino == os.stat(self._index).st_ino:
+                    return
+
+    def _prune(self):
+        lock = self.directory / "prune.lock"
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # Another process is pruning, unless it died while doing so.
+            try:
+                if time() - os.stat(lock).st_mtime > SCF_STORE_LOCK_TIMEOUT:
+                    os.unlink(lock)
+            except OSError:
+                pass
+            return
+        except OSError:
+            return
+        try:
+            self._compact()
+        except OSError:
+            pass
+        finally:
+            try:
+                os.unlink(lock)
+            except OSError:
+                pass
+        # Start again from the rewritten index at the next refresh.
+        self._reset(None)
+
+    def _compact(self):
+        """
+        Remove the least recently used solutions beyond the capacity and
+        rewrite the index, keeping names appended while doing so.
+        """
+        with open(self._index, "rb") as old:
+            _read_lines(old)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npy"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path, entry.name[:-4]))
+                    except OSError:
+                        pass
+            entries.sort(reverse=True)
+            for _, path, _ in entries[self.capacity :]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            kept = [name for _, _, name in entries[: self.capacity]]
+            # Names appended since the old index was read.
+            if not self._write_index(kept + _read_lines(old)):
+                return
+            # Names appended to the old index before it was replaced.  Names
+            # appended afterwards are appended to the new index by add().
+            appended = _read_lines(old)
+        if appended:
+            with open(self._index, "a") as fid:
+                fid.write("".join(name + "\n" for name in appended))
+
+
+def _read_lines(fid):
+    """
+    Return the complete lines from the current position of *fid*, leaving
+    it at the start of any incomplete line.
+    """
+    start = fid.tell()
+    data = fid.read()
+    data = data[: data.rfind(b"\n") + 1]
+    fid.seek(start + len(data))
+    return data.decode("ascii").split()
+
+
+def scf_store_dir():
+    """
+    Default directory for :class:`SCFstore`, which is *REFL1D_CACHE_DIR*/scf,
+    defaulting to ~/.cache/refl1d/scf.
+    """
+    root = os.environ.get("REFL1D_CACHE_DIR", None)
+    if root is None:
+        root = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "refl1d"
+    return Path(root) / "scf"
+
+
+def use_scf_store(directory=None, capacity=SCF_STORE_CAPACITY):
+    """
+    Save the SCF solutions found by :func:`SCFcache` to an :class:`SCFstore`
+    in *directory*, or :func:`scf_store_dir` if *directory* is not given.
+
+    New processes, such as the workers of a parallel fit, use the same
+    store since it is recorded in the *REFL1D_SCF_STORE* and
+    *REFL1D_SCF_STORE_CAPACITY* environment variables.  Use
+    *directory=False* to stop using the store.
+    """
+    global _SCFstore
+    if directory is False:
+        os.environ.pop("REFL1D_SCF_STORE", None)
+        _SCFstore = None
+        return
+    directory = scf_store_dir() if directory is None else Path(directory)
+    os.environ["REFL1D_SCF_STORE"] = str(directory.absolute())
+    os.environ["REFL1D_SCF_STORE_CAPACITY"] = str(capacity)
+    _SCFstore = SCFstore(directory, capacity=capacity)
+
+
+def _store_from_environment():
+    directory = os.environ.get("REFL1D_SCF_STORE", None)
+    if not directory:
+        return None
+    capacity = int(os.environ.get("REFL1D_SCF_STORE_CAPACITY", SCF_STORE_CAPACITY))
+    return SCFstore(directory, capacity=capacity)
+
+
+_SCFstore = _store_from_environment()
 _SCFcache_dict = OrderedDict()
 
 
-def SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp=False, cache=_SCFcache_dict):
+def SCFcache(
+    chi, chi_s, pdi, sigma, phi_b, segments, disp=False, cache=_SCFcache_dict, store=None, inner_rtol=SCF_INNER_RTOL
+):
     """Return a memoized SCF result by walking from a previous solution.
 
     Using an OrderedDict because I want to prune keys FIFO
+
+    If *store* is None, use the on-disk store set by :func:`use_scf_store`,
+    if any.  The walk then starts from the closest solution in either the
+    cache or the store, and the new solution is added to the store.
+
+    *inner_rtol* is passed to :func:`SCFsolve`.  It is part of the cache
+    and store keys, so a solution is only returned as is for the same
+    tolerance, though the walk may start from a solution for any tolerance.
     """
     try:
         from scipy.optimize import NoConvergence
     except ImportError:
         # cruft for scipy < 1.14, hard breaking change with no warning
         from scipy.optimize.nonlin import NoConvergence
-    # prime the cache with a known easy solutions
-    if not cache:
-        cache[(0, 0, 0, 0.1, 0.1, 0.1)] = SCFsolve(sigma=0.1, phi_b=0.1, segments=50, disp=disp)
-        cache[(0, 0, 0, 0, 0.1, 0.1)] = SCFsolve(sigma=0, phi_b=0.1, segments=50, disp=disp)
-        cache[(0, 0, 0, 0.1, 0, 0.1)] = SCFsolve(sigma=0.1, phi_b=0, segments=50, disp=disp)
-
-    if disp:
-        starttime = time()
+    if store is None:
+        store = _SCFstore
 
     # Try to keep the parameters between 0 and 1. Factors are arbitrary.
     scaled_parameters = (chi, chi_s * 3, pdi - 1, sigma, phi_b, segments / 500)
 
+    def cache_key(p):
+        return tuple(p) if inner_rtol is None else (*p, inner_rtol)
+
     # longshot, but return a cached result if we hit it
-    if scaled_parameters in cache:
+    key = cache_key(scaled_parameters)
+    if key in cache:
         if disp:
             print("SCFcache hit at:", scaled_parameters)
-        phi = cache[scaled_parameters] = cache.pop(scaled_parameters)
+        phi = cache[key] = cache.pop(key)
         return phi
 
-    # Find the closest parameters in the cache: O(len(cache))
+    # The store may have a close solution from this or another process.
+    stored = store.nearest(key) if store is not None else None
 
-    # Numpy setup
-    cached_parameters = tuple(dict.__iter__(cache))
-    cp_array = np.array(cached_parameters)
-    p_array = np.array(scaled_parameters)
+    # prime the cache with a known easy solutions
+    if not cache and stored is None:
+        cache[cache_key((0, 0, 0, 0.1, 0.1, 0.1))] = SCFsolve(
+            sigma=0.1, phi_b=0.1, segments=50, disp=disp, inner_rtol=inner_rtol
+        )
+        cache[cache_key((0, 0, 0, 0, 0.1, 0.1))] = SCFsolve(
+            sigma=0, phi_b=0.1, segments=50, disp=disp, inner_rtol=inner_rtol
+        )
+        cache[cache_key((0, 0, 0, 0.1, 0, 0.1))] = SCFsolve(
+            sigma=0.1, phi_b=0, segments=50, disp=disp, inner_rtol=inner_rtol
+        )
+        if store is not None:
+            for primed, phi in cache.items():
+                store.add(primed, phi)
 
-    # Calculate distances to all cached parameters
-    deltas = p_array - cp_array  # Parameter space displacement vectors
-    closest_index = np.sum(deltas * deltas, axis=1).argmin()
+    if disp:
+        starttime = time()
 
-    # Organize closest point data for later use
-    closest_cp = cached_parameters[closest_index]
-    closest_cp_array = cp_array[closest_index]
-    closest_delta = deltas[closest_index]
+    # Find the closest parameters in the cache: O(len(cache))
 
-    phi = cache[closest_cp] = cache.pop(closest_cp)
+    # Numpy setup
+    p_array = np.array(scaled_parameters)
+    closest_distance = np.inf
+    if cache:
+        cached_parameters = tuple(dict.__iter__(cache))
+        # Walk from the nearest solution for any tolerance.
+        cp_array = np.array([cp[:6] for cp in cached_parameters])
+
+        # Calculate distances to all cached parameters
+        deltas = p_array - cp_array  # Parameter space displacement vectors
+        distances = np.sum(deltas * deltas, axis=1)
+        closest_index = distances.argmin()
+        closest_distance = distances[closest_index]
+
+        # Organize closest point data for later use
+        closest_cp = cached_parameters[closest_index]
+        closest_cp_array = cp_array[closest_index]
+        closest_delta = deltas[closest_index]
+
+        phi = cache[closest_cp] = cache.pop(closest_cp)
+
+    # Walk from the stored solution instead if it is closer.
+    if stored is not None:
+        stored_cp, stored_phi = stored
+        stored_delta = p_array - np.array(stored_cp[:6])
+        if np.sum(stored_delta * stored_delta) < closest_distance:
+            cache[stored_cp] = stored_phi
+            if stored_cp == key:
+                if disp:
+                    print("SCFstore hit at:", scaled_parameters)
+                return stored_phi
+            closest_cp_array, closest_delta, phi = np.array(stored_cp[:6]), stored_delta, stored_phi
 
     if disp:
         print("Walking from nearest:", closest_cp_array)
@@ -760,7 +1136,15 @@ def SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp=False, cache=_SCFcach
 
         try:
             phi = SCFsolve(
-                p_tup[0], p_tup[1] / 3, p_tup[2] + 1, p_tup[3], p_tup[4], p_tup[5] * 500, disp=disp, phi0=phi
+                p_tup[0],
+                p_tup[1] / 3,
+                p_tup[2] + 1,
+                p_tup[3],
+                p_tup[4],
+                p_tup[5] * 500,
+                disp=disp,
+                phi0=phi,
+                inner_rtol=inner_rtol,
             )
         except (NoConvergence, ValueError) as e:
             if isinstance(e, ValueError):
@@ -774,10 +1158,13 @@ def SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp=False, cache=_SCFcach
             if dstep < 1e-5:
                 raise RuntimeError("Cache walk appears to be stuck")
         else:  # Belongs to try, executes if no exception is raised
-            cache[p_tup] = phi
+            cache[cache_key(p_tup)] = phi
             dstep *= 1.05
             step += dstep
 
+    if store is not None:
+        store.add(key, phi)
+
     if disp:
         print("SCFcache execution time:", round(time() - starttime, 3), "s")
 
@@ -788,7 +1175,18 @@ def SCFcache(chi, chi_s, pdi, sigma, phi_b, segments, disp=False, cache=_SCFcach
     return phi
 
 
-def SCFsolve(chi=0, chi_s=0, pdi=1, sigma=None, phi_b=0, segments=None, disp=False, phi0=None, maxiter=30):
+def SCFsolve(
+    chi=0,
+    chi_s=0,
+    pdi=1,
+    sigma=None,
+    phi_b=0,
+    segments=None,
+    disp=False,
+    phi0=None,
+    maxiter=30,
+    inner_rtol=SCF_INNER_RTOL,
+):
     """Solve SCF equations using an initial guess and lattice parameters
 
     This function finds a solution for the equations where the lattice size
@@ -796,6 +1194,11 @@ def SCFsolve(chi=0, chi_s=0, pdi=1, sigma=None, phi_b=0, segments=None, disp=Fal
 
     The Newton-Krylov solver really makes this one. With gmres, it was faster
     than the other solvers by quite a lot.
+
+    Set *inner_rtol* to solve each Newton step to that relative residual
+    rather than following the scipy schedule.  A loose tolerance such as
+    0.1 saves propagator sweeps, but the solution moves by up to the
+    solver tolerance.
     """
 
     from scipy.optimize import newton_krylov
@@ -830,6 +1233,8 @@ def SCFsolve(chi=0, chi_s=0, pdi=1, sigma=None, phi_b=0, segments=None, disp=Fal
     def curried_SCFeqns(phi):
         return SCFeqns(phi, chi, chi_s, sigma, segments, p_i, phi_b)
 
+    inner_kw = {} if inner_rtol is None else {"inner_rtol": inner_rtol}
+
     while lattice_too_small:
         if disp:
             print("Solving SCF equations")
@@ -843,6 +1248,7 @@ def SCFsolve(chi=0, chi_s=0, pdi=1, sigma=None, phi_b=0, segments=None, disp=Fal
                         verbose=bool(disp),
                         maxiter=maxiter,
                         method=jac_solve_method,
+                        **inner_kw,
                     )
                 )
         except RuntimeError as e:
@@ -1004,54 +1410,97 @@ def SCFeqns(phi_z, chi, chi_s, sigma, n_avg, p_i, phi_b=0):
 
 
 def calc_phi_z(g_z, n_avg, sigma, phi_b, u_z_avg=0, p_i=None):
+    """
+    Volume fraction profile for the chains given the Boltzmann weights *g_z*.
+
+    The forward propagator for each segment is composed with the reverse
+    propagator for the complementary segment.  Rather than holding both
+    propagators for all segments, the forward propagator is saved at
+    intervals by :func:`propagate` and rebuilt one block at a time by
+    :func:`compose_blocks` as the reverse propagator is walked.
+    """
     if p_i is None:
         segments = n_avg
         uniform = True
     else:
         segments = p_i.size
         uniform = segments == round(n_avg)
-
-    g_zs = Propagator(g_z, segments)
+    segments = int(segments)
 
     # for terminally attached chains
     if sigma:
-        g_zs_ta = g_zs.ta()
+        start = np.zeros(g_z.size)
+        start[0] = g_z[0]
+        checkpoints, totals = propagate(g_z, start, segments)
 
         if uniform:
-            c_i_ta = sigma / np.sum(g_zs_ta[:, -1])
-            g_zs_ta_ngts = g_zs.ngts_u(c_i_ta)
+            c_i_ta = np.zeros(segments)
+            c_i_ta[-1] = sigma / totals[-1]
         else:
-            c_i_ta = sigma * p_i / np.sum(g_zs_ta, axis=0)
-            g_zs_ta_ngts = g_zs.ngts(c_i_ta)
+            c_i_ta = sigma * p_i / totals
 
-        phi_z_ta = compose(g_zs_ta, g_zs_ta_ngts, g_z)
+        phi_z_ta = compose_blocks(g_z, checkpoints, c_i_ta)
     else:
         phi_z_ta = 0
 
     # for free chains
     if phi_b:
-        g_zs_free = g_zs.free()
+        checkpoints, _ = propagate(g_z, g_z, segments)
 
         if uniform:
             r_i = segments
             c_free = phi_b / r_i
             normalizer = exp(u_z_avg * r_i)
-            c_free = c_free * normalizer
-            g_zs_free_ngts = g_zs.ngts_u(c_free)
+            c_i_free = np.zeros(segments)
+            c_i_free[-1] = c_free * normalizer
         else:
             r_i = np.arange(1, segments + 1)
             c_i_free = phi_b * p_i / r_i
             normalizer = exp(u_z_avg * r_i)
             c_i_free = c_i_free * normalizer
-            g_zs_free_ngts = g_zs.ngts(c_i_free)
 
-        phi_z_free = compose(g_zs_free, g_zs_free_ngts, g_z)
+        phi_z_free = compose_blocks(g_z, checkpoints, c_i_free)
     else:
         phi_z_free = 0
 
     return phi_z_ta + phi_z_free
 
 
+def propagate(g_z, start, segments):
+    """
+    Walk the forward propagator from *start* for *segments* segments.
+
+    Returns the propagator at every *block* segments, with *block* about
+    the square root of *segments*, along with the total weight of each
+    segment.  Memory use is O(layers * sqrt(segments)) rather than the
+    O(layers * segments) needed for :class:`Propagator`.
+    """
+    block = int(np.ceil(np.sqrt(segments)))
+    checkpoints = np.empty(((segments - 1) // block + 1, g_z.size))
+    totals = np.empty(segments)
+    _propagate(g_z, np.asarray(start, "d"), LAMBDA_0, LAMBDA_1, block, checkpoints, totals)
+    return checkpoints, totals
+
+
+def compose_blocks(g_z, checkpoints, c_i):
+    """
+    Compose the forward propagator saved by :func:`propagate` with the
+    reverse propagator for the free ends, with weight *c_i* for the chains
+    of each length.
+
+    This is equivalent to :func:`compose` for the propagators from
+    :class:`Propagator`, but the forward propagator is rebuilt from the
+    checkpoints one block at a time, in reverse, as the reverse propagator
+    is walked.  This costs one more pass of the forward propagator.
+    """
+    segments = len(c_i)
+    block = int(np.ceil(segments / len(checkpoints)))
+    phi = np.zeros(g_z.size)
+    buffer = np.empty((block, g_z.size))
+    _compose_blocks(g_z, checkpoints, np.asarray(c_i, "d"), LAMBDA_0, LAMBDA_1, buffer, phi)
+    return phi / g_z
+
+
 def compose(g_zs, g_zs_ngts, g_z):
     prod = g_zs * np.fliplr(g_zs_ngts)
     prod[np.isnan(prod)] = 0
@@ -1136,8 +1585,88 @@ if USE_NUMBA:
                 g_zs[k, r + 1] = (g_zs[k, r] * f0 + (g_zs[k - 1, r] + g_zs[k + 1, r]) * f1 + c_ir) * g_z[k]
             g_zs[-1, r + 1] = (g_zs[-2, r] * f1 + g_zs[-1, r] * f0 + c_ir) * g_z[-1]
 
+    @njit("(f8[:], f8[:], f8[:], f8, f8, f8)", cache=True)
+    def _step(g_z, src, dst, f0, f1, c):
+        points = len(g_z)
+        dst[0] = (src[0] * f0 + src[1] * f1 + c) * g_z[0]
+        for k in range(1, points - 1):
+            dst[k] = (src[k] * f0 + (src[k - 1] + src[k + 1]) * f1 + c) * g_z[k]
+        dst[-1] = (src[-2] * f1 + src[-1] * f0 + c) * g_z[-1]
+
+    @njit("(f8[:], f8[:], f8, f8, i8, f8[:, :], f8[:])", cache=True)
+    def _propagate(g_z, start, f0, f1, block, checkpoints, totals):
+        segments = len(totals)
+        current, following = start.copy(), np.empty_like(start)
+        for s in range(segments):
+            if s % block == 0:
+                checkpoints[s // block, :] = current
+            totals[s] = np.sum(current)
+            if s < segments - 1:
+                _step(g_z, current, following, f0, f1, 0.0)
+                current, following = following, current
+
+    @njit("(f8[:], f8[:, :], f8[:], f8, f8, f8[:, :], f8[:])", cache=True)
+    def _compose_blocks(g_z, checkpoints, c_i, f0, f1, buffer, phi):
+        points, segments = len(g_z), len(c_i)
+        block = buffer.shape[0]
+        # Reverse propagator for the free ends, starting at r = 0.
+        current = c_i[-1] * g_z
+        following = np.empty_like(current)
+        r = 0
+        for b in range(len(checkpoints) - 1, -1, -1):
+            # Rebuild forward segments first, ..., first + count - 1.
+            first = b * block
+            count = min(block, segments - first)
+            buffer[0, :] = checkpoints[b]
+            for j in range(1, count):
+                _step(g_z, buffer[j - 1], buffer[j], f0, f1, 0.0)
+            # Segment s = first + j pairs with the reverse segment r = segments - 1 - s.
+            for j in range(count - 1, -1, -1):
+                for k in range(points):
+                    prod = buffer[j, k] * current[k]
+                    if prod == prod:
+                        phi[k] += prod
+                r += 1
+                if r < segments:
+                    _step(g_z, current, following, f0, f1, c_i[segments - r - 1])
+                    current, following = following, current
+
 else:
 
+    def _step(g_z, src, dst, f0, f1, c):
+        dst[:] = (old_correlate(src, np.array([f1, f0, f1]), 1) + c) * g_z
+
+    def _propagate(g_z, start, f0, f1, block, checkpoints, totals):
+        segments = len(totals)
+        current, following = start.copy(), np.empty_like(start)
+        for s in range(segments):
+            if s % block == 0:
+                checkpoints[s // block, :] = current
+            totals[s] = np.sum(current)
+            if s < segments - 1:
+                _step(g_z, current, following, f0, f1, 0.0)
+                current, following = following, current
+
+    def _compose_blocks(g_z, checkpoints, c_i, f0, f1, buffer, phi):
+        segments = len(c_i)
+        block = buffer.shape[0]
+        current = c_i[-1] * g_z
+        following = np.empty_like(current)
+        r = 0
+        for b in range(len(checkpoints) - 1, -1, -1):
+            first = b * block
+            count = min(block, segments - first)
+            buffer[0, :] = checkpoints[b]
+            for j in range(1, count):
+                _step(g_z, buffer[j - 1], buffer[j], f0, f1, 0.0)
+            for j in range(count - 1, -1, -1):
+                prod = buffer[j] * current
+                phi += np.where(np.isnan(prod), 0.0, prod)
+                r += 1
+                if r < segments:
+                    _step(g_z, current, following, f0, f1, c_i[segments - r - 1])
+                    current, following = following, current
+
     def _calc_g_zs(g_z, c_i, g_zs, f0, f1):
         coeff = np.array([f1, f0, f1])
         pg_zs = g_zs[:, 0]
@@ -17,10 +17,15 @@ __author__ = "Paul Kienzle"
 __all__ = [
     "reflectivity",
     "reflectivity_amplitude",
+    "reflectivity_amplitude_batch",
+    "reflectivity_amplitude_cache",
+    "reflectivity_amplitude_update",
+    "reflectivity_amplitude_gradient",
     "magnetic_reflectivity",
     "magnetic_amplitude",
     "unpolarized_magnetic",
     "convolve",
+    "convolve_matrix",
 ]
 
 import numpy as np
@@ -72,6 +77,7 @@ def reflectivity_amplitude(
     irho=0,
     sigma=0,
     rho_index=None,
+    repeats=None,
 ):
     r"""
     Calculate reflectivity amplitude $r(k_z)$ from slab model.
@@ -93,6 +99,11 @@ def reflectivity_amplitude(
             Points at which to evaluate the reflectivity
         *rho_index* = 0 : integer[M]
             *rho* and *irho* columns to use for the various kz.
+        *repeats* = None : (integer[B], integer[B], integer[B])
+            Start, length and count of repeated blocks within the slabs,
+            as returned by :attr:`refl1d.profile.Microslabs.repeats`.  The
+            slabs must still be given in full; the repeat information lets
+            the backend compute the block as a matrix power.
 
     :Returns:
         *r* | complex[M]
@@ -102,6 +113,25 @@ def reflectivity_amplitude(
     """
     from ..backends import backend
 
+    kz, depth, rho, irho, sigma, rho_index = _slab_arrays(kz, depth, rho, irho, sigma, rho_index)
+    r = np.empty(kz.shape, "D")
+    # print "amplitude", depth, rho, kz, rho_index
+    # print depth.shape, sigma.shape, rho.shape, irho.shape, kz.shape
+    kernel = getattr(backend, "reflectivity_amplitude_repeat", None)
+    if repeats is not None and len(repeats[0]) and kernel is not None:
+        start, length, count = [_dense(v, "i") for v in repeats]
+        kernel(depth, sigma, rho, irho, kz, rho_index, start, length, count, r)
+    else:
+        backend.reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r)
+
+    return r
+
+
+def _slab_arrays(kz, depth, rho, irho, sigma, rho_index):
+    """
+    Convert the arguments to :func:`reflectivity_amplitude` to the arrays
+    expected by the backend kernels.
+    """
     kz = _dense(kz, "d")
     if rho_index is None:
         rho_index = np.zeros(kz.shape, "i")
@@ -129,11 +159,141 @@ def reflectivity_amplitude(
     # irho[irho < 0] = 0.
     # print depth.shape, rho.shape, irho.shape, sigma.shape
     # print depth.dtype, rho.dtype, irho.dtype, sigma.dtype
+    return kz, depth, rho, irho, sigma, rho_index
+
+
+def reflectivity_amplitude_cache(kz=None, depth=None, rho=None, irho=0, sigma=0, rho_index=None):
+    r"""
+    Calculate reflectivity amplitude $r(k_z)$ from slab model, saving the
+    partial transfer matrix products for :func:`reflectivity_amplitude_update`.
+
+    The parameters are as for :func:`reflectivity_amplitude`.
+
+    :Returns:
+        *r* | complex[M]
+            Complex reflectivity waveform.
+        *cache* | object
+            Partial products, or None if the backend does not support them.
+
+    The cache uses 96 bytes per kz point per slab.
+    """
+    from ..backends import backend
+
+    if not hasattr(backend, "reflectivity_amplitude_cache"):
+        return reflectivity_amplitude(kz, depth, rho, irho, sigma, rho_index), None
+    kz, depth, rho, irho, sigma, rho_index = _slab_arrays(kz, depth, rho, irho, sigma, rho_index)
+    steps = max(len(depth) - 1, 0)
+    prefix = np.empty((len(kz), steps, 4), "D")
+    suffix = np.empty((len(kz), steps, 2), "D")
     r = np.empty(kz.shape, "D")
-    # print "amplitude", depth, rho, kz, rho_index
-    # print depth.shape, sigma.shape, rho.shape, irho.shape, kz.shape
-    backend.reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r)
+    backend.reflectivity_amplitude_cache(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, r)
+    return r, (prefix, suffix)
+
+
+def reflectivity_amplitude_update(cache, first, last, kz=None, depth=None, rho=None, irho=0, sigma=0, rho_index=None):
+    r"""
+    Calculate reflectivity amplitude $r(k_z)$ for a slab model which differs
+    from the cached model only in slabs *first* through *last*.
+
+    *cache* is returned from :func:`reflectivity_amplitude_cache` for the
+    original model, with the same *kz* and number of slabs.  The remaining
+    parameters are as for :func:`reflectivity_amplitude`, and describe the
+    new model.
+
+    Only the transfer matrices which involve the changed slabs are
+    computed, so the cost is independent of the number of slabs when
+    a single layer changes.  This is useful for numerical derivatives.
+    """
+    from ..backends import backend
+
+    kz, depth, rho, irho, sigma, rho_index = _slab_arrays(kz, depth, rho, irho, sigma, rho_index)
+    prefix, suffix = cache
+    r = np.empty(kz.shape, "D")
+    backend.reflectivity_amplitude_update(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, first, last, r)
+    return r
+
+
+def reflectivity_amplitude_gradient(kz=None, depth=None, rho=None, irho=0, sigma=0, rho_index=None):
+    r"""
+    Calculate reflectivity amplitude $r(k_z)$ from slab model along with
+    its derivatives with respect to the slab parameters.
+
+    The parameters are as for :func:`reflectivity_amplitude`.
+
+    :Returns:
+        *r* | complex[M]
+            Complex reflectivity waveform.
+        *dr* | (complex[M, N], complex[M, N-1], complex[M, N], complex[M, N])
+            Derivatives of *r* with respect to *depth*, *sigma*, *rho* and
+            *irho*, or None if the backend does not support them.
+
+    The *rho* derivative for each point is with respect to the row of *rho*
+    selected by *rho_index*.  Since the absorption is computed from
+    abs(*irho*), the *irho* derivative is with respect to abs(*irho*).
+    """
+    from ..backends import backend
+
+    if not hasattr(backend, "reflectivity_amplitude_gradient"):
+        return reflectivity_amplitude(kz, depth, rho, irho, sigma, rho_index), None
+    kz, depth, rho, irho, sigma, rho_index = _slab_arrays(kz, depth, rho, irho, sigma, rho_index)
+    layers = len(depth)
+    r = np.empty(kz.shape, "D")
+    dr = tuple(np.empty((len(kz), n), "D") for n in (layers, layers - 1, layers, layers))
+    backend.reflectivity_amplitude_gradient(depth, sigma, rho, irho, kz, rho_index, r, *dr)
+    return r, dr
+
+
+def reflectivity_amplitude_batch(kz, depth, rho, irho=None, sigma=None):
+    r"""
+    Calculate reflectivity amplitude $r(k_z)$ for a population of slab models.
 
+    :Parameters :
+        *kz* : float[M] | |1/Ang|
+            Points at which to evaluate the reflectivity, shared by all models
+        *depth* : [float[N_k]] | |Ang|
+            Thickness of the individual layers for each model k.  The
+            models may have different numbers of layers.
+        *rho*, *irho* = None: [float[N_k]] | |1e-6/Ang^2|
+            Real and imaginary scattering length density for each model.
+            Only one wavelength column is supported.
+        *sigma* = None : [float[N_k-1]] | |Ang|
+            Interface roughness for each model.
+
+    :Returns:
+        *r* | complex[K, M]
+            Complex reflectivity waveform for each model.
+
+    The slabs are padded to a common length and evaluated with a single call
+    to the backend kernel.  Backends without a batch kernel evaluate the
+    models one at a time.
+    """
+    from ..backends import backend
+
+    kz = _dense(kz, "d")
+    nmodels = len(depth)
+    layers = np.array([len(d) for d in depth], "i")
+    nmax = max(layers.max(), 2) if nmodels else 2
+    D, S, P, I = [np.zeros((nmodels, n), "d") for n in (nmax, nmax - 1, nmax, nmax)]
+    for k, n in enumerate(layers):
+        D[k, :n] = depth[k]
+        P[k, :n] = rho[k]
+        if irho is not None:
+            I[k, :n] = np.abs(irho[k])
+        if sigma is not None:
+            S[k, : n - 1] = sigma[k]
+    I += 1e-30
+    r = np.empty((nmodels, len(kz)), "D")
+    kernel = getattr(backend, "reflectivity_amplitude_batch", None)
+    if kernel is not None:
+        kernel(D, S, P, I, layers, kz, r)
+    else:
+        rho_index = np.zeros(kz.shape, "i")
+        for k, n in enumerate(layers):
+            r_k = np.empty(kz.shape, "D")
+            backend.reflectivity_amplitude(
+                D[k, :n], S[k, : n - 1], P[k : k + 1, :n], I[k : k + 1, :n], kz, rho_index, r_k
+            )
+            r[k] = r_k
     return r
 
 
@@ -203,11 +363,13 @@ def magnetic_amplitude(
     Aguide=-90,
     H=0,
     rho_index=None,
+    repeats=None,
 ):
     """
     Returns the complex magnetic reflectivity waveform.
 
-    See :class:`magnetic_reflectivity <refl1d.sample.reflectivity.magnetic_reflectivity>` for details.
+    See :class:`magnetic_reflectivity <refl1d.sample.reflectivity.magnetic_reflectivity>` for details,
+    and :func:`reflectivity_amplitude` for *repeats*.
     """
     from ..backends import backend
 
@@ -235,7 +397,12 @@ def magnetic_amplitude(
     sld_b, u1, u3 = calculate_u1_u3(H, rhoM, thetaM, Aguide)
 
     R1, R2, R3, R4 = [np.empty(kz.shape, "D") for pol in (1, 2, 3, 4)]
-    backend.magnetic_amplitude(depth, sigma, rho, irho, sld_b, u1, u3, kz, rho_index, R1, R2, R3, R4)
+    kernel = getattr(backend, "magnetic_amplitude_repeat", None)
+    if repeats is not None and len(repeats[0]) and kernel is not None:
+        start, length, count = [_dense(v, "i") for v in repeats]
+        kernel(depth, sigma, rho, irho, sld_b, u1, u3, kz, rho_index, start, length, count, R1, R2, R3, R4)
+    else:
+        backend.magnetic_amplitude(depth, sigma, rho, irho, sld_b, u1, u3, kz, rho_index, R1, R2, R3, R4)
     return R1, R2, R3, R4
 
 
@@ -330,6 +497,138 @@ def convolve(xi, yi, x, dx, resolution="normal"):
     return y
 
 
+def convolve_matrix(xi, x, dx, resolution="normal", max_entries=None):
+    r"""
+    Return the sparse matrix *W* for which *W @ yi* is :func:`convolve`.
+
+    The convolution is linear in the theory values *yi*, so for fixed
+    calculation points *xi*, measurement points *x* and widths *dx* it can
+    be precomputed.  Row *k* holds the weights of the theory points within
+    the resolution window of *x[k]*.  The matrix is returned in CSR format.
+
+    If *max_entries* is given, None is returned rather than building a
+    matrix with more than *max_entries* weights.
+    """
+    from scipy.sparse import csr_matrix
+
+    xi, x, dx = _dense(xi), _dense(x), _dense(dx)
+    if resolution == "uniform":
+        entries = _uniform_weights(xi, x, dx, max_entries)
+    else:
+        entries = _gaussian_weights(xi, x, dx, max_entries)
+    if entries is None:
+        return None
+    rows, cols, weights = entries
+    # Duplicate entries are summed when converting to CSR.
+    return csr_matrix((weights, (rows, cols)), shape=(len(x), len(xi)))
+
+
+SQRT2 = 1.41421356237309504880
+SQRT2PI = 2.50662827463100050241
+LOG_RESLIMIT = -6.90775527898213703123
+
+
+def _gaussian_weights(xin, x, dx, max_entries=None):
+    """
+    Weights for the gaussian resolution, following the windows and
+    normalization of the convolve_gaussian kernels, or None if there
+    would be more than *max_entries*.
+    """
+    from scipy.special import erf
+
+    Nin = len(xin)
+    limit = np.sqrt(-2.0 * dx * dx * LOG_RESLIMIT)
+
+    # Window from the last input point at or before x - limit to the first
+    # input point at or after x + limit, with at least one interval.
+    left = x - limit
+    start = np.searchsorted(xin, left, "left")
+    exact = (start < Nin) & (xin[np.minimum(start, Nin - 1)] == left)
+    start = np.clip(np.where(exact, start, start - 1), 0, Nin - 1)
+    stop = np.searchsorted(xin, x + limit, "left")
+    stop = np.minimum(np.maximum(stop, start + 1), Nin - 1)
+
+    # One entry for each interval (k-1, k) in each window.
+    width = dx > 0.0
+    count = np.where(width, stop - start, 0)
+    if max_entries is not None and 2 * np.sum(count) > max_entries:
+        return None
+    point = np.repeat(np.arange(len(x)), count)
+    k = np.arange(len(point)) - np.repeat(np.cumsum(count) - count, count) + start[point] + 1
+    sigma, xo = dx[point], x[point]
+    x1, x2 = xin[k - 1], xin[k]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zlo, zhi = xo - x1, xo - x2
+        two_sigma_sq = 2.0 * sigma * sigma
+        E = erf(-zhi / (SQRT2 * sigma)) - erf(-zlo / (SQRT2 * sigma))
+        G = np.exp(-zhi * zhi / two_sigma_sq) - np.exp(-zlo * zlo / two_sigma_sq)
+        # The area 0.5 (m xo + b) E - sigma/sqrt(2 pi) m G for the line
+        # y = m x + b through (x1, y1), (x2, y2) split into y1 and y2 terms.
+        # No contribution from duplicate points.
+        D = np.where(x1 != x2, x2 - x1, np.inf)
+        w1 = -0.5 * E * zhi / D + sigma / SQRT2PI * G / D
+        w2 = 0.5 * E * (1 + zhi / D) - sigma / SQRT2PI * G / D
+        w1[~np.isfinite(D)] = w2[~np.isfinite(D)] = 0.0
+
+        # Normalize by the area of the truncated gaussian.
+        erfmin = erf((xin[start] - x) / (SQRT2 * dx))
+        erfmax = erf((xin[stop] - x) / (SQRT2 * dx))
+        scale = (2 / (erfmax - erfmin))[point]
+
+    # Linear interpolation for zero width, or extrapolation at the end.
+    zero = np.flatnonzero(~width)
+    lo = np.where(start < Nin - 1, start, start - 1)[zero]
+    t = (x[zero] - xin[lo]) / (xin[lo + 1] - xin[lo])
+
+    rows = np.hstack((point, point, zero, zero))
+    cols = np.hstack((k - 1, k, lo, lo + 1))
+    weights = np.hstack((w1 * scale, w2 * scale, 1 - t, t))
+    return rows, cols, weights
+
+
+def _uniform_weights(xi, x, dx, max_entries=None):
+    """
+    Weights for the uniform resolution, following the convolve_uniform
+    kernels: the average of the theory over the window, truncated to the
+    theory range.  Returns None if there would be more than *max_entries*.
+    """
+    N = len(xi)
+    half = dx * np.sqrt(3)
+    left, right = np.maximum(x - half, xi[0]), np.minimum(x + half, xi[-1])
+    overlap = left <= right
+
+    # Intervals (k, k+1) from the one holding left to the one holding right.
+    start = np.clip(np.searchsorted(xi, left, "right") - 1, 0, N - 2)
+    stop = np.clip(np.searchsorted(xi, right, "left"), start + 1, N - 1)
+    count = np.where(overlap, stop - start, 0)
+    if max_entries is not None and 2 * np.sum(count) > max_entries:
+        return None
+    point = np.repeat(np.arange(len(x)), count)
+    k = np.arange(len(point)) - np.repeat(np.cumsum(count) - count, count) + start[point]
+    x1, x2 = xi[k], xi[k + 1]
+    a, b = np.maximum(x1, left[point]), np.minimum(x2, right[point])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        D = np.where(x1 != x2, x2 - x1, np.inf)
+        ta, tb = (a - x1) / D, (b - x1) / D
+        # Trapezoid over [a, b] with the end values interpolated in the interval.
+        area = np.where(b > a, 0.5 * (b - a), 0.0)
+        w1, w2 = area * ((1 - ta) + (1 - tb)), area * (ta + tb)
+        length = (right - left)[point]
+        w1, w2 = np.where(length > 0, w1 / length, 0.0), np.where(length > 0, w2 / length, 0.0)
+
+    # For zero length use the value at x in the first interval, or the
+    # average of the end points for an empty interval.
+    zero = np.flatnonzero(overlap & (left == right))
+    lo = start[zero]
+    gap = xi[lo + 1] - xi[lo]
+    t = np.where(gap > 0, (left[zero] - xi[lo]) / np.where(gap > 0, gap, 1.0), 0.5)
+
+    rows = np.hstack((point, point, zero, zero))
+    cols = np.hstack((k, k + 1, lo, lo + 1))
+    weights = np.hstack((w1, w2, 1 - t, t))
+    return rows, cols, weights
+
+
 def convolve_sampled(xi, yi, xp, yp, x, dx):
     """
     Apply x-dependent arbitrary resolution function to the theory.
@@ -10,10 +10,14 @@ Use *run_errors* in a model file to reload the results of a batch DREAM fit.
 """
 
 __all__ = [
+    "QuantileAccumulator",
+    "UncertaintyBands",
     "align_profiles",
     "calc_errors",
+    "load_errors",
     "reload_errors",
     "run_errors",
+    "save_errors",
     "show_errors",
     "show_profiles",
     "show_residuals",
@@ -21,10 +25,12 @@ __all__ = [
 
 import os
 import sys
+import threading
+import warnings
 
 import numpy as np
-from bumps.errplot import reload_errors
-from bumps.plotutil import dhsv, form_quantiles, next_color, plot_quantiles
+from bumps.errplot import error_points_from_state, reload_errors
+from bumps.plotutil import _plot_quantiles, dhsv, form_quantiles, next_color, plot_quantiles
 
 from .sample.reflectivity import BASE_GUIDE_ANGLE
 from .utils import asbytes
@@ -33,6 +39,14 @@ from .utils import asbytes
 # CONTOURS = (57, 68, 84, 95, 100)
 CONTOURS = (68, 95)
 
+# Number of histogram bins used to estimate the profile quantiles.  The
+# contour levels are accurate to 1/QUANTILE_BINS of the range of the profile.
+QUANTILE_BINS = 1000
+
+# Profile sets with up to this many samples use exact quantiles.  Larger sets
+# are estimated with QUANTILE_BINS bins without stacking the samples.
+EXACT_QUANTILE_DRAWS = 1000
+
 # TODO: we should just keep a certain number of evaluations as a matter of
 #       course during sampling rather than recomputing them after the fact.
 # TODO: want similar code for covariance matrix based forward analysis
@@ -117,7 +131,7 @@ def _usage():
     print(run_errors.__doc__)
 
 
-def calc_errors(problem, points):
+def calc_errors(problem, points, workers=1, progress=None, bands=None):
     """
     Align the sample profiles and compute the residual difference from the
     measured reflectivity for a set of points.
@@ -153,25 +167,65 @@ def calc_errors(problem, points):
 
         Array of (theory-data)/uncertainty for each data point in
         the measurement.  There will be one array returned per error sample.
+
+    *workers* is the number of processes used to evaluate the points, or 0
+    for one process per CPU.  Each process evaluates its share of the points
+    using its own copy of the problem.  If the problem cannot be pickled, or
+    the processes cannot be started or fail, the points are evaluated in the
+    current process.  Use a :class:`WorkerPool` for *workers* to keep the
+    processes between calls.
+
+    *progress* is called as *progress(done, total)* as the points are
+    evaluated.
+
+    *bands* is an optional :class:`UncertaintyBands` for *problem*.  If it
+    is given, the points are added to the bands as they are evaluated rather
+    than being returned, and the bands are returned in place of (profiles,
+    slabs, Q, residuals).  The points are evaluated using the workers of the
+    bands rather than *workers*.  The memory used then does not grow with the
+    number of points, but the contours are estimated from histograms rather
+    than exact.  :func:`show_errors` accepts the bands in place of the errors.
     """
+    if bands is not None:
+        bands.update(points, progress=progress)
+        return bands
+
     # Find Q
     Q = [_residQ(m) for m in _experiments(problem)]
 
     # Put best at slot 0, no alignment
-    data = [_eval_point(problem, problem.getp())]
-    for p in points:
-        data.append(_eval_point(problem, p))
-
-    profiles, slabs, residuals = zip(*data)
+    points = [problem.getp()] + list(points)
+    total = len(points)
+
+    # Results are stored by point number as they arrive.  The profiles differ
+    # in length from point to point, but the slabs and residuals are stored
+    # in preallocated arrays.
+    nmodels = len(Q)
+    profiles = [[None] * total for _ in range(nmodels)]
+    slabs, residuals = [None] * nmodels, [None] * nmodels
+    done = 0
+    for start, data in _eval_points(problem, points, workers):
+        for offset, (profiles_p, slabs_p, residuals_p) in enumerate(data):
+            index = start + offset
+            for k in range(nmodels):
+                if slabs[k] is None:
+                    slabs[k] = np.empty((total, len(slabs_p[k])))
+                    residuals[k] = np.empty((len(residuals_p[k]), total))
+                profiles[k][index] = profiles_p[k]
+                slabs[k][index] = slabs_p[k]
+                residuals[k][:, index] = residuals_p[k]
+        done += len(data)
+        if progress is not None:
+            progress(done, total)
 
     # TODO: return sane datastructure
     # Make a hashable version of model which just contains the name
     # attribute, which is all that the rest of this code accesses.
     models = [_HashableModel(m, i) for i, m in enumerate(_experiments(problem))]
 
-    profiles = {h: [v[k] for v in profiles] for k, h in enumerate(models)}
-    slabs = {h: [v[k] for v in slabs] for k, h in enumerate(models)}
-    residuals = {h: np.asarray([v[k] for v in residuals]).T for k, h in enumerate(models)}
+    profiles = {h: profiles[k] for k, h in enumerate(models)}
+    slabs = {h: list(slabs[k]) for k, h in enumerate(models)}
+    residuals = {h: residuals[k] for k, h in enumerate(models)}
     Q = {h: Q[k] for k, h in enumerate(models)}
 
     # from .pstruct import pstruct, sstruct
@@ -196,6 +250,369 @@ class _HashableModel:
         return f"model {self.name}: {self.index}"
 
 
+def save_errors(errors, filename):
+    """
+    Save the output of :func:`calc_errors` to *filename* as a numpy .npz file.
+
+    The profiles for each model are concatenated into one array along with
+    the number of points in each profile.  Use :func:`load_errors` to
+    restore them.
+    """
+    profiles, slabs, Q, residuals = errors
+    data = {}
+    for k, m in enumerate(profiles):
+        data[f"name{k}"] = np.array(m.name)
+        data[f"lengths{k}"] = np.array([len(p[0]) for p in profiles[m]])
+        data[f"profiles{k}"] = np.hstack([np.vstack(p) for p in profiles[m]])
+        data[f"slabs{k}"] = np.array(slabs[m])
+        data[f"Q{k}"] = Q[m]
+        data[f"residuals{k}"] = residuals[m]
+    np.savez(filename, **data)
+
+
+def load_errors(filename):
+    """
+    Load errors saved by :func:`save_errors`.
+    """
+    from types import SimpleNamespace
+
+    profiles, slabs, Q, residuals = {}, {}, {}, {}
+    with np.load(filename) as data:
+        k = 0
+        while f"name{k}" in data:
+            m = _HashableModel(SimpleNamespace(name=str(data[f"name{k}"])), k)
+            ends = np.cumsum(data[f"lengths{k}"])
+            columns = data[f"profiles{k}"]
+            profiles[m] = [tuple(columns[:, end - n : end]) for end, n in zip(ends, data[f"lengths{k}"])]
+            slabs[m] = list(data[f"slabs{k}"])
+            Q[m] = data[f"Q{k}"]
+            residuals[m] = data[f"residuals{k}"]
+            k += 1
+    return profiles, slabs, Q, residuals
+
+
+class UncertaintyBands:
+    """
+    Running profile and residual uncertainty bands.
+
+    Points are added in batches with :meth:`update`, for example from the
+    generations of a DREAM fit which is still running.  Each point is
+    evaluated once and the aligned profiles and the residuals are added to
+    a :class:`QuantileAccumulator` for each model, so the bands can be
+    updated without keeping or reprocessing the earlier samples.
+
+    The first batch also evaluates the current point of *problem*, which
+    is used as the best profile and as the reference for alignment.  The z
+    grid of *npoints* points spans the aligned profiles of the first *nstart*
+    points evaluated, or of the first batch if it is smaller.  The histogram
+    ranges are set from the same points, extended by *margin* times their
+    width on each side.  Values from later points outside these ranges go
+    into the end bins, so the bands are less accurate for them.
+
+    The bands are estimated with *QUANTILE_BINS* bins, so the contour levels
+    are approximate, as described for :class:`QuantileAccumulator`.
+
+    *align* is as for :func:`show_errors`, and *workers* is as for
+    :func:`calc_errors`.
+    """
+
+    def __init__(self, problem, align="auto", npoints=200, margin=0.5, workers=1, nstart=50):
+        self.problem = problem
+        self.align = align
+        self.npoints = npoints
+        self.margin = margin
+        self.workers = workers
+        self.nstart = nstart
+        self.count = 0
+        self.draws = 0
+        self.models = None
+        self.best = problem.getp()
+
+    def update(self, points, progress=None):
+        """
+        Evaluate *points* and add them to the bands.
+
+        The points are added as they are evaluated, and their profiles and
+        residuals are not kept.  *progress* is as for :func:`calc_errors`.
+        """
+        points = list(points)
+        if self.models is None:
+            points = [self.best] + points
+        total = len(points)
+        # Until the bands are started, hold the results by point number.
+        pending = {}
+        done = 0
+        for start, data in _eval_points(self.problem, points, self.workers):
+            if self.models is None:
+                pending.update(zip(range(start, start + len(data)), data))
+                if 0 in pending and len(pending) >= min(self.nstart, total):
+                    results = [pending[k] for k in sorted(pending)]
+                    self._start(results)
+                    self._add(results)
+                    pending = None
+            else:
+                self._add(data)
+            done += len(data)
+            if progress is not None:
+                progress(done, total)
+        self.problem.setp(self.best)
+
+    def update_from_state(self, state, nshown=50):
+        """
+        Add the generations drawn by the DREAM *state* since the last update.
+
+        At most *nshown* points are chosen at random from the new draws.
+        The first update draws from the whole state as
+        :func:`bumps.errplot.error_points_from_state` does.
+        """
+        draws, chains, _ = state.chains()
+        if self.models is None:
+            points = error_points_from_state(state, nshown=nshown, random=True)
+        else:
+            points = chains[draws > self.draws].reshape(-1, chains.shape[2])
+            if len(points) > nshown:
+                points = points[np.random.choice(len(points), nshown, replace=False)]
+        if len(draws):
+            self.draws = draws[-1]
+        if len(points) or self.models is None:
+            self.update(points)
+
+    def profile_quantiles(self, contours=CONTOURS):
+        """
+        Return the profile bands for each model.
+
+        Returns {model: (z, [(best, q) for each profile column])} where
+        *q* is as returned by :func:`bumps.plotutil.form_quantiles`.
+        """
+        return {
+            model["key"]: (
+                model["z"],
+                [(b, acc.quantiles(contours)[1]) for b, acc in zip(model["best"], model["profiles"])],
+            )
+            for model in self.models
+        }
+
+    def residual_quantiles(self, contours=CONTOURS):
+        """
+        Return the residual bands for each model.
+
+        Returns {model: (Q, best, q)} where *q* is as returned by
+        :func:`bumps.plotutil.form_quantiles`.
+        """
+        return {
+            model["key"]: (model["Q"], model["best_residuals"], model["residuals"].quantiles(contours)[1])
+            for model in self.models
+        }
+
+    def _add(self, results):
+        for k, model in enumerate(self.models):
+            group = [r[0][k] for r in results]
+            slabs = [r[1][k] for r in results]
+            if self.align is not None:
+                # Align against the reference profile, then drop it.
+                group = [model["reference"]] + group
+                slabs = [model["reference_slabs"]] + slabs
+                group = _align_profile_set(group, slabs, self.align)[1:]
+            for L in group:
+                for index, accumulator in enumerate(model["profiles"], 1):
+                    accumulator.add(np.interp(model["z"], L[0], L[index]))
+            for r in results:
+                model["residuals"].add(r[2][k])
+        self.count += len(results)
+
+    def _start(self, results):
+        self.models = []
+        for k, m in enumerate(_experiments(self.problem)):
+            group = [r[0][k] for r in results]
+            slabs = [r[1][k] for r in results]
+            residuals = np.array([r[2][k] for r in results])
+            aligned = _align_profile_set(group, slabs, self.align) if self.align is not None else group
+            z = np.hstack([L[0] for L in aligned])
+            zp = np.linspace(np.min(z), np.max(z), self.npoints)
+            profiles = []
+            for index in range(1, len(group[0])):
+                lo, hi = _widen(np.hstack([L[index] for L in group]), self.margin)
+                profiles.append(QuantileAccumulator(self.npoints, lo, hi))
+            best = aligned[0]
+            lo, hi = _widen(residuals, self.margin)
+            self.models.append(
+                dict(
+                    key=_HashableModel(m, k),
+                    Q=_residQ(m),
+                    z=zp,
+                    reference=group[0],
+                    reference_slabs=slabs[0],
+                    profiles=profiles,
+                    best=[np.interp(zp, best[0], best[index]) for index in range(1, len(best))],
+                    residuals=QuantileAccumulator(residuals.shape[1], lo, hi),
+                    best_residuals=residuals[0],
+                )
+            )
+
+
+def _widen(v, margin):
+    lo, hi = np.min(v), np.max(v)
+    return lo - margin * (hi - lo), hi + margin * (hi - lo)
+
+
+# Number of chunks per worker when evaluating points in parallel.  Several
+# chunks per worker balances the load when some points are slower than others.
+CHUNKS_PER_WORKER = 4
+
+# Problem evaluated by a calc_errors worker process, and for a WorkerPool,
+# the pickle it was loaded from.
+_worker_problem = None
+_worker_pickled = None
+
+
+class WorkerPool:
+    """
+    Worker processes for :func:`calc_errors` and :class:`UncertaintyBands`
+    which are kept between calls.
+
+    Use the pool as *workers* to evaluate points for any problem without
+    starting new processes each time.  The problem is sent with each block
+    of points, and each process keeps the last problem it loaded.  The
+    *workers* processes are started on first use with the current backend,
+    and restarted if the backend changes.  Call :meth:`shutdown` to stop them.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        """
+        Return the process pool executor, starting it if necessary.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        import refl1d
+
+        with self._lock:
+            if self._executor is not None and self._backend != refl1d.BACKEND_NAME:
+                # Calls in progress finish with the old backend.
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._backend = refl1d.BACKEND_NAME
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=refl1d.use, initargs=(self._backend,)
+                )
+            return self._executor
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker processes, waiting for them to finish if *wait* is
+        True.  They are restarted if the pool is used again.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def _eval_points(problem, points, workers):
+    """
+    Evaluate *points*, yielding (start, results) for blocks of consecutive
+    points in the order they are completed.
+
+    The points are evaluated in this process if the problem cannot be
+    pickled, or if the worker processes cannot be started or fail, as in
+    environments without multiprocessing.
+    """
+    pool = None
+    if isinstance(workers, WorkerPool):
+        pool, workers = workers, workers.workers
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(points))
+    pickled = _pickle_problem(problem) if workers > 1 else None
+    remaining = {0: points}
+    if pickled is not None:
+        from concurrent.futures import BrokenExecutor
+        from pickle import PicklingError
+
+        size = -(-len(points) // (CHUNKS_PER_WORKER * workers))
+        remaining = {k: points[k : k + size] for k in range(0, len(points), size)}
+        try:
+            for start, data in _eval_chunks(pickled, remaining, workers, pool):
+                del remaining[start]
+                yield start, data
+        except (OSError, ImportError, NotImplementedError, BrokenExecutor, PicklingError) as exc:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            warnings.warn(f"worker processes failed ({exc}); evaluating the remaining points in this process")
+    for start, chunk in remaining.items():
+        for offset, p in enumerate(chunk):
+            yield start + offset, [_eval_point(problem, p)]
+
+
+def _eval_chunks(pickled, chunks, workers, pool):
+    """
+    Evaluate the *chunks* of points, keyed by their start index, in worker
+    processes, yielding (start, results) as they are completed.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    import refl1d
+
+    if pool is not None:
+        executor = pool.executor()
+        futures = [executor.submit(_eval_pool_chunk, pickled, k, chunk) for k, chunk in chunks.items()]
+        for future in as_completed(futures):
+            yield future.result()
+        return
+
+    # Forking is not safe once the numba parallel kernels have started their
+    # thread pool, so start fresh worker processes.  They use the backend
+    # selected in this process, even if it was chosen with refl1d.use().
+    context = multiprocessing.get_context("spawn")
+    initargs = (pickled, refl1d.BACKEND_NAME)
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=initargs) as executor:
+        futures = [executor.submit(_eval_chunk, k, chunk) for k, chunk in chunks.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _pickle_problem(problem):
+    import pickle
+
+    try:
+        return pickle.dumps(problem)
+    except Exception:
+        return None
+
+
+def _init_worker(pickled, backend_name):
+    import pickle
+
+    import refl1d
+
+    global _worker_problem
+    refl1d.use(backend_name)
+    _worker_problem = pickle.loads(pickled)
+
+
+def _eval_chunk(start, points):
+    return start, [_eval_point(_worker_problem, p) for p in points]
+
+
+def _eval_pool_chunk(pickled, start, points):
+    import pickle
+
+    global _worker_problem, _worker_pickled
+    if pickled != _worker_pickled:
+        _worker_problem = pickle.loads(pickled)
+        _worker_pickled = pickled
+    return _eval_chunk(start, points)
+
+
 def _eval_point(problem, p):
     problem.chisq_str()  # Force reflectivity recalculation
     problem.setp(p)
@@ -270,13 +687,20 @@ def show_errors(errors, contours=CONTOURS, npoints=200, align="auto", plots=1, s
     *save* is the basename of the plot to save.  This should usually
     be "<store>/<model>".  The program will add '-err#.png' where '#'
     is the number of the plot.
+
+    *errors* may also be an :class:`UncertaintyBands`, as returned by
+    :func:`calc_errors` with *bands*.  The profiles were aligned and
+    interpolated when they were added, so *align* and *npoints* are ignored,
+    and the residuals are shown as contours rather than as points.
     """
     import matplotlib.pyplot as plt
 
     if fig is not None and plots != 1:
         raise ValueError("can only pass in a figure object if exactly 1 plot is requested")
 
-    if plots == 0:  # Don't create plots, just save the data
+    if isinstance(errors, UncertaintyBands):
+        _show_bands(errors, contours=contours, plots=plots, save=save, fig=fig)
+    elif plots == 0:  # Don't create plots, just save the data
         _save_profile_data(errors, contours=contours, npoints=npoints, align=align, save=save)
         _save_residual_data(errors, contours=contours, save=save)
     elif plots == 1:  # Subplots for profiles/residuals
@@ -315,6 +739,37 @@ def show_errors(errors, contours=CONTOURS, npoints=200, align="auto", plots=1, s
             fignum += 1
 
 
+def _show_bands(bands, contours, plots, save, fig):
+    import matplotlib.pyplot as plt
+
+    if plots == 0:
+        _save_band_data(bands, contours=contours, save=save)
+    elif plots == 1:
+        if fig is None:
+            fig = plt.gcf()
+        _bands_profiles(bands.models, contours, axes=fig.add_subplot(211))
+        _bands_residuals(bands.models, contours, axes=fig.add_subplot(212))
+        if save:
+            plt.savefig(save + "-err.png")
+    elif plots == 2:
+        _bands_profiles(bands.models, contours)
+        if save:
+            plt.savefig(save + "-err1.png")
+        plt.figure()
+        _bands_residuals(bands.models, contours)
+        if save:
+            plt.savefig(save + "-err2.png")
+    else:
+        fignum = 1
+        for draw in (_bands_profiles, _bands_residuals):
+            for model in bands.models:
+                plt.figure()
+                draw([model], contours)
+                if save:
+                    plt.savefig(save + "-err%d.png" % fignum)
+                fignum += 1
+
+
 def show_profiles(errors, align, contours, npoints, axes=None):
     profiles, slabs, _, _ = errors
     if align is not None:
@@ -367,13 +822,11 @@ def _save_profile_data(errors, align, contours, npoints, save):
 
 
 def _build_profile_matrix(group, index, zp, contours):
-    # Interpolate to common z
-    fp = np.vstack([np.interp(zp, L[0], L[index]) for L in group])
     # Find quantiles
-    q, qval = form_quantiles(fp, contours)
+    best, q, qval = _profile_quantiles(group, index, zp, contours)
     # Build and return data columns
     columns = ["z", "best"] + list("%g%%" % v for v in 100 * q.flatten())
-    data = np.vstack((zp, fp[0], np.reshape(qval, (-1, qval.shape[2]))))
+    data = np.vstack((zp, best, np.reshape(qval, (-1, qval.shape[2]))))
     return data, columns
 
 
@@ -391,6 +844,22 @@ def _save_residual_data(errors, contours, save):
         k += 1
 
 
+def _save_band_data(bands, contours, save):
+    k = 1
+    for model in sorted(bands.models, key=lambda m: (m["key"].name, m["key"].index)):
+        title = model["key"].name
+        for name, best, accumulator in zip(("rho", "irho", "rhoM", "thetaM"), model["best"], model["profiles"]):
+            q, qval = accumulator.quantiles(contours)
+            columns = ["z", "best"] + list("%g%%" % v for v in 100 * q.flatten())
+            data = np.vstack((model["z"], best, np.reshape(qval, (-1, qval.shape[2]))))
+            _write_file(save + "_%s_contour%d.dat" % (name, k), data, title, columns)
+        q, qval = model["residuals"].quantiles(contours)
+        columns = ["q", "best"] + list("%g%%" % v for v in 100 * q.flatten())
+        data = np.vstack((model["Q"], model["best_residuals"], np.reshape(qval, (-1, qval.shape[2]))))
+        _write_file(save + "_resid_contour%d.dat" % k, data, title, columns)
+        k += 1
+
+
 def _write_file(path, data, title, columns):
     with open(path, "wb") as fid:
         fid.write(asbytes("# " + title + "\n"))
@@ -464,12 +933,29 @@ def _draw_contours(group, index, label, zp, contours, axes=None):
     if axes is None:
         axes = plt.gca()
     color = next_color(axes=axes)
-    # Interpolate on common z
-    fp = np.vstack([np.interp(zp, L[0], L[index]) for L in group])
+    best, _, q = _profile_quantiles(group, index, zp, contours)
     # Plot the quantiles
-    plot_quantiles(zp, fp, contours, color, axes=axes)
+    _plot_quantiles(zp, q, color, None, axes=axes)
     # Plot the best
-    axes.plot(zp, fp[0], "-", label=label, color=dark(color))
+    axes.plot(zp, best, "-", label=label, color=dark(color))
+
+
+def _bands_profiles(models, contours, axes=None):
+    import matplotlib.pyplot as plt
+
+    if axes is None:
+        axes = plt.gca()
+    for model in models:
+        name = model["key"].name
+        # Note: Use 3 colours per dataset for consistency
+        for label, best, accumulator in zip(("rho", "irho", "rhoM"), model["best"], model["profiles"]):
+            color = next_color(axes=axes)
+            _, q = accumulator.quantiles(contours)
+            _plot_quantiles(model["z"], q, color, None, axes=axes)
+            axes.plot(model["z"], best, "-", label=name + " " + label, color=dark(color))
+        for _ in range(len(model["profiles"]), 3):
+            next_color(axes=axes)
+    _profile_labels(axes=axes)
 
 
 def _profile_labels(axes=None):
@@ -515,6 +1001,27 @@ def _residuals_contour(Q, residuals, contours=CONTOURS):
     _residuals_labels()
 
 
+def _bands_residuals(models, contours, axes=None):
+    import matplotlib.pyplot as plt
+
+    if axes is None:
+        axes = plt.gca()
+    shift = 0
+    for model in models:
+        color = next_color(axes=axes)
+        order = np.argsort(model["Q"])
+        _, q = model["residuals"].quantiles(contours)
+        _plot_quantiles(model["Q"][order], shift + q[:, :, order], color, None, axes=axes)
+        axes.plot(
+            model["Q"], shift + model["best_residuals"], ".", label=model["key"].name, markersize=1, color=dark(color)
+        )
+        # Use 3 colours from cycle so reflectivity matches rho for each dataset
+        next_color(axes=axes)
+        next_color(axes=axes)
+        shift += 5
+    _residuals_labels(axes=axes)
+
+
 def _residuals_labels(axes=None):
     import matplotlib.pyplot as plt
 
@@ -535,36 +1042,184 @@ def _profiles_draw_align_lines(profiles, slabs, align, axes):
 # ==== Helper functions =====
 
 
+class QuantileAccumulator:
+    """
+    Streaming estimate of the quantiles of a set of curves.
+
+    The curves are sampled on a common grid of *npoints* points and added
+    one at a time with :meth:`add`.  Rather than storing the curves, the
+    accumulator keeps a histogram of the values at each point, using *bins*
+    equal width bins spanning [*lo*, *hi*], along with the minimum and
+    maximum value seen at each point.  The memory used is independent of
+    the number of curves.
+
+    Quantiles follow :func:`bumps.plotutil.form_quantiles`.  Each value is
+    interpolated from estimates of the neighbouring order statistics, which
+    are placed evenly within the bin holding them, so for curves within
+    [*lo*, *hi*] the error in the reported quantiles is at most the bin
+    width, (*hi* - *lo*)/*bins*.  The minimum and maximum are exact.  Values
+    outside the range are counted in the first or last bin.
+    """
+
+    def __init__(self, npoints, lo, hi, bins=QUANTILE_BINS):
+        self.lo = float(lo)
+        self.width = (float(hi) - self.lo) / bins if hi > lo else 1.0
+        self.bins = bins
+        self.count = 0
+        self.counts = np.zeros((npoints, bins), "i")
+        self.min = np.full(npoints, np.inf)
+        self.max = np.full(npoints, -np.inf)
+        self._points = np.arange(npoints)
+
+    def add(self, y):
+        """
+        Add the curve *y* to the accumulator.
+        """
+        index = np.clip((y - self.lo) / self.width, 0, self.bins - 1).astype("i")
+        self.counts[self._points, index] += 1
+        np.minimum(self.min, y, out=self.min)
+        np.maximum(self.max, y, out=self.max)
+        self.count += 1
+
+    def quantile(self, prob, alphap=0.4, betap=0.4):
+        """
+        Return the estimated quantile *prob* at each point.
+
+        *alphap* and *betap* are the plotting positions used by
+        :func:`scipy.stats.mstats.mquantiles`.
+        """
+        n = self.count
+        # Fractional rank from scipy.stats.mstats.mquantiles.
+        aleph = n * prob + alphap + prob * (1.0 - alphap - betap)
+        k = int(np.floor(np.clip(aleph, 1, n - 1)))
+        gamma = np.clip(aleph - k, 0, 1)
+        cumulative = np.cumsum(self.counts, axis=1, dtype="i")
+        return (1 - gamma) * self._order(cumulative, k - 1) + gamma * self._order(cumulative, k)
+
+    def quantiles(self, contours):
+        """
+        Return quantiles and values for a list of confidence intervals,
+        as returned by :func:`bumps.plotutil.form_quantiles`.
+        """
+        p = np.hstack([(100.0 - c, 100.0 + c) for c in sorted(contours, reverse=True)]) / 200.0
+        q = np.array([self.quantile(pk) for pk in p])
+        return np.reshape(p, (2, -1)), np.reshape(q, (-1, 2, len(self.min)))
+
+    def _order(self, cumulative, k):
+        """
+        Estimate the order statistic *k* (counting from zero) at each point
+        given the *cumulative* bin counts.
+        """
+        if k <= 0:
+            return self.min.copy()
+        if k >= self.count - 1:
+            return self.max.copy()
+        # The order statistic is in the first bin holding more than k values.
+        index = np.sum(cumulative <= k, axis=1)
+        below = np.where(index > 0, cumulative[self._points, np.maximum(index - 1, 0)], 0)
+        fraction = (k - below + 0.5) / self.counts[self._points, index]
+        value = self.lo + (index + fraction) * self.width
+        return np.clip(value, self.min, self.max)
+
+
+def _profile_quantiles(group, index, zp, contours):
+    """
+    Interpolate the profiles in *group* onto *zp* and find the quantiles of
+    column *index* for the *contours*.
+
+    The quantiles are exact for up to *EXACT_QUANTILE_DRAWS* profiles, and
+    estimated with a :class:`QuantileAccumulator` for more.
+
+    Returns the interpolated best profile and the quantiles (q, qval) as
+    returned by :func:`bumps.plotutil.form_quantiles`.
+    """
+    if len(group) <= EXACT_QUANTILE_DRAWS:
+        fp = np.vstack([np.interp(zp, L[0], L[index]) for L in group])
+        q, qval = form_quantiles(fp, contours)
+        return fp[0], q, qval
+    best, accumulator = _accumulate_profiles(group, index, zp)
+    q, qval = accumulator.quantiles(contours)
+    return best, q, qval
+
+
+def _accumulate_profiles(group, index, zp):
+    """
+    Interpolate the profiles in *group* onto *zp* one at a time, collecting
+    the values of column *index* in a :class:`QuantileAccumulator`.
+
+    Returns the interpolated best profile and the accumulator.
+    """
+    # Interpolation stays within the range of the profile values.
+    lo = min(L[index].min() for L in group)
+    hi = max(L[index].max() for L in group)
+    accumulator = QuantileAccumulator(len(zp), lo, hi)
+    best = np.interp(zp, group[0][0], group[0][index])
+    accumulator.add(best)
+    for L in group[1:]:
+        accumulator.add(np.interp(zp, L[0], L[index]))
+    return best, accumulator
+
+
+# Number of profiles aligned together by cross-correlation.  This limits
+# the memory used by the batched FFT.
+ALIGN_BLOCK = 256
+
+
 def _align_profile_set(profiles, slabs, align):
     """
     Align all profiles to the first profile.
     """
-    p1 = profiles[0]
-    t1_offset = _find_offset(slabs[0], align) if align != "auto" else None
-    offsets = [0]
-    for p2, t2 in zip(profiles[1:], slabs[1:]):
-        offsets.append(_align_profile_pair(p1[0], p1[1], t1_offset, p2[0], p2[1], t2, align))
+    if align == "auto":
+        offsets = _correlation_offsets(profiles)
+    else:
+        t = _find_offsets(np.asarray(slabs), align)
+        offsets = -(t - t[0])
     profiles = [tuple([group[0] + offset] + list(group[1:])) for offset, group in zip(offsets, profiles)]
     return profiles
 
 
-def _align_profile_pair(z1, r1, t1_offset, z2, r2, t2, align):
-    """
-    Use crosscorrelation to align r1 and r2.
+def _correlation_offsets(profiles):
     """
-    if align == "auto":
-        import scipy.signal
+    Use crosscorrelation to align the rho profiles to the first profile.
 
-        # Assume z1, z2 have the same step size
-        n2 = len(r2)
-        idx = np.argmax(scipy.signal.correlate(r1, r2, "full"))
-        if idx < n2:
-            offset = z2[(n2 - 1) - idx] - z1[0]
-        else:
-            offset = z2[0] - z1[idx - (n2 - 1)]
-        return -offset
-    else:
-        return -(_find_offset(t2, align) - t1_offset)
+    The cross-correlations are computed in blocks of *ALIGN_BLOCK* profiles
+    using FFTs, with the shorter profiles padded to the length of the
+    longest in the block.
+    """
+    import scipy.fft
+
+    # Assume the profiles have the same step size
+    z1, r1 = profiles[0][0], profiles[0][1]
+    n1 = len(r1)
+    offsets = np.zeros(len(profiles))
+    for start in range(1, len(profiles), ALIGN_BLOCK):
+        block = profiles[start : start + ALIGN_BLOCK]
+        n2 = np.array([len(p[1]) for p in block])
+        width = n2.max()
+        z2, r2 = np.zeros((len(block), width)), np.zeros((len(block), width))
+        for k, p in enumerate(block):
+            z2[k, : n2[k]], r2[k, : n2[k]] = p[0], p[1]
+        # Full correlation of r1 with each r2, padded with zeros on the right,
+        # as the convolution of r1 with the reversed r2.
+        size = n1 + width - 1
+        nfft = scipy.fft.next_fast_len(size, real=True)
+        c = scipy.fft.irfft(scipy.fft.rfft(r1, nfft) * scipy.fft.rfft(r2[:, ::-1], nfft, axis=1), nfft, axis=1)[
+            :, :size
+        ]
+        # Lag idx in the unpadded correlation of length n1 + n2 - 1 is at
+        # column idx + width - n2 of the padded correlation.
+        shift = (width - n2)[:, None]
+        lag = np.arange(size)[None, :] - shift
+        c[(lag < 0) | (lag > n1 + n2[:, None] - 2)] = -np.inf
+        idx = np.argmax(c, axis=1) - shift[:, 0]
+        rows = np.arange(len(block))
+        offset = np.where(
+            idx < n2,
+            z2[rows, np.clip(n2 - 1 - idx, 0, width - 1)] - z1[0],
+            z2[:, 0] - z1[np.clip(idx - (n2 - 1), 0, n1 - 1)],
+        )
+        offsets[start : start + len(block)] = -offset
+    return offsets
 
 
 def _find_offset(v, align):
@@ -575,7 +1230,15 @@ def _find_offset(v, align):
     This may even work for interfaces defined from the left, such as
     -1.5 to specify the middle of the final layer.
     """
+    return _find_offsets(np.asarray(v)[None, :], align)[0]
+
+
+def _find_offsets(v, align):
+    """
+    Find the offset of k.p for each row of slab thicknesses in *v*.
+
+    See :func:`_find_offset`.
+    """
     idx = int(align)
-    offset = np.sum(v[:idx]) + np.sum((align - idx) * v[idx : idx + 1])
-    # print offset, idx, v[:idx], align
+    offset = np.sum(v[:, :idx], axis=1) + np.sum((align - idx) * v[:, idx : idx + 1], axis=1)
     return offset
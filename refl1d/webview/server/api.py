@@ -1,4 +1,5 @@
 import asyncio
+import threading
 from copy import deepcopy
 from functools import lru_cache
 from pathlib import Path
@@ -6,7 +7,6 @@ from typing import Dict, List, Union
 
 # import bumps.webview.server.api as bumps_api
 import numpy as np
-from bumps.errplot import error_points_from_state
 from bumps.webview.server.api import (
     add_notification,
     get_chisq,
@@ -18,12 +18,13 @@ from bumps.webview.server.api import (
     to_json_compatible_dict,
 )
 
-from refl1d.uncertainty import calc_errors
 from refl1d.experiment import Experiment, ExperimentBase, MixedExperiment
+from refl1d.uncertainty import UncertaintyBands
 from refl1d.probe.data_loaders import load4
 from refl1d.probe import PolarizedNeutronProbe
-from .profile_uncertainty import show_errors
+from .profile_uncertainty import show_bands, show_errors
 from .profile_plot import plot_multiple_sld_profiles, ModelSpec
+from .uncertainty_cache import get_errors, worker_pool
 
 # state.problem.serializer = "dataclass"
 
@@ -140,7 +141,7 @@ def _get_profile_uncertainty_plot(
 ):
     if state.problem is None or state.problem.fitProblem is None:
         return None
-    fitProblem = deepcopy(state.problem.fitProblem)
+    fitProblem = state.problem.fitProblem
     uncertainty_state = state.fitting.uncertainty_state
     align_arg = "auto" if auto_align else align
     if uncertainty_state is not None:
@@ -148,9 +149,7 @@ def _get_profile_uncertainty_plot(
 
         start_time = time.time()
         logger.info(f"queueing new profile uncertainty plot... {start_time}")
-        error_points = error_points_from_state(uncertainty_state, nshown=nshown, random=random, portion=1.0)
-        logger.info(f"points calculated: {time.time() - start_time}")
-        errs = calc_errors(fitProblem, error_points)
+        errs = get_errors(fitProblem, uncertainty_state, nshown=nshown, random=random, log=logger.info)
         logger.info(f"errors calculated: {time.time() - start_time}")
         error_result = show_errors(errs, npoints=npoints, align=align_arg, residuals=residuals)
         error_result["fig"] = error_result["fig"].to_dict()
@@ -164,6 +163,51 @@ def _get_profile_uncertainty_plot(
         return None
 
 
+# Uncertainty bands accumulated while a fit is running, keyed by the fit and
+# the plot settings.
+_running_bands: Dict[tuple, UncertaintyBands] = {}
+_running_bands_lock = threading.Lock()
+
+# Time stamp of the uncertainty state used for the cached plots.
+_plotted_uncertainty = None
+
+
+def _get_running_uncertainty_plot(
+    auto_align: bool = True,
+    align: float = 0.0,
+    nshown: int = 5000,
+    npoints: int = 5000,
+    residuals: bool = False,
+):
+    """
+    Update the uncertainty bands with the generations drawn since the last
+    update, evaluating at most *nshown* new points, and plot them.
+
+    The points are evaluated as set by :func:`worker_pool`, either in the
+    server process or in a pool kept between polls.
+    """
+    uncertainty_state = state.fitting.uncertainty_state
+    if state.problem is None or state.problem.fitProblem is None or uncertainty_state is None:
+        return None
+    key = (state.shared.active_fit.get("fitter_id", None), auto_align, align, npoints)
+    with _running_bands_lock:
+        bands = _running_bands.get(key, None)
+        draws = uncertainty_state.chains()[0]
+        if bands is None or (len(draws) and draws[-1] < bands.draws):
+            # Samples from a new fit.
+            _running_bands.clear()
+            align_arg = "auto" if auto_align else align
+            bands = UncertaintyBands(
+                deepcopy(state.problem.fitProblem), align=align_arg, npoints=npoints, workers=worker_pool()
+            )
+            _running_bands[key] = bands
+        bands.update_from_state(uncertainty_state, nshown=nshown)
+        logger.info(f"uncertainty bands include {bands.count} samples")
+        result = show_bands(bands, residuals=residuals)
+    result["fig"] = result["fig"].to_dict()
+    return to_json_compatible_dict(result)
+
+
 @register
 async def get_profile_uncertainty_plot(
     auto_align: bool = True,
@@ -173,6 +217,28 @@ async def get_profile_uncertainty_plot(
     random: bool = True,
     residuals: bool = False,
 ):
+    global _plotted_uncertainty
+    active_fit = state.shared.active_fit
+    if isinstance(active_fit, dict) and active_fit:
+        # Add the new samples to the running bands rather than starting over.
+        return await asyncio.to_thread(
+            _get_running_uncertainty_plot,
+            auto_align=auto_align,
+            align=align,
+            nshown=nshown,
+            npoints=npoints,
+            residuals=residuals,
+        )
+    with _running_bands_lock:
+        _running_bands.clear()
+    updated = state.shared.updated_uncertainty
+    if updated != _plotted_uncertainty:
+        # The samples changed, for example when the fit ends.  The running
+        # bands only approximate the posterior and the cached plots are for
+        # the old samples, so evaluate the final samples in full.
+        logger.info("uncertainty samples changed: evaluating the full profile uncertainty")
+        _get_profile_uncertainty_plot.cache_clear()
+        _plotted_uncertainty = updated
     result = await asyncio.to_thread(
         _get_profile_uncertainty_plot,
         auto_align=auto_align,
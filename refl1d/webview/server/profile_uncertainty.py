@@ -5,7 +5,9 @@ import numpy as np
 if TYPE_CHECKING:
     import plotly.graph_objs as go
 
-from refl1d.uncertainty import _find_offset, align_profiles, form_quantiles
+    from refl1d.uncertainty import UncertaintyBands
+
+from refl1d.uncertainty import _find_offset, _profile_quantiles, align_profiles, form_quantiles
 from .colors import COLORS
 
 ErrorType = tuple[
@@ -23,6 +25,25 @@ def get_color(index: int):
 
 
 def show_errors(errors: ErrorType, npoints: int, align: bool, residuals: bool = True):
+    fig = _make_figure(residuals)
+    contour_data = show_profiles(errors, align, CONTOURS, npoints, fig=fig, row=1, col=1)
+    if residuals:
+        show_residuals(errors, None, fig=fig, row=2, col=1)
+    return dict(fig=fig, contour_data=contour_data, contours=CONTOURS)
+
+
+def show_bands(bands: "UncertaintyBands", residuals: bool = True):
+    """
+    Plot the running uncertainty bands accumulated during a fit.
+    """
+    fig = _make_figure(residuals)
+    contour_data = _bands_contour(bands.profile_quantiles(CONTOURS), CONTOURS, fig=fig, row=1, col=1)
+    if residuals:
+        _residuals_bands(bands.residual_quantiles(CONTOURS), CONTOURS, fig=fig, row=2, col=1)
+    return dict(fig=fig, contour_data=contour_data, contours=CONTOURS)
+
+
+def _make_figure(residuals: bool):
     from plotly.subplots import make_subplots
 
     specs = (
@@ -30,10 +51,7 @@ def show_errors(errors: ErrorType, npoints: int, align: bool, residuals: bool =
     )
     fig = make_subplots(rows=2, cols=1, specs=specs)
     fig.update_layout(template=None)
-    contour_data = show_profiles(errors, align, CONTOURS, npoints, fig=fig, row=1, col=1)
-    if residuals:
-        show_residuals(errors, None, fig=fig, row=2, col=1)
-    return dict(fig=fig, contour_data=contour_data, contours=CONTOURS)
+    return fig
 
 
 def show_profiles(
@@ -212,6 +230,45 @@ def _profiles_contour(
     return contour_data
 
 
+def _bands_contour(
+    bands: dict,
+    contours: tuple[float],
+    fig: "go.Figure",
+    row: Optional[int] = None,
+    col: Optional[int] = None,
+):
+    contour_data = {}
+    has_magnetism = False
+    for model_index, (model, (zp, columns)) in enumerate(bands.items()):
+        name = model.name if model.name is not None else f"Model {model_index}"
+        if name in contour_data:
+            name += f" {model_index}"
+        contour_data[name] = {"z": zp, "data": {}}
+        absorbing = (columns[1][1] > 1e-4).any()
+        magnetic = len(columns) > 3
+        has_magnetism = has_magnetism or magnetic
+        # Note: Use 4 colours per dataset for consistency
+        color_index = model_index * 4
+        for k, ((best, q), column) in enumerate(zip(columns, ("rho", "irho", "rhoM", "thetaM"))):
+            if column == "irho" and not absorbing:
+                continue
+            contour_data[name]["data"][column] = _draw_band(
+                best,
+                q,
+                f"{name} {column}",
+                zp,
+                contours,
+                fig=fig,
+                color_index=color_index + k,
+                row=row,
+                col=col,
+                secondary_y=(column == "thetaM"),
+            )
+
+    _profile_labels(fig=fig, row=row, col=col, magnetic=has_magnetism)
+    return contour_data
+
+
 def _draw_contours(
     group,
     index,
@@ -224,14 +281,28 @@ def _draw_contours(
     col: Optional[int] = None,
     secondary_y: bool = False,
 ):
-    # Interpolate on common z
-    fp = np.vstack([np.interp(zp, L[0], L[index]) for L in group])
+    best, _, q = _profile_quantiles(group, index, zp, contours)
+    return _draw_band(best, q, label, zp, contours, fig, color_index, row=row, col=col, secondary_y=secondary_y)
+
+
+def _draw_band(
+    best,
+    q,
+    label,
+    zp,
+    contours,
+    fig: "go.Figure",
+    color_index: int,
+    row: Optional[int] = None,
+    col: Optional[int] = None,
+    secondary_y: bool = False,
+):
     # Plot the quantiles
     color = get_color(color_index)
     legendgroup = f"group_{color_index}"
     fig.add_scattergl(
         x=zp,
-        y=fp[0],
+        y=best,
         mode="lines",
         name=label,
         line=dict(color=color),
@@ -241,9 +312,9 @@ def _draw_contours(
         secondary_y=secondary_y,
     )
     named_contours = _plot_quantiles(
-        zp, fp, contours, color, alpha=None, fig=fig, row=row, col=col, legendgroup=legendgroup, secondary_y=secondary_y
+        zp, q, contours, color, alpha=None, fig=fig, row=row, col=col, legendgroup=legendgroup, secondary_y=secondary_y
     )
-    named_contours["best"] = fp[0]
+    named_contours["best"] = best
     # Plot the best
     # axes.plot(zp, fp[0], '-', label=label, color=dark(color))
     return named_contours
@@ -317,12 +388,37 @@ def _residuals_contour(Q, residuals, contours, fig: "go.Figure", row: Optional[i
             row=row,
             col=col,
         )
-        _plot_quantiles(sorted_x, shift + r.T[:, sort_order], contours, color, alpha=None, fig=fig, row=row, col=col)
+        _, q = form_quantiles(shift + r.T[:, sort_order], contours)
+        _plot_quantiles(sorted_x, q, contours, color, alpha=None, fig=fig, row=row, col=col)
         # Plot the best
         shift += 5
     _residuals_labels(fig, row=row, col=col)
 
 
+def _residuals_bands(
+    bands: dict, contours: tuple[float], fig: "go.Figure", row: Optional[int] = None, col: Optional[int] = None
+):
+    shift = 0
+    for model_index, (m, (x, best, q)) in enumerate(bands.items()):
+        color = get_color(model_index * 4)
+        # residuals x may not be sorted:
+        sort_order = np.argsort(x)
+        fig.add_scattergl(
+            x=x[sort_order],
+            y=shift + best[sort_order],
+            mode="markers",
+            name=m.name,
+            marker=dict(color=color, size=3),
+            row=row,
+            col=col,
+        )
+        _plot_quantiles(
+            x[sort_order], shift + q[:, :, sort_order], contours, color, alpha=None, fig=fig, row=row, col=col
+        )
+        shift += 5
+    _residuals_labels(fig, row=row, col=col)
+
+
 def _residuals_labels(fig, row=None, col=None):
     fig.update_xaxes(title_text="Q (1/Å)", row=row, col=col, showline=True, zeroline=False)
     fig.update_yaxes(title_text="Residuals", row=row, col=col, showline=True)
@@ -339,7 +435,7 @@ def _profiles_draw_align_lines(
 
 def _plot_quantiles(
     x,
-    y,
+    q,
     contours,
     color,
     alpha,
@@ -354,7 +450,8 @@ def _plot_quantiles(
 
     *x* is the x coordinates for all lines.
 
-    *y* is the y coordinates, one row for each line.
+    *q* is the quantile values for the confidence intervals, as returned
+    by :func:`bumps.plotutil.form_quantiles`.
 
     *contours* is a list of confidence intervals expressed as percents.
 
@@ -366,8 +463,6 @@ def _plot_quantiles(
     *alpha* is the transparency level to use for all fill regions.  The
     default value, alpha=2./(#contours+1), works pretty well.
     """
-    _, q = form_quantiles(y, contours)
-
     output = {}
     if alpha is None:
         alpha = 2.0 / (len(q) + 1)
@@ -0,0 +1,153 @@
+"""
+On-disk cache for the profile uncertainty samples.
+
+Evaluating the profiles and residuals for thousands of posterior samples is
+the slow part of the profile uncertainty plot, while the alignment, contours
+and number of plotted points are cheap to change.  The output of
+:func:`refl1d.uncertainty.calc_errors` is saved in the cache directory and
+reused for the same samples, even after the server restarts.
+
+The entry for a plot is keyed on a hash of the uncertainty state, the
+indices of the samples drawn from it, and a fingerprint of the problem
+made from the parameter names, the current parameter values and the
+measured data.  The random sample selection is seeded from the state hash,
+so the same samples are drawn each time for a given state.
+
+The cache directory is *REFL1D_CACHE_DIR*/uncertainty, defaulting to
+~/.cache/refl1d/uncertainty.  Only the most recent *MAX_ENTRIES* entries
+are kept.
+
+Samples which are not in the cache are evaluated in the server process.
+Set *REFL1D_UNCERTAINTY_WORKERS* to a number of worker processes to
+evaluate them in a :class:`refl1d.uncertainty.WorkerPool` instead, which is
+started on first use and kept between requests.  If the workers cannot be
+started, the samples are evaluated in the server process.
+"""
+
+import hashlib
+import os
+import threading
+from copy import deepcopy
+from pathlib import Path
+
+import numpy as np
+
+from refl1d.uncertainty import WorkerPool, _experiments, calc_errors, load_errors, save_errors
+
+MAX_ENTRIES = 20
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_pool():
+    """
+    Return the workers used to evaluate the uncertainty samples: the shared
+    :class:`refl1d.uncertainty.WorkerPool` if *REFL1D_UNCERTAINTY_WORKERS*
+    is more than one, or 1 to evaluate them in this process.
+    """
+    global _pool
+    try:
+        workers = int(os.environ.get("REFL1D_UNCERTAINTY_WORKERS", 1))
+    except ValueError:
+        workers = 1
+    if workers <= 1:
+        return 1
+    with _pool_lock:
+        if _pool is None or _pool.workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = WorkerPool(workers)
+        return _pool
+
+
+def cache_dir():
+    """
+    Return the directory holding the cached uncertainty samples.
+    """
+    root = os.environ.get("REFL1D_CACHE_DIR", None)
+    if root is None:
+        root = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "refl1d"
+    return Path(root) / "uncertainty"
+
+
+def sample_indices(nsamples, nshown, random, seed):
+    """
+    Return the indices of the points used by
+    :func:`bumps.errplot.error_points_from_state`, with the random
+    selection drawn from a generator seeded with *seed*.
+    """
+    index = np.arange(nsamples)
+    if random:
+        # Skip the last point, which is the best point from state.keep_best().
+        index = np.random.default_rng(seed).permutation(nsamples - 1)
+    return index[-min(nshown, nsamples) : -1]
+
+
+def problem_fingerprint(problem):
+    """
+    Hash of the parameters and data of *problem*.
+    """
+    digest = hashlib.sha1()
+    digest.update("\n".join(problem.labels()).encode("utf-8"))
+    digest.update(np.asarray(problem.getp(), "d").tobytes())
+    for m in _experiments(problem):
+        probe = m.probe
+        for xs in probe.xs if probe.polarized else [probe]:
+            if xs is None:
+                continue
+            for v in (xs.Q, getattr(xs, "R", None), getattr(xs, "dR", None)):
+                if v is not None:
+                    digest.update(np.asarray(v, "d").tobytes())
+    return digest.hexdigest()
+
+
+def get_errors(problem, uncertainty_state, nshown, random, directory=None, log=None, workers=None):
+    """
+    Return :func:`refl1d.uncertainty.calc_errors` for *nshown* points drawn
+    from *uncertainty_state*, loading them from the cache if available.
+
+    The problem is copied before the points are evaluated, so it is not
+    modified.  The points are evaluated by *workers*, which defaults to
+    :func:`worker_pool`.
+    """
+    directory = cache_dir() if directory is None else Path(directory)
+    points, _ = uncertainty_state.sample(portion=1.0)
+    state_hash = hashlib.sha1(np.ascontiguousarray(points).tobytes()).hexdigest()
+    index = sample_indices(len(points), nshown, random, seed=int(state_hash[:8], 16))
+    key = hashlib.sha1(
+        "/".join((state_hash, hashlib.sha1(index.tobytes()).hexdigest(), problem_fingerprint(problem))).encode()
+    )
+    path = directory / f"{key.hexdigest()}.npz"
+    if path.exists():
+        try:
+            errors = load_errors(path)
+            path.touch()
+            if log is not None:
+                log(f"loaded uncertainty samples from {path}")
+            return errors
+        except (OSError, ValueError, KeyError):
+            pass
+
+    errors = calc_errors(deepcopy(problem), points[index], workers=worker_pool() if workers is None else workers)
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry.
+        partial = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(partial, "wb") as fid:
+            save_errors(errors, fid)
+        os.replace(partial, path)
+        _prune(directory)
+    except OSError as exc:
+        if log is not None:
+            log(f"could not cache uncertainty samples: {exc}")
+    return errors
+
+
+def _prune(directory):
+    entries = sorted(directory.glob("*.npz"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in entries[MAX_ENTRIES:]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
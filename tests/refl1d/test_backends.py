@@ -0,0 +1,284 @@
+import importlib
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from refl1d.backends import BACKEND_MODULE_NAMES
+
+
+def _random_slabs(nlayers, nprobe=1, seed=1):
+    rng = np.random.default_rng(seed)
+    depth = rng.uniform(5, 200, nlayers)
+    depth[0] = depth[-1] = 0.0
+    sigma = rng.uniform(0, 10, nlayers - 1)
+    rho = rng.uniform(-1, 8, (nprobe, nlayers))
+    irho = rng.uniform(0, 0.1, (nprobe, nlayers)) + 1e-30
+    return depth, sigma, rho, irho
+
+
+def _numba_and_numpy():
+    return [importlib.import_module(BACKEND_MODULE_NAMES[name]) for name in ("numba", "numpy")]
+
+
+def _reflamp(backend, kz, depth, sigma, rho, irho, rho_index=None):
+    if rho_index is None:
+        rho_index = np.zeros(kz.shape, "i")
+    r = np.empty(kz.shape, "D")
+    backend.reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r)
+    return r
+
+
+def test_numba_parallel_matches_serial():
+    serial = importlib.import_module(BACKEND_MODULE_NAMES["numba"])
+    parallel = importlib.import_module(BACKEND_MODULE_NAMES["numba_parallel"])
+    depth, sigma, rho, irho = _random_slabs(20)
+    # Use enough points to exercise the threaded kernel, including negative kz.
+    kz = np.linspace(-0.2, 0.2, 2 * parallel.MIN_PARALLEL_POINTS + 1)
+    expected = _reflamp(serial, kz, depth, sigma, rho, irho)
+    assert np.array_equal(_reflamp(parallel, kz, depth, sigma, rho, irho), expected)
+    # Small problems go through the serial kernel.
+    assert np.array_equal(_reflamp(parallel, kz[:10], depth, sigma, rho, irho), expected[:10])
+
+
+def test_numba_parallel_convolve_matches_serial():
+    serial = importlib.import_module(BACKEND_MODULE_NAMES["numba"])
+    parallel = importlib.import_module(BACKEND_MODULE_NAMES["numba_parallel"])
+    n = 2 * parallel.MIN_PARALLEL_POINTS + 1
+    xin = np.linspace(0.0, 0.31, 5 * n)
+    yin = np.exp(-20 * xin) * (1 + 0.5 * np.cos(200 * xin))
+    x = np.linspace(0.005, 0.3, n)
+    dx = 0.01 * x + 0.001
+    xp = np.linspace(-3, 3, 31)
+    yp = np.exp(-0.5 * xp**2)
+    cases = {
+        "convolve_gaussian": (xin, yin, x, dx),
+        "convolve_uniform": (xin, yin, x, dx),
+        "convolve_sampled": (xin, yin, xp, yp, x, dx),
+    }
+    for name, args in cases.items():
+        expected = np.empty(n)
+        getattr(serial, name)(*args, expected)
+        y = np.empty(n)
+        getattr(parallel, name)(*args, y)
+        assert np.array_equal(y, expected)
+        # Each thread keeps its own window index, whatever the thread count.
+        for nthreads in (2, 3, 7):
+            y = np.empty(n)
+            parallel.KERNELS.get("_parallel_" + name)(*args, y, nthreads)
+            assert np.array_equal(y, expected)
+
+
+def test_repeat_matches_expanded():
+    depth, sigma, rho, irho = _random_slabs(4, seed=3)
+    # Substrate, 3 slabs, 10 periods of 4 slabs with a different top interface, 2 slabs, surface
+    start, length, count = 4, 4, 10
+
+    def tile(v, n):
+        return np.hstack([v[..., :1]] * 4 + [np.tile(v, n)] + [v[..., -1:]] * 3)
+
+    depth, rho, irho = tile(depth, count), tile(rho, count), tile(irho, count)
+    sigma = tile(np.hstack((sigma, 2.0)), count)[:-1]
+    sigma[start + length * count - 1] = 7.0
+    repeats = [np.array([v], "i") for v in (start, length, count)]
+    kz = np.hstack((np.linspace(-0.2, -0.001, 50), np.linspace(0.001, 0.2, 50)))
+    rho_index = np.zeros(kz.shape, "i")
+    for name in ("python", "numba", "numba_parallel"):
+        backend = importlib.import_module(BACKEND_MODULE_NAMES[name])
+        expected = _reflamp(backend, kz, depth, sigma, rho, irho)
+        r = np.empty(kz.shape, "D")
+        backend.reflectivity_amplitude_repeat(depth, sigma, rho, irho, kz, rho_index, *repeats, r)
+        assert np.allclose(r, expected, rtol=1e-12, atol=1e-14)
+
+
+def test_partial_update_matches_full():
+    nlayers = 30
+    depth, sigma, rho, irho = _random_slabs(nlayers, seed=5)
+    kz = np.hstack((np.linspace(-0.2, -0.001, 50), [0.0], np.linspace(0.001, 0.2, 50)))
+    rho_index = np.zeros(kz.shape, "i")
+    for name in ("python", "numba", "numba_parallel"):
+        backend = importlib.import_module(BACKEND_MODULE_NAMES[name])
+        prefix = np.empty((len(kz), nlayers - 1, 4), "D")
+        suffix = np.empty((len(kz), nlayers - 1, 2), "D")
+        r = np.empty(kz.shape, "D")
+        backend.reflectivity_amplitude_cache(depth, sigma, rho, irho, kz, rho_index, prefix, suffix, r)
+        assert np.array_equal(r, _reflamp(backend, kz, depth, sigma, rho, irho))
+        for first, last in [(0, 0), (1, 1), (5, 7), (12, 12), (nlayers - 2, nlayers - 2), (nlayers - 1, nlayers - 1)]:
+            depth2, sigma2, rho2, irho2 = depth.copy(), sigma.copy(), rho.copy(), irho.copy()
+            depth2[max(first, 1) : min(last + 1, nlayers - 1)] *= 1.1
+            sigma2[first : min(last + 1, nlayers - 1)] += 0.5
+            rho2[:, first : last + 1] += 0.3
+            irho2[:, first : last + 1] += 0.01
+            backend.reflectivity_amplitude_update(
+                depth2, sigma2, rho2, irho2, kz, rho_index, prefix, suffix, first, last, r
+            )
+            expected = _reflamp(backend, kz, depth2, sigma2, rho2, irho2)
+            assert np.allclose(r, expected, rtol=1e-12, atol=1e-14)
+
+
+def test_gradient_matches_finite_difference():
+    nlayers = 8
+    depth, sigma, rho, irho = _random_slabs(nlayers, seed=7)
+    kz = np.hstack((np.linspace(-0.2, -0.001, 50), [0.0], np.linspace(0.001, 0.2, 50)))
+    rho_index = np.zeros(kz.shape, "i")
+    h = 1e-5
+    for name in ("python", "numba", "numba_parallel"):
+        backend = importlib.import_module(BACKEND_MODULE_NAMES[name])
+        r = np.empty(kz.shape, "D")
+        dr = [np.empty((len(kz), n), "D") for n in (nlayers, nlayers - 1, nlayers, nlayers)]
+        backend.reflectivity_amplitude_gradient(depth, sigma, rho, irho, kz, rho_index, r, *dr)
+        assert np.allclose(r, _reflamp(backend, kz, depth, sigma, rho, irho), rtol=1e-14, atol=1e-15)
+        for v, dv in zip((depth, sigma, rho[0], irho[0]), dr):
+            for j in range(len(v)):
+                save = v[j]
+                v[j] = save + h
+                rp = _reflamp(backend, kz, depth, sigma, rho, irho)
+                v[j] = save - h
+                rm = _reflamp(backend, kz, depth, sigma, rho, irho)
+                v[j] = save
+                assert np.allclose(dv[:, j], (rp - rm) / (2 * h), rtol=1e-5, atol=1e-8)
+
+
+def test_numba_kernels_compile_on_demand():
+    # Run in a fresh interpreter since other tests may have used the kernels.
+    script = """
+import sys
+import numpy as np
+from refl1d.sample.reflectivity import reflectivity_amplitude
+from refl1d.lib.numba import reflectivity as module
+reflectivity_amplitude(np.linspace(0.01, 0.1, 5), [0, 100, 0], [2.07, 4, 0], [0, 0, 0], [3, 3])
+print("refl1d.lib.numba.magnetic" in sys.modules, "reflectivity_amplitude_gradient" in vars(module))
+"""
+    env = dict(os.environ, REFL1D_BACKEND="numba")
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_numba_parallel_compiles_on_demand():
+    # Importing the backend neither compiles a kernel nor checks for threads.
+    script = """
+import numpy as np
+from refl1d.lib.numba import parallel
+compiled = lambda: sorted(name for name in parallel.KERNELS.builders if name in vars(parallel))
+print(parallel.PARALLEL_AVAILABLE, compiled())
+r = np.empty(10, "D")
+parallel.reflectivity_amplitude(np.zeros(2), np.zeros(1), np.zeros((1, 2)), np.zeros((1, 2)), np.linspace(0.01, 0.1, 10), np.zeros(10, "i"), r)
+print(parallel.PARALLEL_AVAILABLE, compiled())
+x = np.linspace(0, 1, 2 * parallel.MIN_PARALLEL_POINTS)
+parallel.convolve_gaussian(x, x, x, np.full(x.shape, 0.01), np.empty(x.shape))
+print(parallel.PARALLEL_AVAILABLE is not None, compiled())
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines() == [
+        "None []",
+        "None []",
+        "True ['_parallel_convolve_gaussian', '_threading_check']",
+    ]
+
+
+def _smooth_profile(n, nprobe, seed=5):
+    rng = np.random.default_rng(seed)
+    d = rng.uniform(0.5, 2, n)
+    sigma = np.zeros(n - 1)
+    sigma[::40] = 3.0
+    rho = np.cumsum(rng.normal(0, 0.1, (nprobe, n)), axis=1)
+    irho = np.abs(np.cumsum(rng.normal(0, 0.01, (nprobe, n)), axis=1))
+    return d, sigma, rho, irho
+
+
+def test_contract_by_area_multi():
+    d, sigma, rho, irho = _smooth_profile(300, 3)
+    for name in ("python", "numba", "numpy"):
+        backend = importlib.import_module(BACKEND_MODULE_NAMES[name])
+        # With a single wavelength the result matches contract_by_area.
+        single = [v.copy() for v in (d, sigma, rho[0], irho[0])]
+        multi = [v.copy() for v in (d, sigma, rho[:1], irho[:1])]
+        k = backend.contract_by_area(*single, 0.5)
+        assert backend.contract_by_area_multi(*multi, 0.5) == k
+        for a, b in zip(single, multi):
+            assert np.array_equal(a.ravel()[: k - 1], b.ravel()[: k - 1])
+
+        # With several wavelengths the joint contraction keeps every
+        # wavelength within the tolerance, so it splits at least as often
+        # as contracting any one wavelength alone.
+        args = [v.copy() for v in (d, sigma, rho, irho)]
+        k = backend.contract_by_area_multi(*args, 0.5)
+        for row in range(len(rho)):
+            single = [v.copy() for v in (d, sigma, rho[row], irho[row])]
+            assert k >= backend.contract_by_area(*single, 0.5)
+        assert k < len(d)
+        assert np.isclose(args[0][1:k].sum(), d[1:].sum())
+
+
+def test_numpy_reflectivity_amplitude_matches_numba():
+    depth, sigma, rho, irho = _random_slabs(20, nprobe=2)
+    kz = np.hstack((np.linspace(-0.2, -0.001, 100), [0.0], np.linspace(0.001, 0.2, 100)))
+    rho_index = (np.arange(len(kz)) % 2).astype("i")
+    r = [np.empty(kz.shape, "D") for _ in range(2)]
+    for backend, r_k in zip(_numba_and_numpy(), r):
+        backend.reflectivity_amplitude(depth, sigma, rho, irho, kz, rho_index, r_k)
+    assert np.allclose(r[1], r[0], rtol=1e-12, atol=1e-14)
+
+
+def test_numpy_magnetic_amplitude_matches_numba():
+    depth, sigma, rho, irho = _random_slabs(12, seed=2)
+    rng = np.random.default_rng(3)
+    rhoM = rng.uniform(0, 2, len(depth))
+    rhoM[0] = rhoM[-1] = 0.0
+    thetaM = np.radians(rng.uniform(0, 360, len(depth)))
+    kz = np.hstack((np.linspace(-0.1, -0.001, 60), [0.0], np.linspace(0.001, 0.1, 60)))
+    rho_index = np.zeros(kz.shape, "i")
+    R = []
+    for backend in _numba_and_numpy():
+        sld_b, u1, u3 = rhoM.copy(), np.empty(len(depth), "D"), np.empty(len(depth), "D")
+        backend.calculate_u1_u3(0.5, sld_b, thetaM, 270.0, u1, u3)
+        R_k = [np.empty(kz.shape, "D") for _ in range(4)]
+        backend.magnetic_amplitude(depth, sigma, rho[0], irho[0], sld_b, u1, u3, kz, rho_index, *R_k)
+        R.append(np.array(R_k))
+    assert np.allclose(R[1], R[0], rtol=1e-10, atol=1e-13)
+
+
+def test_numpy_convolve_gaussian_matches_numba():
+    xin = np.linspace(0.001, 0.3, 400)
+    xin = np.sort(np.hstack((xin, xin[5::37])))  # include duplicate points
+    yin = np.exp(-xin * 20) * (1 + 0.5 * np.cos(xin * 300))
+    x = np.linspace(-0.01, 0.31, 150)
+    dx = 0.002 + 0.02 * x
+    dx[::10] = 0.0
+    y = [np.empty(x.shape) for _ in range(2)]
+    for backend, y_k in zip(_numba_and_numpy(), y):
+        backend.convolve_gaussian(xin, yin, x, dx, y_k)
+    assert np.allclose(y[1], y[0], rtol=1e-10, atol=1e-14)
+
+
+def test_numpy_build_profile_matches_numba():
+    z = np.linspace(-20, 200, 500)
+    offset = np.array([0.0, 40.0, 90.0, 150.0])
+    roughness = np.array([3.0, 0.0, 10.0, 1.0])
+    value = np.array([[2.07, 4.0, -0.5, 6.0, 0.0], [0.0, 0.1, 0.0, 0.3, 0.0]])
+    contrast = np.diff(value, axis=1).ravel()
+    initial_value = value[:, 0].copy()
+    profiles = [np.zeros(len(z) * len(value)) for _ in range(2)]
+    for backend, p in zip(_numba_and_numpy(), profiles):
+        backend.build_profile(z, offset, roughness, contrast, initial_value, p)
+    assert np.allclose(profiles[1], profiles[0], rtol=1e-12, atol=1e-12)
+
+
+def test_numpy_contract_by_area_matches_numba():
+    rng = np.random.default_rng(4)
+    n = 300
+    d = rng.uniform(0.5, 2, n)
+    sigma = np.zeros(n - 1)
+    sigma[::40] = 3.0
+    rho = np.cumsum(rng.normal(0, 0.1, n))
+    irho = np.abs(np.cumsum(rng.normal(0, 0.01, n)))
+    for dA in (0.0, 0.5, 5.0, 1e6):
+        results = []
+        for backend in _numba_and_numpy():
+            args = [v.copy() for v in (d, sigma, rho, irho)]
+            k = backend.contract_by_area(*args, dA)
+            results.append([k] + [v[:k] for v in args])
+        assert results[1][0] == results[0][0]
+        for a, b in zip(results[1][1:], results[0][1:]):
+            assert np.allclose(a, b, rtol=1e-12, atol=0)
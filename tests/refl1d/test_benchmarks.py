@@ -0,0 +1,30 @@
+import json
+
+from refl1d import benchmarks
+
+SMALL = {"layers": (4, 8), "points": (20,), "oversampling": (1, 2)}
+
+
+def test_run_and_compare(tmp_path):
+    results = benchmarks.run(backends=["python", "numpy"], sweep=SMALL, repeat=1)
+    timed = [r for r in results if "time" in r]
+    assert {r["kernel"] for r in timed} == set(benchmarks.KERNELS)
+    assert all(r["time"] >= 0 for r in timed)
+
+    filename = tmp_path / "bench.json"
+    benchmarks.save(results, filename)
+    assert "numpy" in json.loads(filename.read_text())
+    baseline = benchmarks.load(filename)
+    assert benchmarks.compare(results, baseline) == []
+
+    # A slower case shows up as a regression.
+    slower = [dict(r, time=r["time"] * 2 + 1e-3) if "time" in r else r for r in results]
+    regressions = benchmarks.compare(slower, baseline, tolerance=0.2)
+    assert len(regressions) == len(timed)
+
+
+def test_unavailable_backend():
+    results = benchmarks.run(backends=["c_ext"], kernels=["rebin_counts"], sweep=SMALL, repeat=1)
+    # c_ext may or may not be built; either way every case is reported.
+    assert len(results) == 2
+    assert all("time" in r or r["skipped"] == "backend unavailable" for r in results)
@@ -19,9 +19,12 @@ from refl1d.sample.polymer import (
     Propagator,
     SCFcache,
     SCFeqns,
+    SCFstore,
     SCFprofile,
     SCFsolve,
     SZdist,
+    calc_phi_z,
+    compose,
 )
 
 
@@ -518,6 +521,24 @@ def calc_g_zs_free_test():
     check(g_zs.free(), g_zs_data, rtol=1e-7)
 
 
+def calc_phi_z_test():
+    # the blocked propagators match the full propagators
+    layers = 40
+    g_z = np.linspace(1.1, 0.9, layers)
+    for pdi, segments in ((1, 30), (1.3, 25)):
+        p_i = SZdist(pdi, segments)
+        g_zs = Propagator(g_z, p_i.size)
+        ta = g_zs.ta()
+        if pdi == 1:
+            expected = compose(ta, g_zs.ngts_u(0.1 / np.sum(ta[:, -1])), g_z)
+        else:
+            expected = compose(ta, g_zs.ngts(0.1 * p_i / np.sum(ta, axis=0)), g_z)
+            r_i = np.arange(1, p_i.size + 1)
+            expected += compose(g_zs.free(), g_zs.ngts(0.01 * p_i / r_i * np.exp(0.2 * r_i)), g_z)
+        phi_b = 0 if pdi == 1 else 0.01
+        check(calc_phi_z(g_z, segments, 0.1, phi_b, 0.2, p_i), expected, rtol=1e-12)
+
+
 def SZdist_test():
     # uniform
     pdi = 1
@@ -1301,6 +1322,24 @@ def SCFsolve_test():
     check(result, data)
 
 
+def SCFsolve_inner_rtol_test():
+    try:
+        from scipy.optimize import NoConvergence
+    except ImportError:
+        # cruft from scipy < 1.14, hard breaking change with no warning
+        from scipy.optimize.nonlin import NoConvergence
+    # the looser Newton steps land on the same solution within tolerance
+    result = SCFsolve(0.1, 0.05, 1.2, 0.1, 0, 95.5, inner_rtol=0.1)
+    check(result, easy_phi_z, atol=1e-6, rtol=0)
+
+    # but do not make the hard one converge without a guess
+    try:
+        SCFsolve(1, 0.5, 1.2, 0.1, 0, 95.5, inner_rtol=0.1)
+        assert False, "should not arrive here"
+    except NoConvergence:
+        pass
+
+
 def SCFcache_test():
     # check that the hard solution can be found by walking
     chi = 1
@@ -1369,6 +1408,11 @@ def SCFcache_test():
     result = SCFcache(chi, chi_s, pdi, sigma, 0, navgsegments, cache=cache)
     check(result, data, atol=1e-12, rtol=1e-6)
 
+    # the walk with looser Newton steps gives the same solution within the
+    # solver tolerance on the residual, about 6e-6
+    result = SCFcache(chi, chi_s, pdi, sigma, 0, navgsegments, cache=OrderedDict(), inner_rtol=0.1)
+    check(result, data, atol=1e-5, rtol=0)
+
     # check that the cache is holding items
     assert cache
 
@@ -1383,6 +1427,105 @@ def SCFcache_test():
         assert newest_key == list(cache)[-2]
 
 
+def SCFstore_test():
+    import tempfile
+    from collections import OrderedDict
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SCFstore(directory, capacity=5)
+        expected = SCFcache(0.3, 0.1, 1.1, 0.08, 0, 60, cache=OrderedDict(), store=store)
+        # the primed solutions and the new solution are saved
+        assert len(store) == 4
+
+        # a new process finds the solution without priming
+        cache = OrderedDict()
+        result = SCFcache(0.3, 0.1, 1.1, 0.08, 0, 60, cache=cache, store=store)
+        check(result, expected)
+        assert len(cache) == 1
+
+        # and walks from it to a nearby solution
+        reference = SCFcache(0.32, 0.1, 1.1, 0.08, 0, 60, cache=OrderedDict(), store=None)
+        result = SCFcache(0.32, 0.1, 1.1, 0.08, 0, 60, cache=cache, store=SCFstore(directory, capacity=5))
+        check(result, reference, atol=1e-8, rtol=1e-4)
+
+        # least recently used solutions are removed beyond the capacity
+        key = (0.3, 0.1 * 3, 1.1 - 1, 0.08, 0, 60 / 500)
+        store.nearest(key)
+        for k in range(3):
+            store.add((k, 0, 0, 0, 0, 0), np.ones(3))
+        assert len(store) == 5
+        assert store.nearest(key)[0] == key
+
+
+def SCFcache_inner_rtol_test():
+    import tempfile
+    from collections import OrderedDict
+
+    key = (0.3, 0.1 * 3, 1.1 - 1, 0.08, 0, 60 / 500)
+    with tempfile.TemporaryDirectory() as directory:
+        cache, store = OrderedDict(), SCFstore(directory)
+        default = SCFcache(0.3, 0.1, 1.1, 0.08, 0, 60, cache=cache, store=store)
+        # a solution for the scipy schedule is not returned for another
+        # tolerance, though the walk starts from it
+        loose = SCFcache(0.3, 0.1, 1.1, 0.08, 0, 60, cache=cache, store=store, inner_rtol=0.1)
+        assert key in cache and (*key, 0.1) in cache
+        check(loose, default, atol=1e-6, rtol=0)
+        # the store keeps the tolerance with the solution
+        fresh = OrderedDict()
+        result = SCFcache(0.3, 0.1, 1.1, 0.08, 0, 60, cache=fresh, store=SCFstore(directory), inner_rtol=0.1)
+        assert list(fresh) == [(*key, 0.1)]
+        assert np.array_equal(result, loose)
+
+
+def SCFstore_index_test():
+    import tempfile
+    from unittest import mock
+
+    with tempfile.TemporaryDirectory() as directory:
+        store, other = SCFstore(directory), SCFstore(directory)
+        store.add((0, 0, 0, 0, 0, 0), np.zeros(3))
+        assert len(other) == 1
+        # other processes see each new solution at once, even within the
+        # time stamp resolution of the file system, without a rescan
+        with mock.patch("os.scandir", side_effect=AssertionError("directory rescanned")):
+            for k in range(1, 100):
+                store.add((k, 0, 0, 0, 0, 0), np.full(3, k))
+                assert len(other) == k + 1
+                key, phi = other.nearest((k + 0.1, 0, 0, 0, 0, 0))
+                assert key[0] == k and phi[0] == k
+
+
+def SCFstore_prune_test():
+    import os
+    import tempfile
+    from unittest import mock
+
+    with tempfile.TemporaryDirectory() as directory:
+        store, other = SCFstore(directory, capacity=3), SCFstore(directory, capacity=3)
+        store.add((0, 0, 0, 0, 0, 0), np.zeros(3))
+        # the count is kept in memory, so adding does not reread the index
+        with mock.patch.object(SCFstore, "_refresh", side_effect=AssertionError("index reread")):
+            for k in range(1, 3):
+                store.add((k, 0, 0, 0, 0, 0), np.full(3, k))
+
+        # a solution added by another process while the store is pruned
+        # is kept in the index even though the directory scan missed it
+        scandir = os.scandir
+
+        def add_during_scan(path):
+            entries = list(scandir(path))
+            other.add((10, 0, 0, 0, 0, 0), np.full(3, 10))
+            return iter(entries)
+
+        with mock.patch("os.scandir", side_effect=add_during_scan):
+            store.add((3, 0, 0, 0, 0, 0), np.full(3, 3))
+        assert not os.path.exists(os.path.join(directory, "prune.lock"))
+        fresh = SCFstore(directory)
+        assert len(fresh) == 4
+        key, phi = fresh.nearest((10, 0, 0, 0, 0, 0))
+        assert key[0] == 10 and phi[0] == 10
+
+
 long_profile = np.array(
     (
         4.99203946e-01,
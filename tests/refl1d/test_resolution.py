@@ -154,5 +154,182 @@ def test():
             print(s)
 
 
+def test_convolve_matrix():
+    from refl1d.sample.reflectivity import convolve, convolve_matrix
+
+    xin = np.linspace(0.001, 0.3, 400)
+    xin = np.sort(np.hstack((xin, xin[5::37])))  # include duplicate points
+    yin = np.exp(-xin * 20) * (1 + 0.5 * np.cos(xin * 300))
+    x = np.linspace(-0.01, 0.31, 150)  # includes points outside the theory
+    dx = 0.002 + 0.02 * np.abs(x)
+    dx[::10] = 0.0
+    for resolution in ("normal", "uniform"):
+        W = convolve_matrix(xin, x, dx, resolution=resolution)
+        expected = convolve(xin, yin, x, dx, resolution=resolution)
+        assert np.allclose(W @ yin, expected, rtol=1e-10, atol=1e-14)
+
+
+def test_resolution_matrix_cache():
+    import pickle
+    from copy import deepcopy
+
+    from refl1d.names import NeutronProbe
+    from refl1d.sample.reflectivity import convolve
+
+    probe = NeutronProbe(T=np.linspace(0.1, 5, 50), dT=0.02, L=4.75, dL=0.0475)
+    probe.oversample(5, seed=1)
+    Q = probe.calc_Q
+    R = np.exp(-20 * np.abs(Q))
+    expected = convolve(Q, R, probe.Q, probe.dQ, resolution=probe.resolution)
+    # The matrix is used from the first call, so repeats match exactly.
+    first = probe.apply_beam(Q, R)[1]
+    assert probe._resolution_cache[4] is not None
+    assert np.allclose(first, expected, rtol=1e-10)
+    assert np.array_equal(probe.apply_beam(Q, R)[1], first)
+    # Copies rebuild the matrix rather than carrying it along.
+    for copy in (pickle.loads(pickle.dumps(probe)), deepcopy(probe)):
+        assert not hasattr(copy, "_resolution_cache")
+        assert np.array_equal(copy.apply_beam(Q, R)[1], first)
+    # Changing the resolution rebuilds the matrix.
+    probe.dQ = 2 * probe.dQ
+    assert not np.allclose(probe.apply_beam(Q, R)[1], first, rtol=1e-10)
+    assert np.allclose(probe._resolution_cache[3], probe.dQ)
+    # A fitted theta offset moves the points, so convolve directly.
+    probe.theta_offset.range(-0.01, 0.01)
+    probe.theta_offset.value = 0.005
+    probe._resolution_cache = None
+    direct = probe.apply_beam(probe.calc_Q, R)[1]
+    assert probe._resolution_cache is None
+    assert np.array_equal(direct, convolve(probe.calc_Q, R, probe.Q, probe.dQ, resolution=probe.resolution))
+
+
+def test_resolution_matrix_size(monkeypatch):
+    from refl1d.names import NeutronProbe
+    from refl1d.probe import probe as probe_module
+    from refl1d.sample.reflectivity import convolve, convolve_matrix
+
+    probe = NeutronProbe(T=np.linspace(0.1, 5, 50), dT=0.02, L=4.75, dL=0.0475)
+    probe.oversample(5, seed=1)
+    Q = probe.calc_Q
+    R = np.exp(-20 * np.abs(Q))
+    entries = convolve_matrix(Q, probe.Q, probe.dQ, resolution=probe.resolution).nnz
+    assert convolve_matrix(Q, probe.Q, probe.dQ, resolution=probe.resolution, max_entries=entries // 2) is None
+    # Problems with too large a matrix are convolved directly.
+    monkeypatch.setattr(probe_module, "RESOLUTION_MATRIX_MAX_ENTRIES", entries // 2)
+    direct = probe.apply_beam(Q, R)[1]
+    assert probe._resolution_cache[4] is None
+    assert np.array_equal(direct, convolve(Q, R, probe.Q, probe.dQ, resolution=probe.resolution))
+
+
+def test_adaptive_oversample():
+    from refl1d.names import SLD, Experiment, NeutronProbe, air, silicon
+    from refl1d.probe.oversampling import fringe_oversampling
+
+    n = fringe_oversampling(np.array([0.0, 1e-5, 1e-3, 1.0]), 1000.0, tolerance=0.05, max_oversampling=50)
+    assert n.tolist() == [1, 1, 8, 50]
+    assert (fringe_oversampling(np.array([1e-3, 1.0]), 0.0) == 1).all()
+
+    film = SLD(name="film", rho=4.0)
+    sample = silicon(0, 5) | film(3000, 5) | air
+
+    def measure():
+        probe = NeutronProbe(T=np.linspace(0.2, 4, 200), dT=0.02, L=4.75, dL=0.0475)
+        return Experiment(sample=sample, probe=probe)
+
+    reference = measure()
+    reference.probe.oversample(301, seed=2)
+    reference.update()
+    Rref = reference.reflectivity()[1]
+
+    tolerance = 0.05
+    model = measure()
+    assert model.film_thickness() == 3000.0
+    model.adaptive_oversample(tolerance=tolerance)
+    counts = fringe_oversampling(model.probe.dQ, 3000.0, tolerance=tolerance)
+    assert len(model.probe.calc_Q) == counts.sum()
+    assert counts.min() < counts.max()
+    # Compare against the fringe envelope, away from the critical edge
+    # which is not resolved by the fringe spacing.
+    Q, R = model.reflectivity()
+    envelope = np.array([Rref[max(k - 5, 0) : k + 6].max() for k in range(len(Rref))])
+    error = (np.abs(R - Rref) / envelope)[Q > 0.03]
+    assert error.max() < 2 * tolerance
+
+    # The oversampling is rebuilt when the model is reloaded.
+    from bumps.serialize import deserialize, serialize
+
+    probe = deserialize(serialize(model.probe))
+    assert probe.oversampling_scheme == "adaptive"
+    assert probe.oversampling is None
+    assert probe.oversampling_max == 201
+    assert np.array_equal(probe.calc_Q, model.probe.calc_Q)
+
+    # The adaptive scheme needs the film thickness.
+    try:
+        NeutronProbe(T=np.linspace(0.2, 4, 20), dT=0.02, L=4.75, dL=0.0475, oversampling_scheme="adaptive")
+    except ValueError as exc:
+        assert "oversampling_thickness" in str(exc)
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_optimal_oversampling_bisect():
+    from refl1d.names import SLD, Experiment, NeutronProbe, air, silicon
+    from refl1d.probe.oversampling import _NestedOversampling, get_optimal_single_oversampling
+
+    film = SLD(name="film", rho=4.0)
+
+    def measure():
+        probe = NeutronProbe(T=np.linspace(0.2, 4, 100), dT=0.02, L=4.75, dL=0.0475)
+        model = Experiment(sample=silicon(0, 5) | film(1000, 5) | air, probe=probe)
+        probe.dR = 0.05 * model.reflectivity()[1]
+        return model
+
+    scan, bisect = {}, {}
+    n_scan, _, _ = get_optimal_single_oversampling(measure(), max_oversampling=101, method="scan", stats=scan)
+    model = measure()
+    n, local, Q = get_optimal_single_oversampling(model, max_oversampling=101, stats=bisect)
+    assert bisect["evaluations"] < scan["evaluations"]
+    assert 1 < n < 101 and abs(n - n_scan) <= n_scan // 2
+    assert local[0].shape == Q[0].shape and 1 <= local[0].min() and local[0].max() <= 101
+    # The model is left oversampled at the recommended value, with the
+    # points drawn by the probe within tolerance of the reference.
+    assert len(model.probe.calc_Q) == n * len(model.probe.Q)
+    R_ref = _NestedOversampling(measure(), 101, seed=1).R_ref[0][1]
+    assert np.all(np.abs(model.reflectivity()[1] - R_ref) / model.probe.dR <= 0.05)
+
+
+def test_hermite_oversampling():
+    from refl1d.names import SLD, Experiment, NeutronProbe, air, silicon
+    from refl1d.probe.oversampling import resolution_quadrature
+
+    z, w = resolution_quadrature(7)
+    assert np.isclose(w.sum(), 1) and np.isclose(w @ z**2, 1) and np.isclose(w @ z**4, 3)
+
+    film = SLD(name="film", rho=4.0)
+
+    def reflectivity(n, scheme, **kw):
+        probe = NeutronProbe(T=np.linspace(0.2, 4, 100), dT=0.02, L=4.75, dL=0.0475, **kw)
+        probe.oversample(n, scheme=scheme)
+        model = Experiment(sample=silicon(0, 5) | film(1000, 5) | air, probe=probe)
+        return probe, model.reflectivity()[1]
+
+    _, reference = reflectivity(1001, "random")
+    probe, R = reflectivity(10, "hermite")
+    assert len(probe.calc_Q) == 10 * len(probe.Q)
+    assert probe._quadrature_cache[2] is not None
+    # Ten nodes are as good as a thousand random points, up to the truncation
+    # of the gaussian in the convolution.
+    assert np.max(abs(R - reference) / reference) < 5e-3
+    _, R = reflectivity(10, "random")
+    assert np.max(abs(R - reference) / reference) > 1e-2
+    # The nodes follow the theta offset.
+    probe, R = reflectivity(10, "hermite", theta_offset=0.01)
+    assert probe._quadrature_cache[2] is not None
+    # Clearing the oversampling goes back to convolution.
+    probe.critical_edge(silicon, air)
+    assert probe._quadrature_nodes() is None
+
+
 if __name__ == "__main__":
     test()
@@ -2,6 +2,7 @@ import pickle
 from copy import deepcopy
 
 import dill
+import numpy as np
 from bumps.serialize import deserialize, serialize
 
 from refl1d.names import SLD, Slab
@@ -69,3 +70,115 @@ def test_repeat_serialization():
     assert thickness_plus.value == 340
     sample.stack[0].thickness.value += 40
     assert thickness_plus.value == 500
+
+
+def _superlattice(repeat, magnetic=False):
+    from refl1d.names import Experiment, NeutronProbe, PolarizedNeutronProbe
+    from refl1d.sample.layers import Repeat
+    from refl1d.sample.magnetism import Magnetism
+
+    Si, Ni, Ti, air = SLD("Si", 2.07), SLD("Ni", 9.4, 0.01), SLD("Ti", -1.9), SLD("air", 0)
+    magnetism = Magnetism(rhoM=1.5, thetaM=200) if magnetic else None
+    unit = Ni(45, 4, magnetism=magnetism) | Ti(30, 3)
+    if repeat:
+        multilayer = Repeat(unit, repeat=20, interface=6)
+    else:
+        layers = [Ni(45, 4, magnetism=magnetism), Ti(30, 3)] * 20
+        layers[-1] = Ti(30, 6)
+        multilayer = layers[0]
+        for layer in layers[1:]:
+            multilayer = multilayer | layer
+    sample = Si(0, 5) | SLD("SiOx", 3.4)(15, 3) | multilayer | Ni(20, 2) | air
+    T = np.linspace(0.05, 5, 200)
+    if magnetic:
+        probe = PolarizedNeutronProbe([NeutronProbe(T=T, L=4.75, dT=0.01, dL=0.05) for _ in range(4)])
+    else:
+        probe = NeutronProbe(T=T, L=4.75, dT=0.01, dL=0.05)
+    return Experiment(sample=sample, probe=probe)
+
+
+def test_repeat_matrix_power():
+    """repeated blocks computed as a matrix power match the expanded stack"""
+    for magnetic in (False, True):
+        repeated, expanded = _superlattice(True, magnetic), _superlattice(False, magnetic)
+        R1, R2 = repeated.reflectivity(), expanded.reflectivity()
+        # Magnetic alignment may shift the block start
+        start, length, count = repeated._render_slabs().repeats
+        assert (length[0], count[0]) == (2, 20)
+        assert expanded._render_slabs().repeats is None
+        if magnetic:
+            for xs1, xs2 in zip(R1, R2):
+                assert np.allclose(xs1[1], xs2[1], rtol=1e-8, atol=0)
+        else:
+            assert np.allclose(R1[1], R2[1], rtol=1e-10, atol=0)
+
+
+def test_render_cache():
+    """expensive layers are only rendered again when their parameters change"""
+    from refl1d.names import Experiment, FunctionalProfile, NeutronProbe
+
+    calls = []
+
+    def linear(z, rho_a, rho_b):
+        calls.append(len(z))
+        return rho_a + (rho_b - rho_a) * z / z[-1]
+
+    def build():
+        Si, Au, air = SLD("Si", 2.07), SLD("Au", 4.5), SLD("air", 0)
+        ramp = FunctionalProfile(80, 0, profile=linear, rho_a=2.07, rho_b=4.5)
+        sample = Si(0, 3) | Au(30, 2) | ramp | Au(20, 1) | air
+        probe = NeutronProbe(T=np.linspace(0.1, 4, 50), L=4.75, dT=0.01, dL=0.05)
+        return Experiment(sample=sample, probe=probe, dz=1)
+
+    M = build()
+    M.reflectivity()
+    assert len(calls) == 1
+    # Changing another layer moves the ramp without rendering it again
+    M.sample[1].thickness.value = 45
+    M.update()
+    _, R = M.reflectivity()
+    assert len(calls) == 1
+    fresh = build()
+    fresh.sample[1].thickness.value = 45
+    assert np.array_equal(fresh.reflectivity()[1], R)
+    # Changing the ramp renders it again
+    M.sample[2].rho_b.value = 3.0
+    M.update()
+    M.reflectivity()
+    assert len(calls) == 3  # one each for M, fresh, and M again
+
+
+def test_render_cache_inputs():
+    """expensive layers are rendered again when their other inputs change"""
+    from refl1d.names import Experiment, FunctionalProfile, NeutronProbe
+
+    calls = []
+
+    def linear(z, rho_a, rho_b):
+        calls.append("linear")
+        return rho_a + (rho_b - rho_a) * z / z[-1]
+
+    def step(z, rho_a, rho_b):
+        calls.append("step")
+        return np.where(z < z[-1] / 2, rho_a, rho_b)
+
+    Si, air = SLD("Si", 2.07), SLD("air", 0)
+    ramp = FunctionalProfile(80, 0, profile=linear, rho_a=2.07, rho_b=4.5)
+    probe = NeutronProbe(T=np.linspace(0.1, 4, 50), L=4.75, dT=0.01, dL=0.05)
+    M = Experiment(sample=Si(0, 3) | ramp | air, probe=probe, dz=1)
+    M.reflectivity()
+    assert calls == ["linear"]
+    # A new profile function is used for the next render
+    ramp.profile = step
+    M.update()
+    _, R = M.reflectivity()
+    assert calls == ["linear", "step"]
+    fresh = Experiment(
+        sample=Si(0, 3) | FunctionalProfile(80, 0, profile=step, rho_a=2.07, rho_b=4.5) | air, probe=probe, dz=1
+    )
+    assert np.array_equal(fresh.reflectivity()[1], R)
+    # as is a new tolerance
+    ramp.tol = 1e-2
+    M.update()
+    M.reflectivity()
+    assert calls == ["linear", "step", "step", "step"]
@@ -0,0 +1,301 @@
+import numpy as np
+from bumps.fitproblem import FitProblem
+
+from refl1d.names import SLD, Experiment, QProbe
+from refl1d.uncertainty import (
+    CONTOURS,
+    QUANTILE_BINS,
+    QuantileAccumulator,
+    UncertaintyBands,
+    WorkerPool,
+    _accumulate_profiles,
+    _align_profile_set,
+    _profile_quantiles,
+    align_profiles,
+    calc_errors,
+    form_quantiles,
+    load_errors,
+    save_errors,
+    show_errors,
+)
+
+
+def _problem():
+    Q = np.linspace(0.01, 0.2, 50)
+    probe = QProbe(Q, 0.02 * Q, data=(np.full_like(Q, 0.1), np.full_like(Q, 0.01)))
+    sample = SLD("Si", rho=2.07)(0, 3) | SLD("Ni", rho=9.4)(100, 5) | SLD("Cu", rho=6.5)(50, 5) | SLD("air", rho=0)
+    sample["Ni"].thickness.range(80, 120)
+    sample["Ni"].interface.range(1, 10)
+    sample["Cu"].thickness.range(30, 70)
+    return FitProblem(Experiment(probe=probe, sample=sample))
+
+
+def test_calc_errors_parallel():
+    problem = _problem()
+    rng = np.random.default_rng(1)
+    lo, hi = problem.bounds()
+    points = rng.uniform(lo, hi, (21, len(lo)))
+    calls = []
+    serial = calc_errors(problem, points)
+    parallel = calc_errors(_problem(), points, workers=2, progress=lambda done, total: calls.append((done, total)))
+
+    assert calls[-1] == (22, 22)
+    profiles, slabs, Q, residuals = serial
+    models = list(profiles)
+    for model_s, model_p in zip(models, parallel[0]):
+        assert len(profiles[model_s]) == 22
+        for a, b in zip(profiles[model_s], parallel[0][model_p]):
+            for x, y in zip(a, b):
+                assert np.allclose(x, y)
+        assert np.allclose(slabs[model_s], parallel[1][model_p])
+        assert np.allclose(Q[model_s], parallel[2][model_p])
+        assert residuals[model_s].shape == (50, 22)
+        assert np.allclose(residuals[model_s], parallel[3][model_p])
+
+
+def test_worker_pool():
+    # one pool evaluates points for several problems
+    problem = _problem()
+    other = _problem()
+    lo, hi = problem.bounds()
+    other.setp((lo + hi) / 2)
+    points = np.random.default_rng(6).uniform(lo, hi, (9, len(lo)))
+    pool = WorkerPool(2)
+    try:
+        for p in (problem, other, problem):
+            pooled = calc_errors(p, points, workers=pool)
+            serial = calc_errors(p, points)
+            executor = pool.executor()
+            assert np.allclose(list(serial[3].values())[0], list(pooled[3].values())[0])
+        assert pool.executor() is executor
+    finally:
+        pool.shutdown()
+
+
+def test_worker_failure(monkeypatch):
+    # points are evaluated in this process if the workers cannot start
+    import multiprocessing
+    import warnings
+
+    def fail(*args, **kw):
+        raise OSError("no processes here")
+
+    class BrokenPool(WorkerPool):
+        def executor(self):
+            from concurrent.futures.process import BrokenProcessPool
+
+            raise BrokenProcessPool("a worker died")
+
+    monkeypatch.setattr(multiprocessing, "get_context", fail)
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(7).uniform(lo, hi, (9, len(lo)))
+    serial = calc_errors(_problem(), points)
+    for workers in (2, WorkerPool(2), BrokenPool(2)):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = calc_errors(_problem(), points, workers=workers)
+        assert any("worker processes failed" in str(w.message) for w in caught)
+        assert np.allclose(list(serial[3].values())[0], list(result[3].values())[0])
+
+
+def test_worker_backend():
+    # spawned workers use the backend chosen at runtime in the parent
+    import pickle
+
+    import refl1d
+    from refl1d import backends
+    from refl1d.uncertainty import _init_worker
+
+    previous = refl1d.BACKEND_NAME
+    try:
+        _init_worker(pickle.dumps(None), "numpy")
+        assert backends.backend.__name__ == backends.BACKEND_MODULE_NAMES["numpy"]
+    finally:
+        refl1d.use(previous)
+
+
+def test_quantile_accumulator():
+    rng = np.random.default_rng(2)
+    y = np.cumsum(rng.normal(size=(500, 80)), axis=1)
+    accumulator = QuantileAccumulator(y.shape[1], y.min(), y.max())
+    for row in y:
+        accumulator.add(row)
+    contours = (68, 95, 100)
+    p, q = form_quantiles(y, contours)
+    p_est, q_est = accumulator.quantiles(contours)
+    assert np.allclose(p_est, p)
+    assert q_est.shape == q.shape
+    assert np.all(np.abs(q_est - q) <= accumulator.width)
+    # The extremes are exact.
+    assert np.allclose(q_est[0], [y.min(axis=0), y.max(axis=0)])
+
+
+def test_quantile_accumulator_percentile():
+    rng = np.random.default_rng(7)
+    y = rng.lognormal(size=(5000, 30))
+    accumulator = QuantileAccumulator(y.shape[1], y.min(), y.max())
+    for row in y:
+        accumulator.add(row)
+    # Plotting positions alphap = betap = 1 give the numpy linear quantiles.
+    for prob in (0.025, 0.16, 0.5, 0.84, 0.975):
+        expected = np.percentile(y, 100 * prob, axis=0)
+        assert np.all(np.abs(accumulator.quantile(prob, alphap=1, betap=1) - expected) <= accumulator.width)
+
+
+def test_profile_quantiles():
+    zp = np.linspace(0, 10, 25)
+    rng = np.random.default_rng(8)
+    group = [(np.linspace(0, 10, 40), rng.normal(size=40)) for _ in range(50)]
+    # Small sets use exact quantiles.
+    fp = np.vstack([np.interp(zp, L[0], L[1]) for L in group])
+    best, q, qval = _profile_quantiles(group, 1, zp, CONTOURS)
+    assert np.array_equal(best, fp[0])
+    p, expected = form_quantiles(fp, CONTOURS)
+    assert np.array_equal(q, p)
+    assert np.array_equal(qval, expected)
+
+
+def test_align_profiles():
+    # Step profiles shifted by whole steps and cut to different lengths.
+    dz, shifts = 0.5, [0, 7, -12, 30]
+    profiles, slabs = [], []
+    for k, shift in enumerate(shifts):
+        z = np.arange(-50 - 10 * k, 150 + 5 * k) * dz
+        rho = np.where(z < 20 + shift * dz, 2.07, 0.0) + np.where(np.abs(z - 40 - shift * dz) < 10, 4.0, 0.0)
+        profiles.append((z, rho, 0 * rho))
+        slabs.append(np.array([15.0 + k, 20.0]))
+    aligned = _align_profile_set(profiles, slabs, "auto")
+    for k, ((z, _, _), shift) in enumerate(zip(aligned, shifts)):
+        assert np.isclose(z[0], (-50 - 10 * k - shift) * dz)
+    aligned = _align_profile_set(profiles, slabs, 1.5)
+    for (z, _, _), (z0, _, _), t in zip(aligned, profiles, slabs):
+        assert np.allclose(z - z0, (slabs[0][0] + 10.0) - (t[0] + 10.0))
+
+
+def test_save_errors(tmp_path):
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(3).uniform(lo, hi, (4, len(lo)))
+    errors = calc_errors(problem, points)
+    save_errors(errors, tmp_path / "errors.npz")
+    loaded = load_errors(tmp_path / "errors.npz")
+    for original, restored in zip(errors, loaded):
+        assert [m.name for m in original] == [m.name for m in restored]
+        for a, b in zip(original.values(), restored.values()):
+            if isinstance(a, list):
+                for x, y in zip(a, b):
+                    assert np.array_equal(np.vstack(x), np.vstack(y))
+            else:
+                assert np.array_equal(a, b)
+
+
+def test_uncertainty_cache(tmp_path, monkeypatch):
+    from refl1d.webview.server import uncertainty_cache
+
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(4).uniform(lo, hi, (30, len(lo)))
+
+    class State:
+        def sample(self, portion=1.0):
+            return points, None
+
+    first = uncertainty_cache.get_errors(problem, State(), nshown=10, random=True, directory=tmp_path)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    def fail(*args, **kw):
+        raise AssertionError("samples should be loaded from the cache")
+
+    monkeypatch.setattr(uncertainty_cache, "calc_errors", fail)
+    second = uncertainty_cache.get_errors(problem, State(), nshown=10, random=True, directory=tmp_path)
+    assert np.array_equal(list(first[3].values())[0], list(second[3].values())[0])
+
+
+def test_uncertainty_cache_workers(tmp_path, monkeypatch):
+    # the server evaluates in process unless workers are requested, and
+    # falls back to that if they cannot be started
+    import multiprocessing
+    import warnings
+
+    from refl1d.webview.server import uncertainty_cache
+
+    monkeypatch.delenv("REFL1D_UNCERTAINTY_WORKERS", raising=False)
+    assert uncertainty_cache.worker_pool() == 1
+    monkeypatch.setenv("REFL1D_UNCERTAINTY_WORKERS", "2")
+    pool = uncertainty_cache.worker_pool()
+    assert isinstance(pool, WorkerPool) and pool.workers == 2
+    assert uncertainty_cache.worker_pool() is pool
+
+    def fail(*args, **kw):
+        raise OSError("no processes here")
+
+    monkeypatch.setattr(multiprocessing, "get_context", fail)
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(8).uniform(lo, hi, (30, len(lo)))
+
+    class State:
+        def sample(self, portion=1.0):
+            return points, None
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        errors = uncertainty_cache.get_errors(problem, State(), nshown=10, random=False, directory=tmp_path)
+    assert any("worker processes failed" in str(w.message) for w in caught)
+    expected = calc_errors(_problem(), points[uncertainty_cache.sample_indices(30, 10, False, 0)])
+    assert np.allclose(list(errors[3].values())[0], list(expected[3].values())[0])
+
+
+def test_uncertainty_bands():
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(5).uniform(lo, hi, (40, len(lo)))
+    bands = UncertaintyBands(problem, npoints=100)
+    bands.update(points[:15])
+    bands.update(points[15:])
+    assert bands.count == 41
+    assert np.array_equal(problem.getp(), bands.best)
+
+    # Compare with the bands from all the samples at once.
+    profiles, slabs, Q, residuals = calc_errors(_problem(), points)
+    model = list(profiles)[0]
+    aligned = align_profiles(profiles, slabs, "auto")[model]
+    ((z, columns),) = bands.profile_quantiles().values()
+    for index, (best, q) in enumerate(columns, 1):
+        expected_best, accumulator = _accumulate_profiles(aligned, index, z)
+        assert np.allclose(best, expected_best)
+        assert np.all(np.abs(q - accumulator.quantiles(CONTOURS)[1]) <= 2 * accumulator.width + 1e-12)
+    ((Q_bands, best, q),) = bands.residual_quantiles().values()
+    assert np.array_equal(Q_bands, Q[model])
+    assert np.array_equal(best, residuals[model][:, 0])
+    width = np.ptp(residuals[model]) * (1 + 2 * bands.margin) / QUANTILE_BINS
+    assert np.all(np.abs(q - form_quantiles(residuals[model].T, CONTOURS)[1]) <= 2 * width)
+
+
+def test_calc_errors_bands(tmp_path):
+    problem = _problem()
+    lo, hi = problem.bounds()
+    points = np.random.default_rng(9).uniform(lo, hi, (30, len(lo)))
+    calls = []
+    bands = UncertaintyBands(problem, npoints=100, nstart=10)
+    result = calc_errors(problem, points, progress=lambda done, total: calls.append((done, total)), bands=bands)
+    assert result is bands
+    assert bands.count == 31
+    assert calls[-1] == (31, 31)
+    assert np.array_equal(problem.getp(), bands.best)
+
+    # The bands match the exact quantiles of the stored samples.
+    profiles, slabs, Q, residuals = calc_errors(_problem(), points)
+    model = list(profiles)[0]
+    ((Q_bands, best, q),) = bands.residual_quantiles().values()
+    assert np.array_equal(best, residuals[model][:, 0])
+    width = 2 * np.ptp(residuals[model]) * (1 + 2 * bands.margin) / QUANTILE_BINS
+    assert np.all(np.abs(q - form_quantiles(residuals[model].T, CONTOURS)[1]) <= 2 * width)
+
+    # The bands can be saved in place of the errors.
+    show_errors(bands, plots=0, save=str(tmp_path / "model"))
+    data = np.loadtxt(tmp_path / "model_rho_contour1.dat")
+    assert data.shape == (100, 2 + 2 * len(CONTOURS))
+    assert np.allclose(data[:, 0], list(bands.profile_quantiles().values())[0][0])
+    assert (tmp_path / "model_resid_contour1.dat").exists()
@@ -222,5 +222,228 @@ class ExperimentNonMagSimulateTest(unittest.TestCase):
         self.assertAlmostEqual(ratio_f, 0.11)
 
 
+class ExperimentBatchTest(unittest.TestCase):
+    """Test population evaluation"""
+
+    def setUp(self):
+        q_values = np.logspace(-2.1, -0.6, 100)
+        probe = NeutronProbe(T=q_values, dT=0.01, L=4.75, dL=0.0475)
+        sample = (
+            Slab(material=SLD(name="Si", rho=2.07, irho=0.0))
+            | Slab(material=SLD(name="Cu", rho=6.5, irho=0.0), thickness=130, interface=15)
+            | Slab(material=SLD(name="air", rho=0, irho=0.0))
+        )
+        sample["Cu"].thickness.range(90.0, 200.0)
+        sample["Cu"].interface.range(0.0, 20.0)
+        probe.intensity.range(0.9, 1.1)
+        self.expt = Experiment(probe=probe, sample=sample)
+        self.expt.simulate_data(noise=2.0)
+
+    def test_nllf_batch(self):
+        """Batch evaluation matches evaluating the points one at a time"""
+        pars = [self.expt.sample["Cu"].thickness, self.expt.sample["Cu"].interface, self.expt.probe.intensity]
+        points = np.array([[100.0, 5.0, 1.0], [150.0, 10.0, 0.95], [180.0, 0.0, 1.05]])
+        start = [p.value for p in pars]
+
+        nllf = self.expt.nllf_batch(points, pars)
+        self.assertEqual([p.value for p in pars], start)
+
+        for k, point in enumerate(points):
+            for p, v in zip(pars, point):
+                p.value = v
+            self.expt.update()
+            self.assertAlmostEqual(nllf[k], self.expt.nllf(), places=8)
+
+    def test_partial_update(self):
+        """Single parameter steps reuse the partial products from the base point"""
+        sample = self.expt.sample
+        pars = [sample["Cu"].thickness, sample["Cu"].interface, sample["Cu"].material.rho]
+        sample = sample[:2] | [Slab(SLD(rho=k % 3, irho=0.01), thickness=20, interface=2) for k in range(8)] | sample[2]
+        expt = Experiment(probe=self.expt.probe, sample=sample)
+        expt.partial_cache = True
+        reference = Experiment(probe=self.expt.probe, sample=sample)
+        base = [p.value for p in pars]
+        try:
+            for k, p in enumerate([None] + pars):
+                if p is not None:
+                    p.value = base[k - 1] * 1.01 + 0.1
+                for model in (expt, reference):
+                    model.update()
+                np.testing.assert_allclose(expt.reflectivity(), reference.reflectivity(), rtol=1e-10)
+                if p is not None:
+                    p.value = base[k - 1]
+        finally:
+            for p, v in zip(pars, base):
+                p.value = v
+        from refl1d.backends import backend
+
+        if hasattr(backend, "reflectivity_amplitude_cache"):
+            self.assertIsNotNone(expt._partial)
+        self.assertIsNone(reference._partial)
+
+    def test_partial_update_moving(self):
+        """Partial products follow the base point over several jacobians"""
+        import pickle
+        from unittest import mock
+
+        import refl1d.experiment
+
+        sample = self.expt.sample
+        pars = [sample["Cu"].thickness, sample["Cu"].interface, sample["Cu"].material.rho]
+        top = Slab(SLD(rho=1.0, irho=0.01), thickness=20, interface=2)
+        sample = sample[:2] | [Slab(SLD(rho=k % 3, irho=0.01), thickness=20, interface=2) for k in range(7)]
+        sample = sample | top | self.expt.sample[2]
+        # Moving these changes slabs at both ends, so the products must be rebuilt.
+        moves = [self.expt.sample["Si"].material.rho, top.thickness]
+        expt = Experiment(probe=self.expt.probe, sample=sample)
+        expt.partial_cache = True
+        reference = Experiment(probe=self.expt.probe, sample=sample)
+        start = [p.value for p in pars + moves]
+        update = mock.Mock(wraps=refl1d.experiment.reflamp_update)
+        try:
+            with mock.patch.object(refl1d.experiment, "reflamp_update", update):
+                for step in range(3):
+                    for p, v in zip(moves, start[len(pars) :]):
+                        p.value = v * (1 + 0.1 * step)
+                    update.reset_mock()
+                    for k, p in enumerate([None] + pars):
+                        if p is not None:
+                            p.value = start[k - 1] * 1.01 + 0.1
+                        for model in (expt, reference):
+                            model.update()
+                        np.testing.assert_allclose(expt.reflectivity(), reference.reflectivity(), rtol=1e-10)
+                        if p is not None:
+                            p.value = start[k - 1]
+                    if expt._partial is not None:
+                        # Each step of the jacobian used the partial products.
+                        self.assertEqual(update.call_count, len(pars))
+        finally:
+            for p, v in zip(pars + moves, start):
+                p.value = v
+        from refl1d.backends import backend
+
+        if hasattr(backend, "reflectivity_amplitude_cache"):
+            self.assertIsNotNone(expt._partial)
+        self.assertIsNone(reference._partial)
+        # The products are not sent to the worker processes.
+        copy = pickle.loads(pickle.dumps(expt))
+        self.assertIsNone(copy._partial)
+        self.assertIsNone(copy._last_slabs)
+
+    def test_residuals_jacobian(self):
+        """Forward difference jacobian from the linearized reflectivity matches central differences"""
+        sample = self.expt.sample
+        self.expt.probe.background.range(0.0, 1e-5)
+        pars = [sample["Cu"].thickness, sample["Cu"].interface, sample["Cu"].material.rho, sample["Si"].material.rho]
+        pars += [self.expt.probe.intensity, self.expt.probe.background]
+        start = [p.value for p in pars]
+        J = self.expt.residuals_jacobian(pars)
+        self.assertEqual(J.shape, (len(self.expt.residuals()), len(pars)))
+        self.assertEqual([p.value for p in pars], start)
+        for j, p in enumerate(pars):
+            h = 1e-5 * max(abs(start[j]), 1e-3)
+            resid = []
+            for v in (start[j] + h, start[j] - h):
+                p.value = v
+                self.expt.update()
+                resid.append(self.expt.residuals())
+            p.value = start[j]
+            self.expt.update()
+            expected = (resid[0] - resid[1]) / (2 * h)
+            np.testing.assert_allclose(J[:, j], expected, rtol=1e-5, atol=1e-5 * abs(expected).max())
+
+
+class DistributionExperimentTest(unittest.TestCase):
+    """Test evaluation over the distribution bins"""
+
+    def check(self, sample, P, edges):
+        from scipy.stats import norm
+
+        from refl1d.dist import DistributionExperiment, Weights
+
+        probe = NeutronProbe(T=np.linspace(0.1, 3.0, 150), dT=0.01, L=4.75, dL=0.0475)
+        dist = Weights(edges=edges, cdf=norm.cdf, loc=edges.mean(), scale=0.2 * np.ptp(edges))
+        for coherent in (False, True):
+            batch = DistributionExperiment(
+                Experiment(probe=probe, sample=sample), P=P, distribution=dist, coherent=coherent
+            )
+            loop = DistributionExperiment(
+                Experiment(probe=probe, sample=sample), P=P, distribution=dist, coherent=coherent
+            )
+            loop.batch = False
+            Q, R = batch.reflectivity()
+            Qloop, Rloop = loop.reflectivity()
+            np.testing.assert_array_equal(Q, Qloop)
+            np.testing.assert_allclose(R, Rloop, rtol=1e-10, atol=1e-14)
+
+    def test_thickness(self):
+        """Partial products shared across the bins match the loop over bins"""
+        sample = SLD(name="Si", rho=2.07)(0, 5) | SLD(name="Cu", rho=6.5)(130, 15) | SLD(name="air", rho=0)
+        self.check(sample, sample["Cu"].thickness, np.linspace(100, 160, 31))
+
+    def test_padded_batch(self):
+        """Batch kernel over the bins matches the loop over bins"""
+        Cu = SLD(name="Cu", rho=6.5, irho=0.01)
+        sample = SLD(name="Si", rho=2.07)(0, 5) | Cu(50, 5) | SLD(name="Ni", rho=9.4)(40, 5) | Cu(30, 5) | SLD(rho=0)
+        self.check(sample, Cu.rho, np.linspace(5.5, 7.5, 21))
+
+    def test_single_bin(self):
+        """A distribution with one nonzero bin matches the loop"""
+        sample = SLD(name="Si", rho=2.07)(0, 5) | SLD(name="Cu", rho=6.5)(130, 15) | SLD(name="air", rho=0)
+        self.check(sample, sample["Cu"].thickness, np.array([125.0, 135.0]))
+
+    def test_film_thickness(self):
+        """The film thickness is the largest over the distribution"""
+        from scipy.stats import norm
+
+        from refl1d.dist import DistributionExperiment, Weights
+
+        sample = SLD(name="Si", rho=2.07)(0, 5) | SLD(name="Cu", rho=6.5)(130, 15) | SLD(name="air", rho=0)
+        probe = NeutronProbe(T=np.linspace(0.1, 3.0, 150), dT=0.01, L=4.75, dL=0.0475)
+        edges = np.linspace(100, 160, 31)
+        dist = Weights(edges=edges, cdf=norm.cdf, loc=130, scale=10)
+        M = DistributionExperiment(Experiment(probe=probe, sample=sample), P=sample["Cu"].thickness, distribution=dist)
+        self.assertAlmostEqual(M.film_thickness(), max(x for x, w in dist if w > 0))
+        M.adaptive_oversample()
+        self.assertEqual(probe.oversampling_thickness, M.film_thickness())
+
+
+class MixedExperimentTest(unittest.TestCase):
+    """Test evaluation of the mixture parts together"""
+
+    def check(self, samples):
+        from refl1d.names import MixedExperiment
+
+        probe = NeutronProbe(T=np.linspace(0.1, 3.0, 150), dT=0.01, L=4.75, dL=0.0475)
+        ratio = [3.0, 2.0, 1.0][: len(samples)]
+        for coherent in (False, True):
+            mixture = MixedExperiment(samples=samples, ratio=ratio, probe=probe, coherent=coherent)
+            Q, R = mixture.reflectivity()
+            r = [Experiment(sample=s, probe=probe)._reflamp()[1] for s in samples]
+            for p, r_p in zip(mixture.parts, r):
+                np.testing.assert_allclose(p._reflamp()[1], r_p, rtol=1e-10, atol=1e-14)
+            if coherent:
+                calc_R = abs(sum(w * r_p for w, r_p in zip(ratio, r)) / sum(ratio)) ** 2
+            else:
+                calc_R = sum(w * abs(r_p) ** 2 for w, r_p in zip(ratio, r)) / sum(ratio)
+            expected_Q, expected_R = probe.apply_beam(probe.calc_Q, calc_R)
+            np.testing.assert_array_equal(Q, expected_Q)
+            np.testing.assert_allclose(R, expected_R, rtol=1e-10)
+
+    def test_shared_layers(self):
+        """Parts differing in one layer share the products for the others"""
+        Si, Ni, air = SLD(name="Si", rho=2.07), SLD(name="Ni", rho=9.4), SLD(name="air", rho=0)
+        cap = SLD(name="cap", rho=4.0, irho=0.01)(30, 4)
+        samples = [
+            Si(0, 5) | Ni(40, 5) | SLD(rho=rho)(t, 5) | cap | air for rho, t in [(6.5, 100), (3.0, 80), (1.0, 120)]
+        ]
+        self.check(samples)
+
+    def test_padded_parts(self):
+        """Parts with different numbers of layers are evaluated as a batch"""
+        Si, Cu, air = SLD(name="Si", rho=2.07), SLD(name="Cu", rho=6.5), SLD(name="air", rho=0)
+        self.check([Si(0, 5) | Cu(100, 5) | air, Si(0, 5) | Cu(50, 5) | SLD(rho=3.0)(20, 3) | Cu(50, 5) | air])
+
+
 if __name__ == "__main__":
     unittest.main()